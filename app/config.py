@@ -6,7 +6,6 @@ import os
 from functools import lru_cache
 from dotenv import load_dotenv
 from dataclasses import dataclass
-import torch
 
 
 @lru_cache
@@ -33,11 +32,128 @@ class LineBot:
     channel_access_token: str = os.getenv("LINE_CHANNEL_ACCESS_TOKEN")
     channel_secret: str = os.getenv("LINE_CHANNEL_SECRET")
     MAX_STORY_SIZE: int = 4     
+    # 用戶名稱快取：存活秒數、查詢失敗的快取秒數、最大筆數
+    PROFILE_CACHE_TTL: int = int(os.getenv("PROFILE_CACHE_TTL", 3600))
+    PROFILE_CACHE_NEGATIVE_TTL: int = int(os.getenv("PROFILE_CACHE_NEGATIVE_TTL", 60))
+    PROFILE_CACHE_SIZE: int = int(os.getenv("PROFILE_CACHE_SIZE", 10000))
+    # 同時處理事件的用戶數上限（同一用戶的事件永遠依序處理）
+    EVENT_CONCURRENCY: int = int(os.getenv("EVENT_CONCURRENCY", 16))
+    # 重送事件去重：webhookEventId 保留秒數、最大筆數，以及是否寫入 SQLite（重啓後仍可去重）
+    EVENT_DEDUP_TTL: int = int(os.getenv("EVENT_DEDUP_TTL", 3600))
+    EVENT_DEDUP_SIZE: int = int(os.getenv("EVENT_DEDUP_SIZE", 50000))
+    EVENT_DEDUP_PERSIST: bool = os.getenv("EVENT_DEDUP_PERSIST", "false").lower() == "true"
+    # 與用戶狀態分開的檔案，去重的批次寫入不會讓狀態寫入等待 SQLite 的寫入鎖
+    EVENT_DEDUP_DB_PATH: str = os.getenv("EVENT_DEDUP_DB_PATH", "app/data/webhook_events.db")
 
 class HuggingFace:
     access_token: str = os.getenv("HUGGINGFACE_ACCESS_TOKEN")
-    model_device: str = torch.cuda.get_device_name() if torch.cuda.is_available() else "cpu"
-    pytorch_version: str = torch.__version__
+
+    # import torch 需要數秒，只在真正需要時才讀取
+    @staticmethod
+    def model_device() -> str:
+        import torch
+        return torch.cuda.get_device_name() if torch.cuda.is_available() else "cpu"
+
+    @staticmethod
+    def pytorch_version() -> str:
+        import torch
+        return torch.__version__
+
+
+class UserState:
+    # 用戶狀態儲存方式：sqlite 或 memory
+    backend: str = os.getenv("STATE_STORE", "sqlite")
+    db_path: str = os.getenv("STATE_DB_PATH", "app/data/user_states.db")
+
+
+def _per_worker(total: int, workers: int) -> int:
+    return max(1, -(-total // workers))
+
+
+class Admission:
+    # 各階段（caption、story、audio）同時執行的任務數、排隊上限，以及排隊超過幾秒即放棄
+    # 排隊已滿時直接回覆「忙碌中」，不更新用戶狀態
+    # 數量以整個部署計算：每個 uvicorn worker 各有一份佇列，依 WEB_CONCURRENCY（uvicorn --workers 的預設值）平均分配，
+    # 每個 worker 至少 1；remote 模式下所有 worker 共用同一個推理行程，不平分會讓 GPU 上的任務數變成 N 倍
+    workers: int = max(1, int(os.getenv("WEB_CONCURRENCY", 1)))
+    caption_concurrency: int = _per_worker(int(os.getenv("CAPTION_CONCURRENCY", 2)), workers)
+    caption_queue_size: int = _per_worker(int(os.getenv("CAPTION_QUEUE_SIZE", 16)), workers)
+    caption_deadline: float = float(os.getenv("CAPTION_DEADLINE", 60))
+    # 預設與 continuous batching 的批次大小相同，多出來的故事只會在推理行程中排隊
+    story_concurrency: int = _per_worker(int(os.getenv("STORY_CONCURRENCY", os.getenv("LLM_MAX_BATCH_SIZE", 4))), workers)
+    story_queue_size: int = _per_worker(int(os.getenv("STORY_QUEUE_SIZE", 16)), workers)
+    story_deadline: float = float(os.getenv("STORY_DEADLINE", 120))
+    audio_concurrency: int = _per_worker(int(os.getenv("AUDIO_CONCURRENCY", 1)), workers)
+    audio_queue_size: int = _per_worker(int(os.getenv("AUDIO_QUEUE_SIZE", 8)), workers)
+    audio_deadline: float = float(os.getenv("AUDIO_DEADLINE", 300))
+
+
+class Monitor:
+    # 系統資源取樣間隔（秒）及保留的樣本數
+    sample_interval: float = float(os.getenv("METRICS_SAMPLE_INTERVAL", 5))
+    history_size: int = int(os.getenv("METRICS_HISTORY_SIZE", 720))
+
+
+class Warmup:
+    # 啟動時預先載入並試跑的階段（caption、translate、generate、tts，逗號分隔），空字串表示不預熱
+    stages: list[str] = [stage.strip() for stage in os.getenv("WARMUP_STAGES", "caption,translate,generate,tts").split(",") if stage.strip()]
+
+
+class TextToSpeech:
+    # 語音快取的模型版本（更新模型時修改，舊快取即失效）及容量上限（MB，0 表示不限制）
+    model_version: str = os.getenv("TTS_MODEL_VERSION", "MeloTTS-ZH")
+    audio_cache_max_mb: int = int(os.getenv("AUDIO_CACHE_MAX_MB", 2048))
+
+
+class ImageCaption:
+    # 圖片描述微批次：最多等待幾毫秒、一批最多幾張圖片
+    batch_window_ms: float = float(os.getenv("CAPTION_BATCH_WINDOW_MS", 50))
+    batch_max_size: int = int(os.getenv("CAPTION_BATCH_MAX_SIZE", 8))
+    # 圖片描述快取：最多保留幾張照片、dHash 漢明距離在多少以內視爲同一張照片
+    cache_max_entries: int = int(os.getenv("CAPTION_CACHE_MAX_ENTRIES", 100000))
+    cache_max_distance: int = int(os.getenv("CAPTION_CACHE_MAX_DISTANCE", 4))
+    # 解碼時短邊至少保留的像素（BLIP 輸入爲 384），以及是否把原圖存到 app/downloads
+    decode_size: int = int(os.getenv("CAPTION_DECODE_SIZE", 384))
+    save_uploads: bool = os.getenv("SAVE_UPLOADED_IMAGES", "false").lower() == "true"
+
+
+class Translation:
+    # 翻譯模型的裝置（未設定時有 GPU 用 cuda，否則用 cpu）、LRU 快取句數及每批句數
+    device: str = os.getenv("TRANSLATOR_DEVICE") or None
+    memo_size: int = int(os.getenv("TRANSLATION_MEMO_SIZE", 1024))
+    batch_size: int = int(os.getenv("TRANSLATION_BATCH_SIZE", 16))
+
+
+class TextGeneration:
+    # 故事生成共同 prompt 前綴的 KV cache 條目數（0 表示不快取）及總大小上限（MB）
+    prefix_cache_size: int = int(os.getenv("PREFIX_CACHE_SIZE", 8))
+    prefix_cache_max_mb: int = int(os.getenv("PREFIX_CACHE_MAX_MB", 1024))
+    # 延伸故事時保留的 KV 總大小上限（MB，0 表示不保留），以及每次 prompt 的 token 上限
+    session_max_mb: int = int(os.getenv("STORY_SESSION_MAX_MB", 2048))
+    session_token_budget: int = int(os.getenv("STORY_SESSION_TOKEN_BUDGET", 3072))
+    # 同時 decode 的故事數上限（continuous batching），1 即逐一生成
+    max_batch_size: int = int(os.getenv("LLM_MAX_BATCH_SIZE", 4))
+    # 等待單一生成請求完成的最長秒數（0 表示不限制），逾時後該序列在下一個 token 邊界移出批次
+    generate_timeout: float = float(os.getenv("LLM_GENERATE_TIMEOUT", 300))
+
+
+class ModelPool:
+    # 常駐模型的記憶體預算（MB），0 表示不限制；VRAM 未設定時預設為顯卡總量的 90%，再扣掉故事生成保留的 KV
+    ram_budget_mb: int = int(os.getenv("MODEL_RAM_BUDGET_MB", 0))
+    vram_budget_mb: int = int(os.getenv("MODEL_VRAM_BUDGET_MB", 0))
+
+
+class Inference:
+    # local：模型在 web 行程中執行；remote：交給獨立的推理行程（python -m app.models.inference_server）
+    mode: str = os.getenv("INFERENCE_MODE", "local")
+    # 預設爲 unix socket 路徑（只有同一用戶可連線）；"host:port" 爲 TCP，只應綁定 127.0.0.1
+    address: str = os.getenv("INFERENCE_ADDRESS", "app/data/inference.sock")
+    # 推理行程會 unpickle 收到的請求，必須設定不公開的隨機金鑰（至少 16 bytes），沒有預設值
+    authkey: bytes = os.getenv("INFERENCE_AUTHKEY", "").encode()
+    # 每個 web worker 保留的閒置連線數
+    pool_size: int = int(os.getenv("INFERENCE_POOL_SIZE", 4))
+    # 超過此大小（bytes）的圖片、PCM 等緩衝區改以 shared memory 傳遞
+    shm_min_bytes: int = int(os.getenv("INFERENCE_SHM_MIN_BYTES", 65536))
 
 
 @dataclass
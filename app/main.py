@@ -1,19 +1,35 @@
-import torch
 from contextlib import asynccontextmanager
-from fastapi import FastAPI
+from fastapi import FastAPI, Response
 from app.routes.line_webhook import line_router
-from app.config import get_config
-from app.resource_monitor import system_monitoring_middleware
+from app.config import Inference, get_config
+from app.resource_monitor import system_monitoring_middleware, system_sampler, route_latency_snapshot
 from app.utils.logger import system_logger
+from app.models.caption_cache import caption_cache
+from app.models.singletons import audio_cache_stats, image2text, loaded_models, mandrine_llm, model_pool_stats, translator
+from app.services.admission import admission
+from app.services.warmup import warmup
+from app.services.linebot.event_services import async_handler
+from app.services.linebot.msg_services import AudioGeneratingPeriod
+from app.utils.state_store import async_state_store
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # 啟動時執行
     system_logger.info("Application is starting up")
+    await system_sampler.start()
+    await admission.start()
+    # 背景預熱模型，完成前 /readyz 回傳 503
+    await warmup.start()
     
     # 釋放資源時執行
     yield
     
+    await warmup.stop()
+    await async_handler.dispatcher.drain()
+    await async_handler.deduplicator.flush()
+    await admission.stop()
+    await async_state_store.flush()
+    await system_sampler.stop()
     system_logger.info("Application is shutting down")
 
 app = FastAPI(
@@ -29,6 +45,20 @@ def read_root():
     return {"message": "Hello, World!"}
 
 
+@app.get("/healthz")
+def healthz():
+    """行程存活即回傳 200，不代表模型已可用"""
+    return {"status": "ok"}
+
+
+@app.get("/readyz")
+def readyz(response: Response):
+    """預熱結束前回傳 503，附上各階段的狀態及耗時"""
+    if not warmup.ready:
+        response.status_code = 503
+    return warmup.stats()
+
+
 @app.get("/info")
 def get_environment():
     config = get_config()
@@ -39,3 +69,68 @@ def get_environment():
         "host": config.env_config.host,
         "reload": config.env_config.reload,
     }
+
+
+@app.get("/models")
+def get_model_stats():
+    """常駐模型池的命中、未命中、淘汰次數及記憶體佔用，以及各模型物件是否已建構"""
+    return {**model_pool_stats(), "constructed": loaded_models()}
+
+
+@app.get("/jobs")
+def get_job_stats():
+    """各階段（caption、story、audio）的佇列長度、拒絕及逾時數、等待時間及執行時間，用於調整並行上限"""
+    return admission.stats()
+
+
+@app.get("/events")
+def get_event_stats():
+    """事件派送狀態，包含各用戶尚未處理的事件數、重送事件的去重計數，以及用戶狀態的背景寫入"""
+    return {
+        **async_handler.dispatcher.stats(),
+        "dedup": async_handler.deduplicator.stats(),
+        "state_writes": async_state_store.stats(),
+    }
+
+
+def _model_metrics() -> dict:
+    """只回報已建構的模型，監控端點不應觸發模型模組的 import"""
+    metrics = {}
+    if Inference.mode == "remote":
+        from app.models.inference_server import inference_client
+        metrics["inference_server"] = inference_client.call("server", "stats")
+    if image2text.is_loaded():
+        metrics["caption_batch"] = image2text.batcher.stats()
+    if translator.is_loaded():
+        metrics["translation"] = translator.stats()
+    if mandrine_llm.is_loaded():
+        metrics.update({
+            "text_generation": mandrine_llm.stats(),
+            "llm_scheduler": mandrine_llm.scheduler.stats(),
+            "prefix_cache": mandrine_llm.prefix_cache.stats(),
+            "story_sessions": mandrine_llm.sessions.stats(),
+        })
+    return metrics
+
+
+@app.get("/metrics")
+def get_metrics(samples: int = 60):
+    """最近的系統資源樣本、各路由耗時百分位數，以及模型、任務、事件的統計"""
+    return {
+        "system": {
+            "latest": system_sampler.latest(),
+            "history": system_sampler.history(samples),
+        },
+        "routes": route_latency_snapshot(),
+        "models": model_pool_stats(),
+        "audio_cache": audio_cache_stats(),
+        "audio": {
+            "time_to_first_audio": AudioGeneratingPeriod.time_to_first_audio.snapshot(),
+            "total_time": AudioGeneratingPeriod.total_audio_time.snapshot(),
+        },
+        "caption_cache": caption_cache.stats(),
+        **_model_metrics(),
+        "warmup": warmup.stats(),
+        "jobs": admission.stats(),
+        "events": {**async_handler.dispatcher.stats(), "dedup": async_handler.deduplicator.stats()},
+    }
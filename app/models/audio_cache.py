@@ -0,0 +1,124 @@
+"""
+內容定址的語音快取
+
+以 (文字, 語者, 語速, 模型版本) 的 hash 作爲檔名，相同內容直接回傳已編碼的 m4a，
+不需要再跑 MeloTTS 及 ffmpeg。檔名同時記錄時長：{key}_{duration_ms}.m4a，
+重啓後掃描目錄即可重建索引。超過容量上限時依最後使用時間（mtime）淘汰。
+"""
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Optional, Union
+
+from app.config import TextToSpeech
+from app.utils.logger import model_logger
+from app.utils.utils import PathTool
+
+_FILE_PATTERN = re.compile(r"^(?P<key>[0-9a-f]{32})_(?P<duration>\d+)\.m4a$")
+
+
+@dataclass
+class CachedAudio:
+    file_name: str
+    duration: int  # 毫秒
+    size: int
+
+
+class AudioCache:
+    def __init__(self, cache_dir: Union[str, Path], max_bytes: int):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[str, CachedAudio] = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.__scan()
+
+    @staticmethod
+    def make_key(text: str, speaker: str, speed: float, model_version: str) -> str:
+        content = "\x1f".join([model_version, speaker, f"{speed:.3f}", text])
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()[:32]
+
+    def get(self, key: str) -> Optional[tuple[str, int]]:
+        """命中回傳 (檔名, 毫秒時長)，並更新最後使用時間"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not (self.cache_dir / entry.file_name).exists():
+                if entry is not None:
+                    self.__remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+
+        try:
+            os.utime(self.cache_dir / entry.file_name)
+        except FileNotFoundError:
+            pass
+        return entry.file_name, entry.duration
+
+    def put(self, key: str, file_path: Union[str, Path], duration: int) -> str:
+        """把已編碼的檔案移入快取，回傳快取中的檔名"""
+        file_name = f"{key}_{duration}.m4a"
+        target = self.cache_dir / file_name
+        os.replace(file_path, target)
+        size = target.stat().st_size
+
+        with self._lock:
+            if key in self._entries:
+                self.__remove(key, delete_file=self._entries[key].file_name != file_name)
+            self._entries[key] = CachedAudio(file_name, duration, size)
+            self._total_bytes += size
+            self.__evict(keep=key)
+        return file_name
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size_mb": round(self._total_bytes / 1024**2, 1),
+                "max_mb": round(self.max_bytes / 1024**2, 1),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    def __scan(self):
+        """由目錄重建索引，依 mtime 由舊到新排序"""
+        files = []
+        for path in self.cache_dir.iterdir():
+            if match := _FILE_PATTERN.match(path.name):
+                stat = path.stat()
+                files.append((stat.st_mtime, match["key"], CachedAudio(path.name, int(match["duration"]), stat.st_size)))
+        for _, key, entry in sorted(files):
+            self._entries[key] = entry
+            self._total_bytes += entry.size
+        self.__evict()
+
+    def __remove(self, key: str, delete_file: bool = False):
+        entry = self._entries.pop(key)
+        self._total_bytes -= entry.size
+        if delete_file:
+            (self.cache_dir / entry.file_name).unlink(missing_ok=True)
+
+    def __evict(self, keep: str = None):
+        while self.max_bytes and self._total_bytes > self.max_bytes:
+            victim = next((key for key in self._entries if key != keep), None)
+            if victim is None:
+                break
+            model_logger.info(f"[AudioCache] evict {self._entries[victim].file_name}")
+            self.__remove(victim, delete_file=True)
+            self.evictions += 1
+
+
+audio_cache = AudioCache(
+    PathTool.join_path("app", "static", "audio"),
+    max_bytes=TextToSpeech.audio_cache_max_mb * 1024**2,
+)
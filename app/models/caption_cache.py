@@ -0,0 +1,132 @@
+"""
+以感知雜湊（dHash）定址的圖片描述快取
+
+用戶常重傳同一張照片，或經過重新壓縮、縮放後的同一張照片，位元組不同但 dHash 幾乎相同。
+漢明距離在 max_distance 以內視爲同一張照片，直接回傳中文描述，不需要再跑 BLIP 及翻譯模型。
+
+查詢使用 multi-index hashing：64 位元的雜湊切成 max_distance + 1 段，
+距離不超過 max_distance 的兩個雜湊至少有一段完全相同（鴿籠原理），
+因此只需比對各段 bucket 中的候選，條目數到數十萬筆仍不需要逐筆比對。
+"""
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+from PIL import Image
+
+from app.config import ImageCaption
+from app.utils.logger import model_logger
+
+HASH_BITS = 64
+
+
+def dhash(image: Image.Image, hash_size: int = 8) -> int:
+    """縮成 (hash_size+1) x hash_size 的灰階圖，比較左右相鄰像素的亮度，得到 hash_size² 位元的雜湊"""
+    small = image.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    pixels = small.tobytes()
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] < pixels[offset + col + 1])
+    return value
+
+
+@dataclass
+class CachedCaption:
+    eng_caption: str
+    cn_caption: str
+
+
+class CaptionCache:
+    """
+    - get()：回傳漢明距離最近（且不超過 max_distance）的描述
+    - put()：加入快取，超過 max_entries 時淘汰最久未使用的條目
+    """
+    def __init__(self, max_entries: int = 100_000, max_distance: int = 4):
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[int, CachedCaption] = OrderedDict()
+        self._segments = self.__make_segments(max_distance + 1)
+        self._buckets: list[dict[int, set[int]]] = [{} for _ in self._segments]
+        self._lock = threading.Lock()
+
+    def get(self, image_hash: int) -> Optional[CachedCaption]:
+        with self._lock:
+            best_hash, best_distance = None, self.max_distance + 1
+            for candidate in self.__candidates(image_hash):
+                distance = (candidate ^ image_hash).bit_count()
+                if distance < best_distance:
+                    best_hash, best_distance = candidate, distance
+                    if distance == 0:
+                        break
+
+            if best_hash is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_hash)
+            self.hits += 1
+            return self._entries[best_hash]
+
+    def put(self, image_hash: int, eng_caption: str, cn_caption: str):
+        with self._lock:
+            if image_hash in self._entries:
+                self._entries.move_to_end(image_hash)
+            else:
+                for buckets, part in zip(self._buckets, self.__split(image_hash)):
+                    buckets.setdefault(part, set()).add(image_hash)
+            self._entries[image_hash] = CachedCaption(eng_caption, cn_caption)
+
+            while self.max_entries and len(self._entries) > self.max_entries:
+                self.__remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "max_distance": self.max_distance,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+    @staticmethod
+    def __make_segments(count: int) -> list[tuple[int, int]]:
+        """把 64 位元切成 count 段，回傳各段的 (shift, mask)"""
+        count = max(1, min(count, HASH_BITS))
+        segments, shift = [], 0
+        for i in range(count):
+            width = HASH_BITS // count + (i < HASH_BITS % count)
+            segments.append((shift, (1 << width) - 1))
+            shift += width
+        return segments
+
+    def __split(self, image_hash: int) -> list[int]:
+        return [(image_hash >> shift) & mask for shift, mask in self._segments]
+
+    def __candidates(self, image_hash: int) -> set[int]:
+        candidates = set()
+        for buckets, part in zip(self._buckets, self.__split(image_hash)):
+            candidates.update(buckets.get(part, ()))
+        return candidates
+
+    def __remove(self, image_hash: int):
+        del self._entries[image_hash]
+        for buckets, part in zip(self._buckets, self.__split(image_hash)):
+            bucket = buckets[part]
+            bucket.discard(image_hash)
+            if not bucket:
+                del buckets[part]
+        model_logger.debug(f"[CaptionCache] evict {image_hash:016x}")
+
+
+caption_cache = CaptionCache(
+    max_entries=ImageCaption.cache_max_entries,
+    max_distance=ImageCaption.cache_max_distance,
+)
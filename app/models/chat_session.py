@@ -0,0 +1,135 @@
+"""
+每位用戶的增量對話狀態
+
+延伸故事時，新的 prompt 幾乎等於上一次的 prompt 加上剛生成的故事及新的指示。
+這裡保存每位用戶上一次生成結束時的 token id 及 KV cache，下一次只 prefill 與之不同的部分：
+以共同前綴長度裁切（crop）KV，再把剩下的 token 送入 generate。
+用戶修改過故事時共同前綴會變短，仍然正確；session 被淘汰時退回 PrefixKVCache 的 system prompt 前綴。
+
+每個 session 的 KV 大小與 token 數成正比（7B Llama、bf16 約 512 KB / token，3k token 約 1.5 GB），
+因此以 KV 的總 bytes 限制保留的 session，而不是用戶數。
+"""
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional, Sequence
+
+from transformers import DynamicCache
+
+from app.models.prefix_cache import PrefixKVCache, common_prefix_length, kv_bytes
+from app.utils.logger import model_logger
+from app.utils.metrics import Histogram
+
+# prefill token 數的 bucket
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096)
+
+
+@dataclass
+class ChatSession:
+    token_ids: list[int]
+    past_key_values: Any
+    nbytes: int
+
+
+class ChatSessionCache:
+    """
+    - prepare()：取出該用戶的 session 作爲 prompt 的 KV，save()：生成結束後放回
+    - drop()：故事結束時釋放該用戶的 KV
+    - stats()：session 命中率及每次 prefill 的 token 數
+
+    max_bytes: 保留的 KV 總大小上限，超過時淘汰最久未使用的 session，0 表示不保留
+    """
+    def __init__(self, prefix_cache: PrefixKVCache, max_bytes: int = 2 * 1024 ** 3):
+        self.prefix_cache = prefix_cache
+        self.max_bytes = max_bytes
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.prefill_tokens = Histogram(buckets=TOKEN_BUCKETS)
+        self.reused_tokens = Histogram(buckets=TOKEN_BUCKETS)
+        self._sessions: OrderedDict[str, ChatSession] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def prepare(self, model, key: str, input_ids: Sequence[int], prefix_len: int = 0) -> tuple[Any, int]:
+        """
+        取出該用戶的 session，裁切到與 input_ids 的共同前綴
+
+        Args:
+            key (str): session 的 key，通常是 user_id
+            prefix_len (int): 沒有 session 時，前 prefix_len 個 token 改用 PrefixKVCache
+
+        Returns:
+            (KV, KV 涵蓋的 token 數)，生成結束後須呼叫 save() 放回
+        """
+        input_ids = list(input_ids)
+        with self._lock:
+            session = self._sessions.pop(key, None)
+            if session is not None:
+                self.bytes_used -= session.nbytes
+
+        reused, past = 0, None
+        if session is not None:
+            # 至少保留一個 token 給 generate 計算下一個 token 的 logits
+            reused = min(common_prefix_length(session.token_ids, input_ids), len(input_ids) - 1)
+            if reused:
+                past = session.past_key_values
+                past.crop(reused)
+        if past is None:
+            self.misses += 1
+            past, reused = self.prefix_cache.prepare(model, input_ids, prefix_len)
+        else:
+            self.hits += 1
+
+        prefill = len(input_ids) - reused
+        self.prefill_tokens.observe(prefill)
+        self.reused_tokens.observe(reused)
+        model_logger.info(f"[ChatSessionCache] {key}: prompt {len(input_ids)} tokens, reused {reused}, prefill {prefill}")
+        return past, reused
+
+    def save(self, key: str, token_ids: list[int], past_key_values: Optional[Any]):
+        """保存生成結束時的 KV，token_ids 須與 KV 的長度一致"""
+        if not self.max_bytes or past_key_values is None:
+            return
+        if isinstance(past_key_values, tuple):
+            past_key_values = DynamicCache.from_legacy_cache(past_key_values)
+        token_ids = token_ids[:past_key_values.get_seq_length()]
+        nbytes = kv_bytes(past_key_values)
+        if nbytes > self.max_bytes:
+            model_logger.warning(f"[ChatSessionCache] session {key} KV of {nbytes / 1024 ** 2:.1f} MB exceeds the budget, not kept")
+            return
+
+        with self._lock:
+            if (previous := self._sessions.pop(key, None)) is not None:
+                self.bytes_used -= previous.nbytes
+            self._sessions[key] = ChatSession(token_ids, past_key_values, nbytes)
+            self.bytes_used += nbytes
+            while self.bytes_used > self.max_bytes:
+                evicted, session = self._sessions.popitem(last=False)
+                self.bytes_used -= session.nbytes
+                self.evictions += 1
+                model_logger.debug(f"[ChatSessionCache] evict session {evicted}")
+
+    def drop(self, key: str):
+        with self._lock:
+            if (session := self._sessions.pop(key, None)) is not None:
+                self.bytes_used -= session.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._sessions.clear()
+            self.bytes_used = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            sessions, bytes_used = len(self._sessions), self.bytes_used
+        return {
+            "sessions": sessions,
+            "kv_mb": round(bytes_used / 1024 ** 2, 1),
+            "max_kv_mb": round(self.max_bytes / 1024 ** 2, 1),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "prefill_tokens": self.prefill_tokens.snapshot(),
+            "reused_tokens": self.reused_tokens.snapshot(),
+        }
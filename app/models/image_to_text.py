@@ -1,20 +1,35 @@
-import torch
+from itertools import groupby
 from PIL import ImageFile
 from transformers import pipeline
+from app.config import ImageCaption
+from app.models.micro_batcher import MicroBatcher
+from app.models.model_registry import model_registry
 from app.models.translator import check
 from app.utils.logger import model_logger
 
 class Img2Text:
     def __init__(self):
         self.model_name = "Salesforce/blip-image-captioning-large"
+        # 同一時間窗內多位用戶的圖片合併成一批推理
+        self.batcher = MicroBatcher(
+            "image_to_text",
+            self.__caption_batch,
+            max_batch_size=ImageCaption.batch_max_size,
+            max_wait=ImageCaption.batch_window_ms / 1000,
+        )
 
     def __load_model(self):
+        # 模型常駐於 model_registry，只有第一次或被淘汰後才會重新載入
+        return model_registry.get(self.model_name, self.__build_pipeline)
+
+    def __build_pipeline(self):
         check(self.__class__.__name__, "ready to loaded")
-        self.pipeline = pipeline(
-            task="image-to-text", 
+        captioner = pipeline(
+            task="image-to-text",
             model=self.model_name
         )
         check(self.__class__.__name__, "model loaded")
+        return captioner
 
 
     def img_to_text(self, image:ImageFile, max_new_tokens=70):
@@ -24,21 +39,24 @@ class Img2Text:
         :param max_new_tokens: 生成文字的最大 token 長度。
         :return: 生成的文字描述。
         """
-        self.__load_model() 
-        result = self.pipeline(image, max_new_tokens=max_new_tokens)
-        text = result[0].get("generated_text")
-        self.__clear()
-        return text
-    
-    def __clear(self):
-        # 刪除 pipeline 和模型
-        if hasattr(self, 'pipeline') and self.pipeline is not None:
-            del self.pipeline.model  # 刪除模型
-            del self.pipeline.tokenizer  # 刪除 tokenizer
-            del self.pipeline  # 刪除 pipeline 對象
-            self.pipeline = None
-        torch.cuda.empty_cache()
-        check(self.__class__.__name__, "clear")
+        return self.batcher.submit((image, max_new_tokens)).result()
 
+    def __caption_batch(self, requests: list[tuple[ImageFile, int]]) -> list[str]:
+        """一次推理整批圖片，max_new_tokens 不同的請求分開執行"""
+        captioner = self.__load_model()
+        texts: list[str] = [None] * len(requests)
+        order = sorted(range(len(requests)), key=lambda i: requests[i][1])
+        for max_new_tokens, group in groupby(order, key=lambda i: requests[i][1]):
+            indexes = list(group)
+            images = [requests[i][0] for i in indexes]
+            results = captioner(images, max_new_tokens=max_new_tokens, batch_size=len(images))
+            for i, result in zip(indexes, results):
+                texts[i] = result[0].get("generated_text")
+        if len(requests) > 1:
+            model_logger.debug(f"[Img2Text] captioned a batch of {len(requests)} images")
+        return texts
 
-image2text = Img2Text()
+    def unload(self):
+        """從 model_registry 移除模型，釋放記憶體"""
+        model_registry.evict(self.model_name)
+        check(self.__class__.__name__, "clear")
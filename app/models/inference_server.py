@@ -0,0 +1,426 @@
+"""
+獨立推理行程
+
+uvicorn 開多個 worker 時，每個 worker 都會各自載入一份模型；推理放在 asyncio.to_thread 也會與 event loop 爭奪 GIL。
+INFERENCE_MODE=remote 時，模型只由一個推理行程持有：
+
+    python -m app.models.inference_server                       # 推理行程
+    INFERENCE_MODE=remote WEB_CONCURRENCY=4 uvicorn app.main:app    # web worker（准入控制的數量依 WEB_CONCURRENCY 平分）
+
+web worker 以 multiprocessing.connection（預設爲 unix socket）呼叫模型方法，
+圖片、PCM 等大型緩衝區放在 shared memory，連線中只傳送區塊名稱，由接收端讀取後釋放。
+推理行程中每條連線由一個執行緒處理，MicroBatcher 及 continuous batching 仍可合併不同 worker 的請求。
+語音檔直接寫入共用的 app/static/audio，只回傳檔名。
+"""
+import argparse
+import asyncio
+import os
+import pickle
+import stat
+import threading
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+from multiprocessing import resource_tracker
+from multiprocessing.connection import AuthenticationError, Client, Connection, Listener
+from multiprocessing.shared_memory import SharedMemory
+from pathlib import Path
+from typing import Any, AsyncIterator, Union
+
+from app.config import Inference
+from app.utils.logger import model_logger
+from app.utils.metrics import Histogram
+
+Address = Union[tuple[str, int], str]
+
+
+def parse_address(address: str) -> Address:
+    host, sep, port = address.rpartition(":")
+    if sep and port.isdigit():
+        return host, int(port)
+    return address
+
+
+def check_authkey(authkey: bytes):
+    """連線的另一端可讓推理行程 unpickle 任意物件，金鑰是唯一的驗證，不接受空白或過短的金鑰"""
+    if len(authkey or b"") < 16:
+        raise ValueError(
+            "INFERENCE_AUTHKEY must be a secret of at least 16 bytes, "
+            "e.g. `python -c \"import secrets; print(secrets.token_hex(32))\"`"
+        )
+
+
+# ---- shared memory ----
+
+@dataclass
+class SharedBuffer:
+    name: str
+    size: int
+
+
+@dataclass
+class SharedArray:
+    name: str
+    shape: tuple
+    dtype: str
+
+
+@dataclass
+class SharedImage:
+    name: str
+    mode: str
+    size: tuple[int, int]
+
+
+def _to_shared(data) -> str:
+    view = memoryview(data).cast("B")
+    shm = SharedMemory(create=True, size=max(view.nbytes, 1))
+    # 由接收端 unlink；傳送端不再追蹤，避免行程結束時被 resource_tracker 提前清除
+    resource_tracker.unregister(shm._name, "shared_memory")
+    shm.buf[:view.nbytes] = view
+    shm.close()
+    return shm.name
+
+
+def _from_shared(name: str, size: int = None) -> bytearray:
+    shm = SharedMemory(name=name)
+    try:
+        return bytearray(shm.buf[:size] if size is not None else shm.buf)
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def _pack(obj: Any) -> Any:
+    """大型 bytes、numpy array、PIL 圖片改放到 shared memory"""
+    if isinstance(obj, (bytes, bytearray)) and len(obj) >= Inference.shm_min_bytes:
+        return SharedBuffer(_to_shared(obj), len(obj))
+    if type(obj) in (list, tuple):
+        return type(obj)(_pack(item) for item in obj)
+    if type(obj) is dict:
+        return {key: _pack(value) for key, value in obj.items()}
+    module = type(obj).__module__
+    if module == "numpy" and getattr(obj, "ndim", 0) > 0 and obj.nbytes >= Inference.shm_min_bytes:
+        import numpy as np
+        array = np.ascontiguousarray(obj)
+        return SharedArray(_to_shared(array), array.shape, array.dtype.str)
+    if module.startswith("PIL.") and hasattr(obj, "tobytes"):
+        image = obj if obj.mode in ("RGB", "RGBA", "L") else obj.convert("RGB")
+        return SharedImage(_to_shared(image.tobytes()), image.mode, image.size)
+    return obj
+
+
+def _unpack(obj: Any) -> Any:
+    if isinstance(obj, SharedBuffer):
+        return bytes(_from_shared(obj.name, obj.size))
+    if isinstance(obj, SharedArray):
+        import numpy as np
+        return np.frombuffer(_from_shared(obj.name), dtype=obj.dtype)[:int(np.prod(obj.shape))].reshape(obj.shape)
+    if isinstance(obj, SharedImage):
+        from PIL import Image
+        return Image.frombytes(obj.mode, obj.size, bytes(_from_shared(obj.name)))
+    if type(obj) in (list, tuple):
+        return type(obj)(_unpack(item) for item in obj)
+    if type(obj) is dict:
+        return {key: _unpack(value) for key, value in obj.items()}
+    return obj
+
+
+def _discard(obj: Any):
+    """送出失敗時釋放已建立的 shared memory"""
+    if isinstance(obj, (SharedBuffer, SharedArray, SharedImage)):
+        try:
+            _from_shared(obj.name, 0)
+        except FileNotFoundError:
+            pass
+    elif type(obj) in (list, tuple):
+        for item in obj:
+            _discard(item)
+    elif type(obj) is dict:
+        for value in obj.values():
+            _discard(value)
+
+
+def _portable(error: Exception) -> Exception:
+    """無法 pickle 的例外轉成 RuntimeError 傳回"""
+    try:
+        pickle.dumps(error)
+        return error
+    except Exception:
+        return RuntimeError(f"{type(error).__name__}: {error}")
+
+
+# ---- server ----
+
+class InferenceServer:
+    """
+    持有模型的推理行程
+
+    - targets：可被呼叫的物件（預設爲 singletons 登記的模型），另有 "server" 提供 stats / loaded_models / model_pool / audio_cache
+    - 只允許呼叫公開屬性，path 可爲 "batcher.stats" 這類巢狀屬性
+    - 方法名稱以 stream_ 開頭時，結果爲 async iterator，逐段回傳 chunk 後以 end 結束
+    """
+    CONTROL_METHODS = ("stats", "loaded_models", "model_pool", "audio_cache")
+
+    def __init__(self, address: Address, authkey: bytes, targets: dict[str, Any]):
+        check_authkey(authkey)
+        self.address = address
+        self.authkey = authkey
+        self.targets = targets
+        self.connections = 0
+        self.requests = 0
+        self.errors = 0
+        self.latency: dict[str, Histogram] = defaultdict(Histogram)
+        self._lock = threading.Lock()
+
+    def serve_forever(self):
+        with self.__listen() as listener:
+            model_logger.info(f"[InferenceServer] listening on {self.address}, targets={list(self.targets)}")
+            while True:
+                try:
+                    conn = listener.accept()
+                except (OSError, EOFError, AuthenticationError) as e:
+                    model_logger.warning(f"[InferenceServer] rejected connection: {e}")
+                    continue
+                threading.Thread(target=self.__handle, args=(conn,), daemon=True).start()
+
+    def stats(self) -> dict:
+        return {
+            "connections": self.connections,
+            "requests": self.requests,
+            "errors": self.errors,
+            "latency": {path: histogram.snapshot() for path, histogram in self.latency.items()},
+        }
+
+    def loaded_models(self) -> dict[str, bool]:
+        return {name: target.is_loaded() for name, target in self.targets.items() if hasattr(target, "is_loaded")}
+
+    @staticmethod
+    def model_pool() -> dict:
+        from app.models.model_registry import model_registry
+        return model_registry.stats()
+
+    @staticmethod
+    def audio_cache() -> dict:
+        from app.models.audio_cache import audio_cache
+        return audio_cache.stats()
+
+    def __listen(self) -> Listener:
+        if not isinstance(self.address, str):
+            if self.address[0] not in ("127.0.0.1", "localhost", "::1"):
+                model_logger.warning(f"[InferenceServer] listening on non-loopback address {self.address}")
+            return Listener(self.address, authkey=self.authkey)
+
+        # unix socket：移除上次未清除的 socket 檔，建立時即限定只有本用戶可讀寫
+        path = Path(self.address)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        if path.exists() and stat.S_ISSOCK(path.stat().st_mode):
+            path.unlink()
+        umask = os.umask(0o177)
+        try:
+            return Listener(self.address, family="AF_UNIX", authkey=self.authkey)
+        finally:
+            os.umask(umask)
+
+    def __handle(self, conn: Connection):
+        with self._lock:
+            self.connections += 1
+        try:
+            with conn:
+                while True:
+                    try:
+                        target, path, args, kwargs, stream = conn.recv()
+                    except (EOFError, OSError):
+                        return
+                    start = time.perf_counter()
+                    try:
+                        reply = self.__call(conn, target, path, _unpack(args), _unpack(kwargs), stream)
+                    except Exception as e:
+                        with self._lock:
+                            self.errors += 1
+                        model_logger.exception(f"[InferenceServer] {target}.{path} failed")
+                        reply = ("error", _portable(e))
+                    with self._lock:
+                        self.requests += 1
+                    self.latency[f"{target}.{path}"].observe(time.perf_counter() - start)
+                    try:
+                        conn.send(reply)
+                    except (EOFError, OSError):
+                        _discard(reply)
+                        return
+        finally:
+            with self._lock:
+                self.connections -= 1
+
+    def __call(self, conn: Connection, target: str, path: str, args: tuple, kwargs: dict, stream: bool) -> tuple:
+        method = self.__resolve(target, path)
+        if stream:
+            asyncio.run(self.__stream(conn, method(*args, **kwargs)))
+            return ("end", None)
+        return ("ok", _pack(method(*args, **kwargs)))
+
+    def __resolve(self, target: str, path: str):
+        parts = path.split(".")
+        if target not in self.targets and target != "server":
+            raise LookupError(f"unknown target {target!r}")
+        if any(not part or part.startswith("_") for part in parts):
+            raise AttributeError(f"{path!r} is not a public attribute")
+        if target == "server":
+            if path not in self.CONTROL_METHODS:
+                raise AttributeError(f"server has no method {path!r}")
+            return getattr(self, path)
+        obj = self.targets[target]
+        for part in parts:
+            obj = getattr(obj, part)
+        if not callable(obj):
+            raise TypeError(f"{target}.{path} is not callable")
+        return obj
+
+    @staticmethod
+    async def __stream(conn: Connection, iterator: AsyncIterator):
+        # 客戶端中途離開時 send 會失敗，關閉 iterator 讓生成停止
+        try:
+            async for chunk in iterator:
+                conn.send(("chunk", _pack(chunk)))
+        finally:
+            await iterator.aclose()
+
+
+# ---- client ----
+
+class InferenceClient:
+    """
+    web worker 端的連線池
+
+    - call()：送出請求並等待結果，推理行程拋出的例外會在這裡重新拋出
+    - stream()：async iterator，逐段取得 stream_ 方法的結果
+    - 閒置的連線若已失效（推理行程重啓），送出時會改用新連線重送一次
+    """
+    def __init__(self, address: Address, authkey: bytes, pool_size: int = 4):
+        check_authkey(authkey)
+        self.address = address
+        self.authkey = authkey
+        self.pool_size = pool_size
+        self._idle: list[Connection] = []
+        self._lock = threading.Lock()
+
+    def model(self, name: str) -> "RemoteModel":
+        return RemoteModel(self, name)
+
+    def call(self, target: str, path: str, args: tuple = (), kwargs: dict = None) -> Any:
+        conn = self.__send(target, path, args, kwargs or {}, stream=False)
+        try:
+            status, value = conn.recv()
+        except BaseException:
+            conn.close()
+            raise
+        self.__release(conn)
+        return self.__result(status, value)
+
+    async def stream(self, target: str, path: str, args: tuple = (), kwargs: dict = None) -> AsyncIterator[Any]:
+        conn = await asyncio.to_thread(self.__send, target, path, args, kwargs or {}, True)
+        finished = False
+        try:
+            while True:
+                status, value = await asyncio.to_thread(conn.recv)
+                if status == "chunk":
+                    yield _unpack(value)
+                    continue
+                finished = True
+                self.__result(status, value)
+                return
+        finally:
+            # 中途離開的連線上還有未讀的 chunk，不能放回連線池
+            if finished:
+                self.__release(conn)
+            else:
+                conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+    def __send(self, target: str, path: str, args: tuple, kwargs: dict, stream: bool) -> Connection:
+        request = (target, path, _pack(args), _pack(kwargs), stream)
+        conn = self.__acquire()
+        try:
+            try:
+                conn.send(request)
+            except (EOFError, OSError):
+                conn.close()
+                conn = Client(self.address, authkey=self.authkey)
+                conn.send(request)
+        except BaseException:
+            conn.close()
+            _discard(request)
+            raise
+        return conn
+
+    def __acquire(self) -> Connection:
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return Client(self.address, authkey=self.authkey)
+
+    def __release(self, conn: Connection):
+        with self._lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    @staticmethod
+    def __result(status: str, value: Any) -> Any:
+        if status == "error":
+            raise value
+        return _unpack(value)
+
+
+class RemoteModel:
+    """推理行程中模型的代理，用法與 LazyModel 相同（image2text.batcher.stats() 亦可）"""
+    def __init__(self, client: InferenceClient, name: str, path: str = ""):
+        self._client = client
+        self._name = name
+        self._path = path
+
+    def __getattr__(self, attr: str) -> "RemoteModel":
+        if attr.startswith("_"):
+            raise AttributeError(attr)
+        return RemoteModel(self._client, self._name, f"{self._path}.{attr}" if self._path else attr)
+
+    def __call__(self, *args, **kwargs):
+        if self._path.rpartition(".")[2].startswith("stream_"):
+            return self._client.stream(self._name, self._path, args, kwargs)
+        return self._client.call(self._name, self._path, args, kwargs)
+
+    def is_loaded(self) -> bool:
+        """推理行程中是否已建構；連不上時視爲未建構"""
+        try:
+            return self._client.call(self._name, "is_loaded")
+        except (OSError, EOFError):
+            return False
+
+    def __repr__(self) -> str:
+        return f"<RemoteModel {self._name} @ {self._client.address}>"
+
+
+# 只有 remote 模式需要連線，未設定 INFERENCE_AUTHKEY 時在啟動時即失敗
+inference_client = (
+    InferenceClient(parse_address(Inference.address), Inference.authkey, Inference.pool_size)
+    if Inference.mode == "remote" else None
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the model inference server for INFERENCE_MODE=remote web workers.")
+    parser.add_argument("--address", default=Inference.address)
+    args = parser.parse_args()
+
+    from app.models.singletons import local_models
+    InferenceServer(parse_address(args.address), Inference.authkey, local_models()).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+動態微批次（micro-batching）
+
+多個用戶在短時間內送出的推理請求先排入佇列，背景執行緒最多等待 max_wait 秒
+或湊滿 max_batch_size 筆後，一次呼叫 process_batch 跑完整批，再把結果分送回各自的 Future。
+呼叫端通常已在 asyncio.to_thread 中，直接 submit(...).result() 即可。
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, Callable, Sequence
+
+from app.utils.logger import model_logger
+from app.utils.metrics import Histogram
+
+# 批次大小的 bucket
+BATCH_SIZE_BUCKETS = (1, 2, 3, 4, 6, 8, 12, 16, 24, 32)
+
+
+@dataclass
+class _Request:
+    item: Any
+    future: Future = field(default_factory=Future)
+    enqueued_at: float = field(default_factory=time.monotonic)
+
+
+class MicroBatcher:
+    """
+    - submit()：放入佇列，回傳 concurrent.futures.Future
+    - stats()：批次大小及排隊等待時間的直方圖
+
+    process_batch 接收 item 的 list，須回傳等長的結果 list；拋出例外時整批的 Future 都會收到該例外。
+    """
+    def __init__(self, name: str, process_batch: Callable[[list], Sequence], max_batch_size: int = 8, max_wait: float = 0.05):
+        self.name = name
+        self.process_batch = process_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self.batches = 0
+        self.failed = 0
+        self.batch_size = Histogram(buckets=BATCH_SIZE_BUCKETS)
+        self.queue_wait = Histogram()
+        self._queue: queue.SimpleQueue[_Request] = queue.SimpleQueue()
+        self._thread: threading.Thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, item: Any) -> Future:
+        self.__ensure_thread()
+        request = _Request(item)
+        self._queue.put(request)
+        return request.future
+
+    def stats(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": round(self.max_wait * 1000, 1),
+            "pending": self._queue.qsize(),
+            "batches": self.batches,
+            "failed": self.failed,
+            "batch_size": self.batch_size.snapshot(),
+            "queue_wait": self.queue_wait.snapshot(),
+        }
+
+    def __ensure_thread(self):
+        # 第一次使用才啟動背景執行緒
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self.__run, name=f"micro-batcher-{self.name}", daemon=True)
+                    self._thread.start()
+
+    def __collect(self) -> list[_Request]:
+        # 阻塞等到第一筆請求，之後最多再等 max_wait 秒湊滿一批
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def __run(self):
+        while True:
+            batch = self.__collect()
+            started_at = time.monotonic()
+            for request in batch:
+                self.queue_wait.observe(started_at - request.enqueued_at)
+            self.batch_size.observe(len(batch))
+            self.batches += 1
+
+            try:
+                results = self.process_batch([request.item for request in batch])
+                if len(results) != len(batch):
+                    raise RuntimeError(f"expected {len(batch)} results, got {len(results)}")
+            except Exception as e:
+                self.failed += 1
+                model_logger.exception(f"[MicroBatcher] {self.name} batch of {len(batch)} failed")
+                for request in batch:
+                    request.future.set_exception(e)
+                continue
+
+            for request, result in zip(batch, results):
+                request.future.set_result(result)
@@ -0,0 +1,249 @@
+"""
+共用模型註冊表
+
+載入後的模型常駐在記憶體中，下一次請求直接取用；只有在估算的 RAM/VRAM
+超出預算時，才會淘汰最久未使用（LRU）的模型。
+"""
+import gc
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+from app.config import ModelPool, TextGeneration
+from app.utils.logger import model_logger
+
+MB = 1024 ** 2
+
+
+@dataclass
+class ModelEntry:
+    name: str
+    model: Any
+    ram_bytes: int
+    vram_bytes: int
+    load_seconds: float
+    on_evict: Optional[Callable[[Any], None]] = None
+
+
+def _iter_modules(obj, seen: set):
+    """找出物件裏所有的 torch.nn.Module（pipeline、diffusers components、tuple 等）"""
+    import torch
+
+    if obj is None or id(obj) in seen:
+        return
+    seen.add(id(obj))
+
+    if isinstance(obj, torch.nn.Module):
+        yield obj
+    elif isinstance(obj, (list, tuple, set)):
+        for item in obj:
+            yield from _iter_modules(item, seen)
+    elif isinstance(obj, dict):
+        for item in obj.values():
+            yield from _iter_modules(item, seen)
+    else:
+        # transformers pipeline 的 model、diffusers pipeline 的 components
+        yield from _iter_modules(getattr(obj, "model", None), seen)
+        components = getattr(obj, "components", None)
+        if isinstance(components, dict):
+            yield from _iter_modules(components, seen)
+
+
+def estimate_footprint(obj) -> tuple[int, int]:
+    """
+    估算模型佔用的記憶體
+
+    以參數及 buffer 的大小計算，meta device（尚未載入權重）不計入。
+
+    Returns:
+        (ram_bytes, vram_bytes)
+    """
+    ram_bytes, vram_bytes = 0, 0
+    counted = set()
+    for module in _iter_modules(obj, set()):
+        for tensor in list(module.parameters()) + list(module.buffers()):
+            if id(tensor) in counted:
+                continue
+            counted.add(id(tensor))
+            size = tensor.numel() * tensor.element_size()
+            if tensor.device.type == "cuda":
+                vram_bytes += size
+            elif tensor.device.type != "meta":
+                ram_bytes += size
+    return ram_bytes, vram_bytes
+
+
+def _default_vram_budget() -> int:
+    """
+    未設定時爲顯卡總量的 90%，再扣掉故事生成保留的 KV（前綴快取及延伸故事的 session），
+    這些 KV 不算在模型的佔用裏，需預留空間避免 OOM
+    """
+    if ModelPool.vram_budget_mb:
+        return ModelPool.vram_budget_mb * MB
+    import torch
+    if torch.cuda.is_available():
+        reserved = (TextGeneration.prefix_cache_max_mb + TextGeneration.session_max_mb) * MB
+        return max(int(torch.cuda.get_device_properties(0).total_memory * 0.9) - reserved, 0)
+    return 0
+
+
+class ModelRegistry:
+    """
+    常駐模型池
+
+    - get(name, loader)：命中直接回傳，未命中呼叫 loader 載入並記錄佔用大小
+    - 超出預算時依 LRU 淘汰，剛載入的模型不會被淘汰
+    - hits / misses / evictions 計數可用來調整預算
+
+    budget 爲 0 表示不限制；vram_budget 爲 None 時，第一次載入模型才依顯卡計算預設值（避免啟動時 import torch）。
+    """
+    def __init__(self, ram_budget: int = 0, vram_budget: Optional[int] = 0):
+        self.ram_budget = ram_budget
+        self.vram_budget = vram_budget
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: OrderedDict[str, ModelEntry] = OrderedDict()
+        self._footprints: dict[str, tuple[int, int]] = {}  # 曾經載入過的模型大小，用於載入前預先騰出空間
+        self._lock = threading.RLock()
+        self._load_locks: dict[str, threading.Lock] = {}
+
+    def get(self, name: str, loader: Callable[[], Any], on_evict: Callable[[Any], None] = None) -> Any:
+        """
+        取得常駐模型，若不存在則載入
+
+        Args:
+            name (str): 模型的唯一名稱
+            loader (Callable): 載入模型的函式，回傳值即爲被快取的物件
+            on_evict (Callable, Optional): 模型被淘汰時呼叫，可用來釋放額外資源
+        """
+        if (model := self.__lookup(name)) is not None:
+            return model
+
+        with self._lock:
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        # 同一個模型只允許一個執行緒載入，其他執行緒等待後直接命中
+        with load_lock:
+            if (model := self.__lookup(name)) is not None:
+                return model
+
+            with self._lock:
+                self.misses += 1
+                if self.vram_budget is None:
+                    self.vram_budget = _default_vram_budget()
+                evicted = self.__evict_over_budget(*self._footprints.get(name, (0, 0)))
+            self.__release(evicted)
+
+            start = time.perf_counter()
+            model = loader()
+            load_seconds = time.perf_counter() - start
+            ram_bytes, vram_bytes = estimate_footprint(model)
+
+            with self._lock:
+                self._footprints[name] = (ram_bytes, vram_bytes)
+                self._entries[name] = ModelEntry(name, model, ram_bytes, vram_bytes, load_seconds, on_evict)
+                evicted = self.__evict_over_budget(keep=name)
+            self.__release(evicted)
+
+        model_logger.info(
+            f"[ModelRegistry] loaded {name} in {load_seconds:.2f}s "
+            f"(RAM {ram_bytes / MB:.1f} MB, VRAM {vram_bytes / MB:.1f} MB)"
+        )
+        return model
+
+    def evict(self, name: str) -> bool:
+        """手動淘汰指定模型"""
+        with self._lock:
+            entry = self._entries.pop(name, None)
+            if entry is not None:
+                self.evictions += 1
+        if entry is None:
+            return False
+        self.__release([entry])
+        return True
+
+    def clear(self):
+        """淘汰所有模型"""
+        with self._lock:
+            evicted = list(self._entries.values())
+            self._entries.clear()
+            self.evictions += len(evicted)
+        self.__release(evicted)
+
+    def stats(self) -> dict:
+        with self._lock:
+            ram_used, vram_used = self.__usage()
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "ram_used_mb": round(ram_used / MB, 1),
+                "vram_used_mb": round(vram_used / MB, 1),
+                "ram_budget_mb": round(self.ram_budget / MB, 1),
+                "vram_budget_mb": round(self.vram_budget / MB, 1) if self.vram_budget is not None else None,
+                "resident": [
+                    {
+                        "name": entry.name,
+                        "ram_mb": round(entry.ram_bytes / MB, 1),
+                        "vram_mb": round(entry.vram_bytes / MB, 1),
+                        "load_seconds": round(entry.load_seconds, 2),
+                    }
+                    for entry in self._entries.values()  # 由舊到新（LRU 順序）
+                ],
+            }
+
+    def __lookup(self, name: str):
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is None:
+                return None
+            self._entries.move_to_end(name)
+            self.hits += 1
+            return entry.model
+
+    def __usage(self) -> tuple[int, int]:
+        ram_used = sum(entry.ram_bytes for entry in self._entries.values())
+        vram_used = sum(entry.vram_bytes for entry in self._entries.values())
+        return ram_used, vram_used
+
+    def __over_budget(self, extra_ram: int = 0, extra_vram: int = 0) -> bool:
+        ram_used, vram_used = self.__usage()
+        if self.ram_budget and ram_used + extra_ram > self.ram_budget:
+            return True
+        if self.vram_budget and vram_used + extra_vram > self.vram_budget:
+            return True
+        return False
+
+    def __evict_over_budget(self, extra_ram: int = 0, extra_vram: int = 0, keep: str = None) -> list[ModelEntry]:
+        """從最久未使用的模型開始淘汰，直到符合預算（需持有 self._lock）"""
+        evicted = []
+        while self.__over_budget(extra_ram, extra_vram):
+            victim = next((name for name in self._entries if name != keep), None)
+            if victim is None:
+                break
+            evicted.append(self._entries.pop(victim))
+            self.evictions += 1
+        return evicted
+
+    @staticmethod
+    def __release(entries: list[ModelEntry]):
+        if not entries:
+            return
+        for entry in entries:
+            model_logger.info(f"[ModelRegistry] evict {entry.name}")
+            if entry.on_evict is not None:
+                entry.on_evict(entry.model)
+            entry.model = None
+        gc.collect()
+        import torch
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+
+model_registry = ModelRegistry(
+    ram_budget=ModelPool.ram_budget_mb * MB,
+    vram_budget=None,
+)
@@ -0,0 +1,160 @@
+"""
+共同 prompt 前綴的 KV cache
+
+故事生成的 system prompt 很長且幾乎固定（只差在故事類型），每次從頭 prefill 整段 prompt 很浪費。
+這裡以前綴的 token id 爲 key，保存該前綴跑完 forward 後的 past_key_values，
+之後的請求只需 prefill 前綴之後的 token。快取以 LRU 淘汰，取出時複製一份，
+generate 追加的 KV 不會污染快取中的前綴。
+
+KV 佔用 2 × 層數 × KV head 數 × head_dim × dtype bytes / token（7B Llama、bf16 約 512 KB / token），
+因此快取以 bytes 計算上限，而不是只看條目數。
+"""
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Sequence
+
+import torch
+
+from app.utils.logger import model_logger
+from app.utils.metrics import Histogram
+
+
+def kv_bytes(past: Any) -> int:
+    """past_key_values（DynamicCache 或 legacy tuple）中所有 tensor 的大小"""
+    if past is None:
+        return 0
+    if isinstance(past, torch.Tensor):
+        return past.numel() * past.element_size()
+    if isinstance(past, (list, tuple)):
+        return sum(kv_bytes(item) for item in past)
+    if hasattr(past, "to_legacy_cache"):
+        return kv_bytes(past.to_legacy_cache())
+    return 0
+
+
+def common_prefix_length(a: Sequence[int], b: Sequence[int]) -> int:
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
+
+
+class PrefixKVCache:
+    """
+    - prepare()：取得 prompt 前綴的 KV 副本，交給呼叫端自行 forward
+    - generate()：以快取的前綴 KV 接續生成，回傳新生成的 token id
+    - stats()：命中率、重用的 token 數及前綴 prefill 耗時
+
+    max_bytes: 快取 KV 的總大小上限，0 表示只以 max_entries 限制；超過時從最久未使用的前綴淘汰
+    min_prefix_tokens: 前綴短於此長度時不快取，直接完整 prefill
+
+    取出時的副本屬於該次生成，生成結束即釋放（同時存在的副本數不超過 continuous batching 的批次大小）。
+    """
+    def __init__(self, max_entries: int = 8, max_bytes: int = 0, min_prefix_tokens: int = 16):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.min_prefix_tokens = min_prefix_tokens
+        self.bytes_used = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reused_tokens = 0
+        self.prefill_time = Histogram()
+        self._entries: OrderedDict[tuple[int, ...], Any] = OrderedDict()
+        self._sizes: dict[tuple[int, ...], int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, model, prefix_ids: tuple[int, ...]):
+        """回傳前綴 KV 的副本，快取中沒有時先 prefill 前綴"""
+        with self._lock:
+            past = self._entries.get(prefix_ids)
+            if past is not None:
+                self._entries.move_to_end(prefix_ids)
+                self.hits += 1
+                self.reused_tokens += len(prefix_ids)
+            else:
+                self.misses += 1
+
+        if past is None:
+            past = self.__prefill(model, prefix_ids)
+            self.__store(prefix_ids, past)
+        return copy.deepcopy(past)
+
+    def prepare(self, model, input_ids: Sequence[int], prefix_len: int) -> tuple[Any, int]:
+        """
+        回傳 (前綴 KV, 前綴長度)；前綴太短或不快取時回傳 (None, 0)
+        """
+        # 至少保留一個 token 給 generate 計算下一個 token 的 logits
+        prefix_len = min(prefix_len, len(input_ids) - 1)
+        if not self.max_entries or prefix_len < self.min_prefix_tokens:
+            return None, 0
+        return self.get(model, tuple(input_ids[:prefix_len])), prefix_len
+
+    def generate(self, model, input_ids: Sequence[int], prefix_len: int, **generate_kwargs) -> torch.Tensor:
+        """
+        input_ids 的前 prefix_len 個 token 使用快取的 KV，其餘 token 照常 prefill 後生成
+
+        Returns:
+            新生成的 token id（不含 prompt）
+        """
+        past, _ = self.prepare(model, input_ids, prefix_len)
+
+        ids = torch.tensor([list(input_ids)], device=model.device)
+        with torch.no_grad():
+            output = model.generate(
+                input_ids=ids,
+                attention_mask=torch.ones_like(ids),
+                past_key_values=past,
+                **generate_kwargs,
+            )
+        return output[0, len(input_ids):]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self.bytes_used = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "kv_mb": round(self.bytes_used / 1024 ** 2, 1),
+                "max_kv_mb": round(self.max_bytes / 1024 ** 2, 1),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "reused_tokens": self.reused_tokens,
+                "prefill_time": self.prefill_time.snapshot(),
+            }
+
+    def __store(self, prefix_ids: tuple[int, ...], past: Any):
+        size = kv_bytes(past)
+        if self.max_bytes and size > self.max_bytes:
+            model_logger.warning(f"[PrefixKVCache] prefix KV of {size / 1024 ** 2:.1f} MB exceeds the budget, not cached")
+            return
+        with self._lock:
+            if prefix_ids in self._entries:
+                return
+            self._entries[prefix_ids] = past
+            self._sizes[prefix_ids] = size
+            self.bytes_used += size
+            while len(self._entries) > self.max_entries or (self.max_bytes and self.bytes_used > self.max_bytes):
+                evicted, _ = self._entries.popitem(last=False)
+                self.bytes_used -= self._sizes.pop(evicted)
+                self.evictions += 1
+
+    def __prefill(self, model, prefix_ids: tuple[int, ...]):
+        start = time.perf_counter()
+        ids = torch.tensor([list(prefix_ids)], device=model.device)
+        with torch.no_grad():
+            past = model(input_ids=ids, attention_mask=torch.ones_like(ids), use_cache=True).past_key_values
+        elapsed = time.perf_counter() - start
+        self.prefill_time.observe(elapsed)
+        model_logger.info(f"[PrefixKVCache] cached prefix of {len(prefix_ids)} tokens in {elapsed:.2f}s")
+        return past
@@ -0,0 +1,126 @@
+"""
+模型物件的延遲建構
+
+模型模組會 import torch、transformers、diffusers、MeloTTS，建構時還可能下載資料，
+放在模組層級會讓 import app.main 變得很慢。這裡只登記「如何建構」，
+第一次存取屬性時才 import 對應的模組並建構物件，之後直接轉交給該物件。
+
+    from app.models.singletons import mandrine_llm
+    mandrine_llm.generate_text(...)   # 第一次呼叫時才 import app.models.text_generation
+
+INFERENCE_MODE=remote 時，匯出的名稱改爲推理行程中模型的代理（RemoteModel），用法相同。
+"""
+import importlib
+import threading
+from typing import Any
+
+from app.config import Inference, Translation
+from app.utils.logger import model_logger
+
+
+class LazyModel:
+    """
+    Args:
+        name (str): 登記名稱
+        target (str): "模組路徑:類別名稱"
+        kwargs: 建構時傳入的參數
+    """
+    def __init__(self, name: str, target: str, **kwargs):
+        self._name = name
+        self._target = target
+        self._kwargs = kwargs
+        self._instance = None
+        self._lock = threading.Lock()
+
+    def instance(self) -> Any:
+        if self._instance is None:
+            with self._lock:
+                if self._instance is None:
+                    module_name, class_name = self._target.split(":")
+                    model_logger.info(f"[LazyModel] constructing {self._name} ({self._target})")
+                    cls = getattr(importlib.import_module(module_name), class_name)
+                    self._instance = cls(**self._kwargs)
+        return self._instance
+
+    def is_loaded(self) -> bool:
+        """是否已建構（不會觸發建構），適合用在監控端點"""
+        return self._instance is not None
+
+    def call_if_loaded(self, method: str, *args, **kwargs) -> Any:
+        """
+        已建構時才呼叫 method，否則回傳 None（不會觸發建構）
+
+        remote 模式下 RemoteModel 轉送這個方法，只需一次往返；web 端仍須放在執行緒中呼叫
+        """
+        if method.startswith("_"):
+            raise AttributeError(f"{method!r} is not a public attribute")
+        if self._instance is None:
+            return None
+        return getattr(self._instance, method)(*args, **kwargs)
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self.instance(), attr)
+
+    def __repr__(self) -> str:
+        state = "loaded" if self.is_loaded() else "not loaded"
+        return f"<LazyModel {self._name} ({state})>"
+
+
+_registry: dict[str, LazyModel] = {}
+
+
+def register(name: str, target: str, **kwargs) -> LazyModel:
+    _registry[name] = LazyModel(name, target, **kwargs)
+    return _registry[name]
+
+
+def local_models() -> dict[str, LazyModel]:
+    """本行程登記的模型，推理行程以此提供服務"""
+    return dict(_registry)
+
+
+def loaded_models() -> dict[str, bool]:
+    if Inference.mode == "remote":
+        from app.models.inference_server import inference_client
+        return inference_client.call("server", "loaded_models")
+    return {name: model.is_loaded() for name, model in _registry.items()}
+
+
+def model_pool_stats() -> dict:
+    """常駐模型池的統計；remote 模式下爲推理行程的模型池"""
+    if Inference.mode == "remote":
+        from app.models.inference_server import inference_client
+        return inference_client.call("server", "model_pool")
+    from app.models.model_registry import model_registry
+    return model_registry.stats()
+
+
+def audio_cache_stats() -> dict:
+    """語音快取的統計；remote 模式下語音由推理行程合成，快取也在推理行程，web worker 不建立快取"""
+    if Inference.mode == "remote":
+        from app.models.inference_server import inference_client
+        return inference_client.call("server", "audio_cache")
+    from app.models.audio_cache import audio_cache
+    return audio_cache.stats()
+
+
+mandrine_llm = register("mandrine_llm", "app.models.text_generation:MandarinLLM")
+image2text = register("image2text", "app.models.image_to_text:Img2Text")
+translator = register(
+    "translator",
+    "app.models.translator:Translator",
+    device=Translation.device,
+    memo_size=Translation.memo_size,
+    batch_size=Translation.batch_size,
+)
+speech = register("speech", "app.models.text_to_speech:Speech")
+emoji = register("emoji", "app.models.text_to_image:Emoji")
+handwriting = register("handwriting", "app.models.text_to_image:HandWritingImage")
+
+if Inference.mode == "remote":
+    # 模型由獨立的推理行程持有，這裡只保留代理（見 app/models/inference_server.py）
+    from app.models.inference_server import inference_client
+    mandrine_llm, image2text, translator, speech, emoji, handwriting = (
+        inference_client.model(name)
+        for name in ("mandrine_llm", "image2text", "translator", "speech", "emoji", "handwriting")
+    )
@@ -0,0 +1,105 @@
+"""
+文字生成的串流輸出及提早停止
+
+- StoryLengthCriteria：生成的字數達到下限且剛好結束一個句子時停止，超過上限時強制停止，
+  不必把 max_new_tokens 全部跑完
+- AsyncTextStreamer：generate 在執行緒中執行，解碼出的文字透過 asyncio.Queue 交給 event loop，
+  呼叫端以 async for 逐段取得；呼叫端中途離開時，下一步即停止生成
+"""
+import asyncio
+import time
+from typing import AsyncIterator, Callable
+
+import torch
+from transformers import StoppingCriteria, TextStreamer
+
+from app.utils.metrics import Histogram
+
+# 句子結尾的字元（含結尾的引號）
+SENTENCE_ENDS = "。！？!?…」』”"
+
+_END = object()
+
+
+class StoryLengthCriteria(StoppingCriteria):
+    """
+    Args:
+        prompt_len (int): prompt 的 token 數，只計算新生成的文字
+        min_chars (int): 達到此字數後，遇到句尾即停止
+        max_chars (int): 超過此字數強制停止
+        cancelled (Callable): 回傳 True 時立即停止（例如呼叫端已離開）
+    """
+    def __init__(self, tokenizer, prompt_len: int, min_chars: int, max_chars: int, cancelled: Callable[[], bool] = None):
+        self.tokenizer = tokenizer
+        self.prompt_len = prompt_len
+        self.min_chars = min_chars
+        self.max_chars = max_chars
+        self.cancelled = cancelled
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        done = self.is_done(input_ids[0, self.prompt_len:])
+        return torch.full((input_ids.shape[0],), done, dtype=torch.bool, device=input_ids.device)
+
+    def is_done(self, new_tokens) -> bool:
+        """new_tokens 爲目前已生成的 token（不含 prompt）"""
+        if self.cancelled is not None and self.cancelled():
+            return True
+        text = self.tokenizer.decode(new_tokens, skip_special_tokens=True).rstrip()
+        return len(text) >= self.max_chars or (len(text) >= self.min_chars and text[-1:] in SENTENCE_ENDS)
+
+
+class AsyncTextStreamer(TextStreamer):
+    """
+    TextStreamer 會在每個 token 解碼出完整文字時呼叫 on_finalized_text（在 generate 的執行緒中），
+    這裡把文字轉交給 event loop，並記錄首個 token 及 token 之間的延遲。
+    """
+    def __init__(self, tokenizer, loop: asyncio.AbstractEventLoop, first_token: Histogram = None, inter_token: Histogram = None):
+        super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=True)
+        self.loop = loop
+        self.queue: asyncio.Queue = asyncio.Queue()
+        self.cancelled = False
+        self.first_token = first_token
+        self.inter_token = inter_token
+        self.tokens = 0
+        self._started_at = time.perf_counter()
+        self._last_token_at: float = None
+
+    def put(self, value):
+        # 第一次呼叫是 prompt，之後每次一個新 token
+        if not self.next_tokens_are_prompt:
+            now = time.perf_counter()
+            if self._last_token_at is None:
+                if self.first_token is not None:
+                    self.first_token.observe(now - self._started_at)
+            elif self.inter_token is not None:
+                self.inter_token.observe(now - self._last_token_at)
+            self._last_token_at = now
+            self.tokens += 1
+        super().put(value)
+
+    def on_finalized_text(self, text: str, stream_end: bool = False):
+        if text:
+            self.loop.call_soon_threadsafe(self.queue.put_nowait, text)
+        if stream_end:
+            self.close()
+
+    def close(self):
+        """通知 event loop 已沒有更多文字，可重複呼叫"""
+        self.loop.call_soon_threadsafe(self.queue.put_nowait, _END)
+
+    async def iterate(self, generate: Callable[[], None]) -> AsyncIterator[str]:
+        """在執行緒中執行 generate，逐段回傳解碼出的文字；generate 的例外會在最後拋出"""
+        def run():
+            try:
+                generate()
+            finally:
+                self.close()
+
+        task = asyncio.create_task(asyncio.to_thread(run))
+        try:
+            while (text := await self.queue.get()) is not _END:
+                yield text
+        finally:
+            # 呼叫端提早離開時，讓 StoppingCriteria 停止生成
+            self.cancelled = True
+            await task
@@ -1,13 +1,319 @@
+import asyncio
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Callable, Sequence
 import torch
-from transformers import pipeline, Pipeline, AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig
+from transformers import pipeline, Pipeline, AutoModelForCausalLM, AutoTokenizer, BitsAndBytesConfig, DynamicCache, TextStreamer
 from accelerate import init_empty_weights
 from app.models.translator import check
 from app.utils.logger import model_logger
+from app.models.model_registry import model_registry
+from app.models.prefix_cache import PrefixKVCache, common_prefix_length
+from app.models.chat_session import ChatSessionCache, TOKEN_BUCKETS
+from app.models.streaming import AsyncTextStreamer, StoryLengthCriteria
+from app.models.micro_batcher import BATCH_SIZE_BUCKETS
+from app.utils.metrics import Histogram
+from app.config import TextGeneration
+
+# 延伸故事時每一輪的用戶指示
+STORY_EXTEND_INSTRUCTION = "請接續上面的故事，創作下一段。"
+
+@dataclass
+class SamplingParams:
+    max_new_tokens: int = 600
+    do_sample: bool = True
+    temperature: float = 0.6
+    top_k: int = 40
+    top_p: float = 0.9
+    eos_token_id: int = None
+
+
+@dataclass
+class GenerationRequest:
+    model: Any
+    input_ids: list[int]
+    params: SamplingParams
+    past: Any = None  # 涵蓋 input_ids[:reused] 的 KV（前綴快取或 session）
+    reused: int = 0
+    stop: Callable[[list[int]], bool] = None
+    streamer: TextStreamer = None
+    on_finish: Callable[[list[int], Any], None] = None  # (KV 涵蓋的 token id, KV)，用來保存 session
+    future: Future = field(default_factory=Future)
+    enqueued_at: float = field(default_factory=time.monotonic)
+    generated: list[int] = field(default_factory=list)
+    length: int = 0  # 批次 KV 中屬於此序列的 token 數（不含 padding）
+    done: bool = False
+    cancelled: bool = False  # 呼叫端已逾時放棄
+
+
+class ContinuousBatchScheduler:
+    """
+    continuous batching
+
+    所有故事生成請求共用一個背景執行緒及一個 decode 批次：
+    - 每個 decode step（token 邊界）之間接納新請求：新請求先單獨 prefill，再以 left padding 併入批次的 KV
+    - 序列結束（eos、達到 max_new_tokens 或 stop 回傳 True）後立即移出批次，不必等其他序列
+    - 每個請求各自的 temperature / top_k / top_p
+    批次 KV 以 legacy tuple（每層 (key, value)，形狀 [batch, heads, seq, dim]）保存，方便 padding 及挑選列。
+
+    排程迴圈中任何一步失敗（prefill 以外）都會讓批次中所有序列失敗並清空批次，執行緒繼續服務之後的請求。
+
+    max_batch_size: 同時 decode 的序列數上限，1 即逐一生成
+    timeout: generate() 等待的最長秒數，0 表示不限制
+    """
+    def __init__(self, max_batch_size: int = 4, timeout: float = 0):
+        self.max_batch_size = max(1, max_batch_size)
+        self.timeout = timeout
+        self.completed = 0
+        self.failed = 0
+        self.steps = 0
+        self.prefill_tokens = 0
+        self.generated_tokens = 0
+        self.batch_size = Histogram(buckets=BATCH_SIZE_BUCKETS)
+        self.queue_wait = Histogram()
+        self._queue: queue.SimpleQueue[GenerationRequest] = queue.SimpleQueue()
+        self._waiting: deque[GenerationRequest] = deque()
+        self._active: list[GenerationRequest] = []
+        self._model = None
+        self._kv: list[tuple[torch.Tensor, torch.Tensor]] = None
+        self._mask: torch.Tensor = None
+        self._thread: threading.Thread = None
+        self._lock = threading.Lock()
+
+    def generate(self, model, input_ids: Sequence[int], params: SamplingParams, past: Any = None, reused: int = 0,
+                 stop: Callable[[list[int]], bool] = None, streamer: TextStreamer = None,
+                 on_finish: Callable[[list[int], Any], None] = None) -> list[int]:
+        """阻塞至該請求生成完畢，回傳新生成的 token id；超過 timeout 秒拋出 TimeoutError"""
+        request = GenerationRequest(model, list(input_ids), params, past, reused, stop, streamer, on_finish)
+        try:
+            return self.submit(request).result(timeout=self.timeout or None)
+        except TimeoutError:
+            # 讓排程執行緒在下一個 token 邊界移出此序列
+            request.cancelled = True
+            raise
+
+    def submit(self, request: GenerationRequest) -> Future:
+        self.__ensure_thread()
+        self._queue.put(request)
+        return request.future
+
+    def stats(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "active": len(self._active),
+            "waiting": len(self._waiting) + self._queue.qsize(),
+            "completed": self.completed,
+            "failed": self.failed,
+            "steps": self.steps,
+            "prefill_tokens": self.prefill_tokens,
+            "generated_tokens": self.generated_tokens,
+            "batch_size": self.batch_size.snapshot(),
+            "queue_wait": self.queue_wait.snapshot(),
+        }
+
+    def __ensure_thread(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self.__run, name="llm-scheduler", daemon=True)
+                    self._thread.start()
+
+    def __run(self):
+        while True:
+            try:
+                with torch.no_grad():
+                    self.__admit()
+                    if not self._active:
+                        continue
+                    self.__step()
+                    self.__retire()
+            except Exception as e:
+                # 批次的 KV 可能只改了一半，不能繼續使用；執行緒不能結束，否則之後的請求會永遠等待
+                model_logger.exception(f"[ContinuousBatchScheduler] batch failed, abort {len(self._active)} sequences")
+                for request in self._active:
+                    self.__fail(request, e)
+                self.__reset()
+
+    def __admit(self):
+        # 沒有執行中的序列時，阻塞等待新請求
+        if not self._active and not self._waiting:
+            self._waiting.append(self._queue.get())
+        while True:
+            try:
+                self._waiting.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+
+        while self._waiting and len(self._active) < self.max_batch_size:
+            request = self._waiting[0]
+            if self._active and request.model is not self._model:
+                # 模型已重新載入，等目前的批次結束再換模型
+                break
+            self._waiting.popleft()
+            self.queue_wait.observe(time.monotonic() - request.enqueued_at)
+            try:
+                kv = self.__prefill(request)
+            except Exception as e:
+                model_logger.exception("[ContinuousBatchScheduler] prefill failed")
+                self.__fail(request, e)
+                continue
+            if request.done:
+                self.__finish(request, kv, 0, request.length)
+                continue
+            try:
+                self.__join(request, kv)
+            except Exception as e:
+                # 尚未加入 _active，由這裡讓它失敗，其餘序列交給 __run 處理
+                self.__fail(request, e)
+                raise
+
+    def __prefill(self, request: GenerationRequest) -> list[tuple[torch.Tensor, torch.Tensor]]:
+        model = request.model
+        if request.streamer is not None:
+            request.streamer.put(torch.tensor(request.input_ids))
+        ids = torch.tensor([request.input_ids[request.reused:]], device=model.device)
+        mask = torch.ones(1, len(request.input_ids), dtype=torch.long, device=model.device)
+        output = model(input_ids=ids, attention_mask=mask, past_key_values=request.past, use_cache=True)
+        request.past = None
+        request.length = len(request.input_ids)
+        self.prefill_tokens += ids.shape[1]
+        self.__emit(request, self.__sample(output.logits[0, -1], request.params))
+        return self.__to_legacy(output.past_key_values)
+
+    def __join(self, request: GenerationRequest, kv: list[tuple[torch.Tensor, torch.Tensor]]):
+        """以 left padding 把新序列的 KV 併入批次"""
+        mask = torch.ones(1, request.length, dtype=torch.long, device=kv[0][0].device)
+        if not self._active:
+            self._model, self._kv, self._mask = request.model, kv, mask
+        else:
+            current = self._mask.shape[1]
+            if request.length > current:
+                self._kv = [(self.__pad(k, request.length - current), self.__pad(v, request.length - current)) for k, v in self._kv]
+                self._mask = torch.nn.functional.pad(self._mask, (request.length - current, 0))
+            elif current > request.length:
+                kv = [(self.__pad(k, current - request.length), self.__pad(v, current - request.length)) for k, v in kv]
+                mask = torch.nn.functional.pad(mask, (current - request.length, 0))
+            self._kv = [(torch.cat([k, new_k]), torch.cat([v, new_v])) for (k, v), (new_k, new_v) in zip(self._kv, kv)]
+            self._mask = torch.cat([self._mask, mask])
+        self._active.append(request)
+
+    def __step(self):
+        device = self._mask.device
+        last_tokens = torch.tensor([[request.generated[-1]] for request in self._active], device=device)
+        # 每列的位置 = 該序列已有的 token 數，不受 left padding 影響
+        position_ids = torch.tensor([[request.length] for request in self._active], device=device)
+        self._mask = torch.cat([self._mask, torch.ones(len(self._active), 1, dtype=self._mask.dtype, device=device)], dim=1)
+
+        output = self._model(
+            input_ids=last_tokens,
+            attention_mask=self._mask,
+            position_ids=position_ids,
+            past_key_values=DynamicCache.from_legacy_cache(tuple(self._kv)),
+            use_cache=True,
+        )
+        self._kv = self.__to_legacy(output.past_key_values)
+        self.steps += 1
+        self.batch_size.observe(len(self._active))
+
+        for row, request in enumerate(self._active):
+            request.length += 1
+            self.__emit(request, self.__sample(output.logits[row, -1], request.params))
+
+    def __retire(self):
+        """移出已結束的序列，並裁掉所有序列都是 padding 的欄位"""
+        total = self._mask.shape[1]
+        keep = []
+        for row, request in enumerate(self._active):
+            if request.done:
+                self.__finish(request, self._kv, row, total)
+            else:
+                keep.append(row)
+        if len(keep) == len(self._active):
+            return
+        if not keep:
+            self.__reset()
+            return
+
+        index = torch.tensor(keep, device=self._mask.device)
+        self._active = [self._active[row] for row in keep]
+        trim = total - max(request.length for request in self._active)
+        self._kv = [(k.index_select(0, index)[:, :, trim:], v.index_select(0, index)[:, :, trim:]) for k, v in self._kv]
+        self._mask = self._mask.index_select(0, index)[:, trim:]
+
+    def __emit(self, request: GenerationRequest, token: int):
+        request.generated.append(token)
+        self.generated_tokens += 1
+        if request.streamer is not None:
+            request.streamer.put(torch.tensor([token]))
+        request.done = (
+            request.cancelled
+            or token == request.params.eos_token_id
+            or len(request.generated) >= request.params.max_new_tokens
+            or (request.stop is not None and request.stop(request.generated))
+        )
+
+    def __finish(self, request: GenerationRequest, kv: list[tuple[torch.Tensor, torch.Tensor]], row: int, total: int):
+        if request.streamer is not None:
+            request.streamer.end()
+        try:
+            if request.on_finish is not None:
+                # 取出此序列不含 padding 的 KV；最後一個 token 尚未 forward，不在 KV 中
+                start = total - request.length
+                own_kv = tuple((k[row:row + 1, :, start:].clone(), v[row:row + 1, :, start:].clone()) for k, v in kv)
+                request.on_finish((request.input_ids + request.generated)[:request.length], DynamicCache.from_legacy_cache(own_kv))
+        except Exception:
+            model_logger.exception("[ContinuousBatchScheduler] on_finish failed")
+        self.completed += 1
+        request.future.set_result(request.generated)
+
+    def __fail(self, request: GenerationRequest, error: Exception):
+        if request.future.done():
+            return
+        if request.streamer is not None:
+            try:
+                request.streamer.end()
+            except Exception:
+                model_logger.exception("[ContinuousBatchScheduler] streamer.end failed")
+        self.failed += 1
+        request.future.set_exception(error)
+
+    def __reset(self):
+        self._active, self._model, self._kv, self._mask = [], None, None, None
+
+    @staticmethod
+    def __pad(tensor: torch.Tensor, length: int) -> torch.Tensor:
+        # [batch, heads, seq, dim] 在 seq 維度左側補零
+        return torch.nn.functional.pad(tensor, (0, 0, length, 0))
+
+    @staticmethod
+    def __to_legacy(past) -> list[tuple[torch.Tensor, torch.Tensor]]:
+        if hasattr(past, "to_legacy_cache"):
+            past = past.to_legacy_cache()
+        return list(past)
+
+    @staticmethod
+    def __sample(logits: torch.Tensor, params: SamplingParams) -> int:
+        if not params.do_sample:
+            return int(logits.argmax())
+        logits = logits.float() / max(params.temperature, 1e-5)
+        if params.top_k:
+            kth = torch.topk(logits, min(params.top_k, logits.shape[-1])).values[-1]
+            logits = logits.masked_fill(logits < kth, float("-inf"))
+        if params.top_p < 1.0:
+            sorted_logits, sorted_index = torch.sort(logits, descending=True)
+            probs = torch.softmax(sorted_logits, dim=-1)
+            # 保留累積機率達到 top_p 之前的 token（至少一個）
+            remove = torch.cumsum(probs, dim=-1) - probs > params.top_p
+            logits = logits.scatter(0, sorted_index, sorted_logits.masked_fill(remove, float("-inf")))
+        return int(torch.multinomial(torch.softmax(logits, dim=-1), 1))
+
 
 class MandarinLLM:
     def __init__(self):
-        torch.cuda.empty_cache()
-        torch.cuda.reset_peak_memory_stats()
         self.model_name = "yentinglin/Taiwan-LLM-7B-v2.1-chat"
         self.quantization_config = BitsAndBytesConfig(
             load_in_4bit=True,  # 使用4-bit量化
@@ -15,31 +321,60 @@ class MandarinLLM:
             bnb_4bit_use_double_quant=False,       # 使用double量化 (可選)
             bnb_4bit_quant_type="nf4"             # 設定量化類型，例如 'nf4' (可選)
         )
+        self.prefix_cache = PrefixKVCache(
+            max_entries=TextGeneration.prefix_cache_size,
+            max_bytes=TextGeneration.prefix_cache_max_mb * 1024 ** 2,
+        )
+        self.sessions = ChatSessionCache(self.prefix_cache, max_bytes=TextGeneration.session_max_mb * 1024 ** 2)
+        # 多位用戶的故事生成合併在同一個 decode 批次
+        self.scheduler = ContinuousBatchScheduler(
+            max_batch_size=TextGeneration.max_batch_size,
+            timeout=TextGeneration.generate_timeout,
+        )
+        self.first_token_latency = Histogram()
+        self.inter_token_latency = Histogram()
+        self.new_tokens = Histogram(buckets=TOKEN_BUCKETS)
+        check(self.__class__.__name__, "init")
+
+    def __load_model(self):
+        # 模型常駐於 model_registry，只有第一次或被淘汰後才會重新載入
+        # 模型被淘汰時一併清掉前綴及 session 的 KV，釋放顯存
+        return model_registry.get(self.model_name, self.__build_pipeline, on_evict=self.__clear_kv)
+
+    def __build_pipeline(self):
+        if torch.cuda.is_available():
+            torch.cuda.empty_cache()
+            torch.cuda.reset_peak_memory_stats()
+
         # 使用 init_empty_weights 防止模型過早加載
         with init_empty_weights():
-            self.model = AutoModelForCausalLM.from_pretrained(
+            model = AutoModelForCausalLM.from_pretrained(
                 self.model_name,
                 quantization_config=self.quantization_config,  # 這裡傳入量化配置
                 device_map="auto",
             )
-        check(self.__class__.__name__, "init")
 
-    def __load_model(self): 
         # 加載Tokenizer
-        self.tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        tokenizer = AutoTokenizer.from_pretrained(self.model_name)
         
         # 使用 pipeline
-        self.pipeline = pipeline(
+        text_pipeline = pipeline(
             "text-generation",
-            model=self.model,  # 將量化後的模型傳遞給 pipeline
-            tokenizer=self.tokenizer,
+            model=model,  # 將量化後的模型傳遞給 pipeline
+            tokenizer=tokenizer,
             torch_dtype=torch.float16,  # 設定torch的數據類型
             device_map="auto",  # 根據設備自動設置
         )
-        self.model.gradient_checkpointing_enable()
+        model.gradient_checkpointing_enable()
+        check(self.__class__.__name__, "model loaded")
+        return text_pipeline
     
+    def __clear_kv(self, _):
+        self.prefix_cache.clear()
+        self.sessions.clear()
+
     def show_parameter(self):
-        for name, param in self.pipeline.model.named_parameters():
+        for name, param in self.__load_model().model.named_parameters():
             print(f"{name}: {param.device}")
 
     def generate_text(
@@ -47,6 +382,8 @@ class MandarinLLM:
             user_input: str, 
             chat_history: list[dict] = None,
             generate_text_len: int = 600,
+            length: tuple[int, int] = None,
+            streamer: AsyncTextStreamer = None,
         ) -> str:
         """
         模型生成文字
@@ -58,42 +395,163 @@ class MandarinLLM:
             "role": "system",
             "content": "你是一位說故事家，充滿無限創意。你須要根據使用者提供的描述和故事類型延申故事劇情，内容需緊凑不拖泥帶水，且精彩有起承轉合，有結局。切忌字數介於一百至兩百字之間。"
         }]
+        length: (最少字數, 最多字數)，達到最少字數後遇到句尾即停止生成
+        streamer: 由 stream_text 傳入，逐 token 輸出
         """
-        self.__load_model()
-        
+        text_pipeline = self.__load_model()
+        tokenizer = text_pipeline.tokenizer
+
         if chat_history is None:
             chat_history = [{"role": "system",
                              "content": "你是一位說故事家，充滿無限創意。你須要根據使用者提供的描述和故事類型延申故事劇情，内容需緊凑不拖泥帶水，且精彩有起承轉合，有結局。切忌字數介於一百至兩百字之間。"}]
         chat_history.append({"role": "user", "content": user_input})
         
-        model_logger.info(f"[{self.__class__.__name__}] {chat_history=}")
-        prompt = self.pipeline.tokenizer.apply_chat_template(chat_history, tokenize=False, add_generation_prompt=True)
-        
-        outputs = self.pipeline(
-            prompt, 
-            max_new_tokens=generate_text_len, 
-            do_sample=True, 
-            temperature=0.6, 
-            top_k=40, 
-            top_p=0.9
-            )
+        model_logger.debug("[%s] chat_history=%s", self.__class__.__name__, chat_history)
+        input_ids = tokenizer.apply_chat_template(chat_history, tokenize=True, add_generation_prompt=True)
+
+        # 與只有 system prompt 時的共同前綴，其 KV 由 prefix_cache 重用
+        prefix_len = common_prefix_length(input_ids, self.__prompt_prefix(tokenizer, chat_history[:-1]))
+
+        model = text_pipeline.model
+        past, reused = self.prefix_cache.prepare(model, input_ids, prefix_len)
+        new_tokens = self.scheduler.generate(
+            model,
+            input_ids,
+            self.__sampling_params(tokenizer, generate_text_len),
+            past,
+            reused,
+            stop=self.__stop(tokenizer, length, streamer),
+            streamer=streamer,
+        )
+        return self.__decode(tokenizer, new_tokens)
+
+    def continue_story(
+            self,
+            session_key: str,
+            system_prompt: str,
+            story_list: list[str],
+            generate_text_len: int = 500,
+            length: tuple[int, int] = None,
+            streamer: AsyncTextStreamer = None,
+        ) -> str:
+        """
+        延伸故事，同一用戶的 KV 保存在 sessions，每次只 prefill 新增的故事及指示
 
-        response = outputs[0].get("generated_text")
-        new_reply = response[len(prompt):]
+        對話格式：system → user（故事開頭+指示）→ assistant（第二段）→ user（指示）→ ...，
+        每次延伸只是在上一次的 prompt 後面加上一組 assistant/user。
+        prompt 超過 TextGeneration.session_token_budget 時，保留開頭，從最舊的段落開始捨棄。
+        """
+        text_pipeline = self.__load_model()
+        tokenizer = text_pipeline.tokenizer
+
+        segments = list(story_list)
+        messages = self.__story_messages(system_prompt, segments)
+        input_ids = tokenizer.apply_chat_template(messages, tokenize=True, add_generation_prompt=True)
+        while len(input_ids) > TextGeneration.session_token_budget and len(segments) > 2:
+            del segments[1]
+            messages = self.__story_messages(system_prompt, segments)
+            input_ids = tokenizer.apply_chat_template(messages, tokenize=True, add_generation_prompt=True)
+        if len(segments) < len(story_list):
+            model_logger.info(f"[{self.__class__.__name__}] {session_key}: dropped {len(story_list) - len(segments)} segments over token budget")
+
+        prefix_len = common_prefix_length(input_ids, self.__prompt_prefix(tokenizer, messages[:1]))
+        model = text_pipeline.model
+        past, reused = self.sessions.prepare(model, session_key, input_ids, prefix_len)
+        new_tokens = self.scheduler.generate(
+            model,
+            input_ids,
+            self.__sampling_params(tokenizer, generate_text_len),
+            past,
+            reused,
+            stop=self.__stop(tokenizer, length, streamer),
+            streamer=streamer,
+            on_finish=lambda token_ids, kv: self.sessions.save(session_key, token_ids, kv),
+        )
+        return self.__decode(tokenizer, new_tokens)
+
+    async def stream_text(self, *args, **kwargs) -> AsyncIterator[str]:
+        """generate_text 的串流版本，參數相同，以 async for 逐段取得生成的文字"""
+        async for text in self.__stream(self.generate_text, *args, **kwargs):
+            yield text
+
+    async def stream_story(self, *args, **kwargs) -> AsyncIterator[str]:
+        """continue_story 的串流版本，參數相同"""
+        async for text in self.__stream(self.continue_story, *args, **kwargs):
+            yield text
+
+    def stats(self) -> dict:
+        return {
+            "first_token_latency": self.first_token_latency.snapshot(),
+            "inter_token_latency": self.inter_token_latency.snapshot(),
+            "new_tokens": self.new_tokens.snapshot(),
+        }
+
+    async def __stream(self, generate: Callable[..., str], *args, **kwargs) -> AsyncIterator[str]:
+        # 載入模型可能很久，放在執行緒中
+        text_pipeline = await asyncio.to_thread(self.__load_model)
+        streamer = AsyncTextStreamer(
+            text_pipeline.tokenizer,
+            asyncio.get_running_loop(),
+            first_token=self.first_token_latency,
+            inter_token=self.inter_token_latency,
+        )
+        async for text in streamer.iterate(lambda: generate(*args, **kwargs, streamer=streamer)):
+            yield text
 
+    @staticmethod
+    def __sampling_params(tokenizer, generate_text_len: int) -> SamplingParams:
+        return SamplingParams(
+            max_new_tokens=generate_text_len,
+            do_sample=True,
+            temperature=0.6,
+            top_k=40,
+            top_p=0.9,
+            eos_token_id=tokenizer.eos_token_id,
+        )
+
+    @staticmethod
+    def __stop(tokenizer, length: tuple[int, int] = None, streamer: AsyncTextStreamer = None) -> Callable[[list[int]], bool]:
+        """字數達標或串流的呼叫端已離開時停止"""
+        if length is None and streamer is None:
+            return None
+        min_chars, max_chars = length or (float("inf"), float("inf"))
+        cancelled = (lambda: streamer.cancelled) if streamer is not None else None
+        return StoryLengthCriteria(tokenizer, 0, min_chars, max_chars, cancelled).is_done
+
+    def __decode(self, tokenizer, new_tokens) -> str:
+        self.new_tokens.observe(len(new_tokens))
+        new_reply = tokenizer.decode(new_tokens, skip_special_tokens=True)
         model_logger.info(f"[{self.__class__.__name__}] {new_reply=}")
-        self.__clear()
         return new_reply
-    
-    def __clear(self):
-        # 刪除 pipeline 和模型
-        if hasattr(self, 'pipeline'):
-            del self.pipeline.model  # 刪除模型
-            del self.pipeline.tokenizer  # 刪除 tokenizer
-            del self.pipeline  # 刪除 pipeline 對象
-            self.pipeline = None
-        torch.cuda.empty_cache()
-        check(self.__class__.__name__, "clear")
 
+    def end_session(self, session_key: str):
+        """故事結束，釋放該用戶的 KV"""
+        self.sessions.drop(session_key)
+
+    @staticmethod
+    def __story_messages(system_prompt: str, story_list: list[str]) -> list[dict]:
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": f"{story_list[0]}\n\n{STORY_EXTEND_INSTRUCTION}"},
+        ]
+        for story in story_list[1:]:
+            messages.append({"role": "assistant", "content": story})
+            messages.append({"role": "user", "content": STORY_EXTEND_INSTRUCTION})
+        return messages
 
-mandrine_llm = MandarinLLM()
\ No newline at end of file
+    @staticmethod
+    def __prompt_prefix(tokenizer, messages: list[dict]) -> list[int]:
+        """用戶訊息之前的 prompt（通常是 system prompt）的 token id"""
+        if not messages:
+            return []
+        try:
+            return tokenizer.apply_chat_template(messages, tokenize=True, add_generation_prompt=False)
+        except Exception as e:
+            # 部分 chat template 不接受只有 system 的對話
+            model_logger.warning(f"[MandarinLLM] cannot render prompt prefix: {e}")
+            return []
+    
+    def unload(self):
+        """從 model_registry 移除模型，釋放記憶體"""
+        model_registry.evict(self.model_name)
+        check(self.__class__.__name__, "clear")
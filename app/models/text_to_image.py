@@ -8,7 +8,7 @@ from diffusers import AutoPipelineForText2Image
 from app.utils.image_utils import  ImageHelper
 
 from app.models.translator import check
-import gc
+from app.models.model_registry import model_registry
 
 access_token = HuggingFace.access_token
 # api = HfApi()
@@ -19,24 +19,30 @@ class Emoji:
         self.model_name = "fofr/sdxl-emoji"
     
     def __load_model(self):
+        # 模型常駐於 model_registry，只有第一次或被淘汰後才會重新載入
+        return model_registry.get(self.model_name, self.__build_pipeline)
 
-        self.pipe = DiffusionPipeline.from_pretrained(
+    def __build_pipeline(self):
+        pipe = DiffusionPipeline.from_pretrained(
                 "stabilityai/stable-diffusion-xl-base-1.0",
                 torch_dtype=torch.float16,
                 variant="fp16",
         ).to("cuda")
-        self.pipe.load_lora_weights(self.model_name, weight_name="lora.safetensors")
+        pipe.load_lora_weights(self.model_name, weight_name="lora.safetensors")
 
-    def generate_image(self, prompt:str="A <s0><s1> emoji of a man"):
-        check("before load")
-        self.__load_model()
-        text_encoders = [self.pipe.text_encoder, self.pipe.text_encoder_2]
-        tokenizers = [self.pipe.tokenizer, self.pipe.tokenizer_2]
+        # embeddings 會新增 token 到 tokenizer，只能在載入時處理一次
+        text_encoders = [pipe.text_encoder, pipe.text_encoder_2]
+        tokenizers = [pipe.tokenizer, pipe.tokenizer_2]
 
         embedding_path = hf_hub_download(repo_id=self.model_name, filename="embeddings.pti", repo_type="model")
         embhandler = TokenEmbeddingsHandler(text_encoders, tokenizers)
         embhandler.load_embeddings(embedding_path)
-        images = self.pipe(
+        return pipe
+
+    def generate_image(self, prompt:str="A <s0><s1> emoji of a man"):
+        check("before load")
+        pipe = self.__load_model()
+        images = pipe(
             prompt,
             num_inference_steps=10,
             height=64,
@@ -44,8 +50,6 @@ class Emoji:
             cross_attention_kwargs={"scale": 0.8},
         ).images
         check("after load")
-        self.__clear()
-        check("after clear")
         #your output image
         images[0]
         print(type(images[0]))
@@ -54,12 +58,9 @@ class Emoji:
         
         return images[0]
     
-    def __clear(self):
-        if hasattr(self, 'pipe'):
-            del self.pipe  # 刪除 pipeline 對象
-            self.pipe = None
-        torch.cuda.empty_cache()
-        gc.collect()
+    def unload(self):
+        """從 model_registry 移除模型，釋放記憶體"""
+        model_registry.evict(self.model_name)
 
 class HandWritingImage:
 
@@ -67,23 +68,24 @@ class HandWritingImage:
         self.model_name = "fofr/flux-handwriting"
 
     def __load_image(self):
-        self.pipeline = AutoPipelineForText2Image.from_pretrained(
+        # 模型常駐於 model_registry，只有第一次或被淘汰後才會重新載入
+        return model_registry.get(self.model_name, self.__build_pipeline)
+
+    def __build_pipeline(self):
+        pipeline = AutoPipelineForText2Image.from_pretrained(
             'black-forest-labs/FLUX.1-dev', 
             torch_dtype=torch.float16
             ).to('cuda')
-        self.pipeline.load_lora_weights(self.model_name, weight_name='lora.safetensors')
+        pipeline.load_lora_weights(self.model_name, weight_name='lora.safetensors')
+        return pipeline
         
     def generate_image(self, input_text: str):
         check("handwriting before load")
-        self.__load_image()
+        pipeline = self.__load_image()
         check("handwriting after load")
-        image = self.pipeline(input_text).images[0]
-        self.__clear()
-        check("handwriting after clear")
+        image = pipeline(input_text).images[0]
         return image
     
-    def __clear(self):
-        if hasattr(self, 'pipeline'):
-            del self.pipeline  # 刪除 pipeline 對象
-            self.pipeline = None
-        torch.cuda.empty_cache()
\ No newline at end of file
+    def unload(self):
+        """從 model_registry 移除模型，釋放記憶體"""
+        model_registry.evict(self.model_name)
\ No newline at end of file
@@ -1,71 +1,148 @@
 import ffmpeg
-import gc
 import nltk
 import datetime
+import queue
+import re
+import threading
 from typing import Tuple
-import torch
+import numpy as np
 from MeloTTS.melo.api import TTS
 
+from app.config import TextToSpeech
 from app.utils.utils import PathTool
+from app.utils.logger import model_logger
 from app.models.translator import check
+from app.models.model_registry import model_registry
+from app.models.audio_cache import audio_cache
+
+# 句子結尾的標點，保留在句子內
+_SENTENCE_END = re.compile(r"(?<=[。！？!?；;…\n])")
+
+
+def split_sentences(text: str) -> list[str]:
+    """依句末標點切句，太短的片段併入前一句"""
+    sentences = []
+    for part in _SENTENCE_END.split(text):
+        part = part.strip()
+        if not part:
+            continue
+        if sentences and len(part) < 4:
+            sentences[-1] += part
+        else:
+            sentences.append(part)
+    return sentences or [text]
+
 
 class Speech:
     def __init__(self):
         self.speed = 0.8
         self.device = 'cuda' # or cuda:0
-        self.model = None
+        self.model_name = f"MeloTTS-ZH-{self.device}"
+        self.speaker = 'ZH'
+        # 模型更新時調整版本，讓舊的語音快取失效
+        self.model_version = TextToSpeech.model_version
         self.audio_dir = PathTool.join_path("app", "static", "audio")
-        # 英文詞性標注模型安裝，套件MeloTTS未安裝，遇到特俗英文字會報錯
-        nltk.download('averaged_perceptron_tagger_eng')
+        # 合成與編碼之間最多暫存幾句
+        self.pipeline_depth = 2
 
     def __load_model(self):
-        check(self.__class__.__name__, "ready to loaded")
+        # 模型常駐於 model_registry，只有第一次或被淘汰後才會重新載入
+        return model_registry.get(self.model_name, self.__build_model)
 
-        if self.model is None:
-            self.model = TTS(language='ZH', device=self.device)
-            self.speaker_ids = self.model.hps.data.spk2id
+    def __build_model(self):
+        check(self.__class__.__name__, "ready to loaded")
+        # 英文詞性標注模型安裝，套件MeloTTS未安裝，遇到特俗英文字會報錯
+        nltk.download('averaged_perceptron_tagger_eng')
+        model = TTS(language='ZH', device=self.device)
         check(self.__class__.__name__, "model loaded")
+        return model
 
     def generate_speech(self, input: str, user_id: str) -> Tuple[str, int]:
-        self.__load_model()
-        
-        # audio name
-        timestamp = datetime.datetime.now().strftime("%d_%H%M%S")
-        wav_name = f"audio_{user_id}_{timestamp}.wav"
-        m4a_name = f"audio_{user_id}_{timestamp}.m4a"
-        wav_path = PathTool.join_path(self.audio_dir, wav_name)
-        m4a_path = PathTool.join_path(self.audio_dir, m4a_name)
-
-        self.model.tts_to_file(input, self.speaker_ids['ZH'], wav_path, speed=self.speed)
-        
-        # 轉換格式並獲取音頻時長
-        self.__convert_wav_to_m4a(wav_path, m4a_path)
-        duration = self.__get_audio_duration(m4a_path)
-        self.__clear()
+        # 相同內容直接使用快取，不需要再合成及轉檔
+        cache_key = audio_cache.make_key(input, self.speaker, self.speed, self.model_version)
+        if (cached := audio_cache.get(cache_key)) is not None:
+            model_logger.info(f"[{self.__class__.__name__}] audio cache hit for {user_id}: {cached[0]}")
+            return cached
 
+        timestamp = datetime.datetime.now().strftime("%d_%H%M%S%f")
+        m4a_path = PathTool.join_path(self.audio_dir, f"audio_{user_id}_{timestamp}.tmp.m4a")
+        try:
+            duration = self.__synthesize_to_m4a(input, m4a_path)
+        except Exception:
+            m4a_path.unlink(missing_ok=True)
+            raise
+
+        m4a_name = audio_cache.put(cache_key, m4a_path, duration)
         return m4a_name, duration
 
-    @staticmethod
-    def __get_audio_duration(filepath):
+    def synthesize(self, input: str) -> Tuple[np.ndarray, int]:
+        """合成語音，回傳 (float32 單聲道 PCM, 取樣率)"""
+        model = self.__load_model()
+        speaker_ids = model.hps.data.spk2id
+        samples = model.tts_to_file(input, speaker_ids[self.speaker], None, speed=self.speed, quiet=True)
+        return np.asarray(samples, dtype=np.float32), model.hps.data.sampling_rate
+
+    def __synthesize_to_m4a(self, input: str, output_m4a: str) -> int:
+        """
+        逐句合成並同時編碼
+
+        合成的 PCM 經由有上限的佇列交給寫入執行緒，送進單一 ffmpeg 行程的 stdin，
+        合成第 N+1 句的同時 ffmpeg 正在編碼第 N 句。m4a 的 moov atom 需寫在可 seek 的輸出，
+        因此 ffmpeg 直接寫檔而非輸出到 stdout。
+
+        Returns:
+            音檔時長（毫秒），由樣本數計算，不需要 ffprobe
+        """
+        sample_rate = self.__load_model().hps.data.sampling_rate
+        process = (
+            ffmpeg
+            .input("pipe:", format="f32le", ar=sample_rate, ac=1)
+            .output(str(output_m4a), acodec='aac', ab='192k')
+            .global_args('-loglevel', 'error', '-nostats')
+            .overwrite_output()
+            .run_async(pipe_stdin=True, pipe_stderr=True)
+        )
+        chunks: queue.Queue = queue.Queue(maxsize=self.pipeline_depth)
+        write_errors = []
+
+        def feed_encoder():
+            # 寫入失敗後仍持續取出佇列，避免合成端卡在 put
+            while (chunk := chunks.get()) is not None:
+                if write_errors:
+                    continue
+                try:
+                    process.stdin.write(chunk)
+                except OSError as e:
+                    write_errors.append(e)
+
+        writer = threading.Thread(target=feed_encoder, name="tts-encoder", daemon=True)
+        writer.start()
+
+        # 與 MeloTTS 合併句子時相同，句子之間補一小段靜音
+        silence = np.zeros(int(sample_rate * 0.05 / self.speed), dtype=np.float32)
+        total_samples = 0
         try:
-            probe = ffmpeg.probe(filepath)
-            duration = float(probe['format']['duration'])  # duration 為浮動型數字
-            ms_duration = int(duration * 1000)  # 將秒數轉換為毫秒
-            return ms_duration
-        except ffmpeg.Error as e:
-            print(f"Error probing file {filepath}: {e}")
-            return 0  # 若發生錯誤，返回 0
-    
-    @staticmethod
-    def __convert_wav_to_m4a(input_wav: str, output_m4a: str):
-        ffmpeg.input(str(input_wav)).output(str(output_m4a), acodec='aac', ab='192k').run()
-
-    def __clear(self):
-        if hasattr(self, "model"):
-            del self.model
-            self.model = None
-        torch.cuda.empty_cache()
-        gc.collect()
+            for index, sentence in enumerate(split_sentences(input)):
+                samples, _ = self.synthesize(sentence)
+                if index:
+                    samples = np.concatenate([silence, samples])
+                total_samples += len(samples)
+                chunks.put(samples.tobytes())
+        finally:
+            chunks.put(None)
+            writer.join()
+            try:
+                process.stdin.close()
+            except OSError:
+                pass
+            stderr = process.stderr.read()
+            process.wait()
+
+        if write_errors or process.returncode != 0:
+            raise RuntimeError(f"ffmpeg encode failed: {stderr.decode('utf-8', errors='ignore')} {write_errors}")
+        return int(total_samples * 1000 / sample_rate)
+
+    def unload(self):
+        """從 model_registry 移除模型，釋放記憶體"""
+        model_registry.evict(self.model_name)
         check(self.__class__.__name__, "clear")
-        
-speech = Speech()
\ No newline at end of file
@@ -1,7 +1,10 @@
+import threading
 import torch
+from collections import OrderedDict
 from enum import Enum
 from transformers import T5ForConditionalGeneration, T5Tokenizer
 from app.utils.logger import model_logger
+from app.models.model_registry import model_registry
 
 def check(model_name: str, tag: str = None):
     if torch.cuda.is_available():
@@ -23,50 +26,92 @@ class Language(Enum):
     EN = "translate to en: "
 
 class Translator:
-    def __init__(self):
+    """
+    - translate_batch()：多句一次 padding 後送入同一個 generate
+    - 相同的英文句子（BLIP 常產生重複的描述）由 LRU 快取直接回傳
+    """
+    def __init__(self, device: str = None, memo_size: int = 1024, batch_size: int = 16):
         self.model_name = 'utrobinmv/t5_translate_en_ru_zh_small_1024'
-        self.model = None
-        self.tokenizer = None
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        self.memo_size = memo_size
+        self.batch_size = batch_size
+        self.memo_hits = 0
+        self.memo_misses = 0
+        self._memo: OrderedDict[tuple[Language, str], str] = OrderedDict()
+        self._lock = threading.Lock()
 
     def __load_model(self):
-        if self.model is not None:
-            del self.model
-            torch.cuda.empty_cache()  # 清理缓存
+        # 模型常駐於 model_registry，只有第一次或被淘汰後才會重新載入
+        return model_registry.get(self.model_name, self.__build_model)
 
-        self.model = T5ForConditionalGeneration.from_pretrained(self.model_name).to('cuda')
-        self.tokenizer = T5Tokenizer.from_pretrained(self.model_name)
+    def __build_model(self):
+        model = T5ForConditionalGeneration.from_pretrained(self.model_name).to(self.device)
+        model.eval()
+        tokenizer = T5Tokenizer.from_pretrained(self.model_name)
+        return model, tokenizer
 
     def translate_to_zh(self, user_input: str):
-        check(self.__class__.__name__, "translate")
-        self.__load_model()
-        # translate to Chinese
-        reply = self.__translate(user_input, Language.ZH)
-
-        self.__clear()
-        return reply
-    
-    def __translate(self, user_input: str, translate_to: Language = Language.ZH) -> str:
-        src_text = translate_to.value + user_input
-
-        input_ids = self.tokenizer(src_text, return_tensors="pt")
-
-        generated_tokens = self.model.generate(**input_ids.to('cuda'))
-
-        result = self.tokenizer.batch_decode(generated_tokens, skip_special_tokens=True)
-        
-        check(self.__class__.__name__, f"translate_result={result}")
-        return result[0]
-        
-    def __clear(self):
-        """清理模型和缓存"""
-        if hasattr(self, 'model') and self.model is not None:
-            del self.model
-            self.model = None
-        if hasattr(self, 'tokenizer') and self.tokenizer is not None:
-            del self.tokenizer
-            self.tokenizer = None
-        torch.cuda.empty_cache()
-        check(self.__class__.__name__, "clear")
+        return self.translate_batch([user_input], Language.ZH)[0]
+
+    def translate_batch(self, texts: list[str], translate_to: Language = Language.ZH) -> list[str]:
+        """翻譯多個句子，回傳順序與輸入相同"""
+        results: dict[str, str] = {}
+        pending: list[str] = []
+        with self._lock:
+            for text in dict.fromkeys(texts):
+                cached = self._memo.get((translate_to, text))
+                if cached is None:
+                    pending.append(text)
+                    self.memo_misses += 1
+                else:
+                    self._memo.move_to_end((translate_to, text))
+                    results[text] = cached
+                    self.memo_hits += 1
+
+        if pending:
+            check(self.__class__.__name__, "translate")
+            model, tokenizer = self.__load_model()
+            for i in range(0, len(pending), self.batch_size):
+                chunk = pending[i:i + self.batch_size]
+                results.update(zip(chunk, self.__translate(model, tokenizer, chunk, translate_to)))
+            self.__remember(translate_to, {text: results[text] for text in pending})
+
+        return [results[text] for text in texts]
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "device": self.device,
+                "memo_entries": len(self._memo),
+                "memo_hits": self.memo_hits,
+                "memo_misses": self.memo_misses,
+            }
+
+    def __remember(self, translate_to: Language, translated: dict[str, str]):
+        if not self.memo_size:
+            return
+        with self._lock:
+            for text, result in translated.items():
+                self._memo[(translate_to, text)] = result
+                self._memo.move_to_end((translate_to, text))
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
 
+    def __translate(self, model, tokenizer, user_inputs: list[str], translate_to: Language = Language.ZH) -> list[str]:
+        src_texts = [translate_to.value + user_input for user_input in user_inputs]
 
-translator = Translator()
+        # 不同長度的句子補齊到同一長度，一次 generate
+        input_ids = tokenizer(src_texts, return_tensors="pt", padding=True)
+
+        with torch.inference_mode():
+            generated_tokens = model.generate(**input_ids.to(self.device))
+
+        result = tokenizer.batch_decode(generated_tokens, skip_special_tokens=True)
+
+        model_logger.debug(f"[Translator] translate_result={result}")
+        return result
+
+    def unload(self):
+        """從 model_registry 移除模型，釋放記憶體"""
+        model_registry.evict(self.model_name)
+        check(self.__class__.__name__, "clear")
@@ -1,33 +1,102 @@
+import asyncio
 import time
+from collections import defaultdict, deque
 import psutil
 import GPUtil
 from fastapi import Request
+from app.config import Monitor
 from app.utils.logger import system_logger
+from app.utils.metrics import Histogram
+
+
+class SystemSampler:
+    """
+    背景定時記錄系統資源
+
+    在 lifespan 啟動，每 interval 秒取樣一次 CPU、記憶體及 GPU，存入 ring buffer。
+    GPUtil 會呼叫 nvidia-smi，放在執行緒中避免阻塞 event loop。
+    """
+    def __init__(self, interval: float = 5, capacity: int = 720):
+        self.interval = interval
+        self.samples: deque[dict] = deque(maxlen=capacity)
+        self._task: asyncio.Task = None
+        self._gpu_available = True
+
+    async def start(self):
+        if self._task is None:
+            psutil.cpu_percent()  # 第一次呼叫只建立基準值
+            self._task = asyncio.create_task(self.__run(), name="system-sampler")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def latest(self) -> dict:
+        return self.samples[-1] if self.samples else {}
+
+    def history(self, limit: int = None) -> list[dict]:
+        samples = list(self.samples)
+        return samples[-limit:] if limit else samples
+
+    async def __run(self):
+        while True:
+            try:
+                self.samples.append(await asyncio.to_thread(self.__sample))
+            except Exception as e:
+                system_logger.warning(f"System sampling error: {e}")
+            await asyncio.sleep(self.interval)
+
+    def __sample(self) -> dict:
+        memory = psutil.virtual_memory()
+        sample = {
+            "time": time.time(),
+            "cpu_percent": psutil.cpu_percent(),
+            "memory_percent": memory.percent,
+            "memory_used_mb": round(memory.used / 1024**2, 1),
+            "gpus": [],
+        }
+
+        # GPU資源監控，沒有 GPU 時只警告一次
+        if self._gpu_available:
+            try:
+                sample["gpus"] = [
+                    {
+                        "id": gpu.id,
+                        "name": gpu.name,
+                        "load_percent": round(gpu.load * 100, 1),
+                        "memory_used_mb": gpu.memoryUsed,
+                        "memory_total_mb": gpu.memoryTotal,
+                    }
+                    for gpu in GPUtil.getGPUs()
+                ]
+            except Exception as e:
+                self._gpu_available = False
+                system_logger.warning(f"GPU monitoring error: {e}")
+        return sample
+
+
+system_sampler = SystemSampler(interval=Monitor.sample_interval, capacity=Monitor.history_size)
+
+# 每個路由的請求耗時（以路由樣板區分，例如 /line/static/audio/{audio_name}）
+route_latency: dict[str, Histogram] = defaultdict(Histogram)
+
+
+def route_latency_snapshot() -> dict:
+    return {route: histogram.snapshot() for route, histogram in route_latency.items()}
+
 
 async def system_monitoring_middleware(request: Request, call_next):
-    start_time = time.time()
-    
-    # 記錄系統資源
-    cpu_usage = psutil.cpu_percent()
-    memory = psutil.virtual_memory()
-    
-    system_logger.info(f"CPU Usage: {cpu_usage}%")
-    system_logger.info(f"Memory Usage: {memory.percent}%")
-    
-    # GPU資源監控
-    try:
-        gpus = GPUtil.getGPUs()
-        for gpu in gpus:
-            system_logger.info(f"GPU {gpu.id}: {gpu.name}")
-            system_logger.info(f"GPU Memory: {gpu.memoryUsed}/{gpu.memoryTotal} MB")
-    except Exception as e:
-        system_logger.warning(f"GPU monitoring error: {e}")
-    
+    start_time = time.perf_counter()
+
     # 執行請求
     response = await call_next(request)
-    
-    # 計算請求耗時
-    process_time = time.time() - start_time
-    system_logger.info(f"Request processing time: {process_time} seconds")
-    
-    return response
\ No newline at end of file
+
+    # 計算請求耗時，只記錄到直方圖，不逐筆寫 log
+    process_time = time.perf_counter() - start_time
+    route = request.scope.get("route")
+    route_path = getattr(route, "path", None) or "unmatched"
+    route_latency[f"{request.method} {route_path}"].observe(process_time)
+
+    return response
@@ -0,0 +1,85 @@
+"""
+推理任務的准入控制
+
+每個階段（caption、story、audio）各有一個 JobQueue：worker 數即同時執行的上限，
+佇列有上限，排隊超過 deadline 秒的任務不執行。webhook 收到請求時先嘗試放入佇列，
+已滿就直接回覆「忙碌中」，不更新用戶狀態，避免一波照片同時壓上 GPU。
+
+佇列在每個 web worker 中各有一份，限制已在 app/config.py 依 WEB_CONCURRENCY 平分（見 Admission）。
+"""
+import asyncio
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable
+
+from app.config import Admission
+from app.services.job_queue import Job, JobQueue
+from app.utils.logger import system_logger
+
+
+@dataclass
+class StageLimit:
+    concurrency: int
+    queue_size: int
+    deadline: float  # 秒，0 表示不限制
+
+
+class AdmissionController:
+    """
+    - submit()：放入該階段的佇列，已滿時回傳 False（不拋出例外），由呼叫端回覆忙碌訊息
+    - on_expired：排隊超過 deadline 時呼叫，可用來推送忙碌訊息並還原狀態
+    - stats()：各階段的排隊數、執行中數量、拒絕數、逾時數及等待時間
+    """
+    def __init__(self, limits: dict[str, StageLimit]):
+        self.limits = limits
+        self.queues = {
+            stage: JobQueue(workers=limit.concurrency, max_size=limit.queue_size)
+            for stage, limit in limits.items()
+        }
+        self.rejected = {stage: 0 for stage in limits}
+
+    async def start(self):
+        for queue in self.queues.values():
+            await queue.start()
+
+    async def stop(self):
+        for queue in self.queues.values():
+            await queue.stop()
+
+    def submit(
+            self,
+            stage: str,
+            name: str,
+            func: Callable[..., Awaitable[Any]],
+            *args,
+            on_expired: Callable[[], Awaitable[Any]] = None,
+        ) -> bool:
+        deadline = self.limits[stage].deadline
+        job = Job(name, func, args, on_expired=on_expired)
+        if deadline:
+            job.deadline = job.enqueued_at + deadline
+        try:
+            self.queues[stage].enqueue(job)
+            return True
+        except asyncio.QueueFull:
+            self.rejected[stage] += 1
+            system_logger.warning(f"[Admission] {stage} queue full, rejected {name}")
+            return False
+
+    def stats(self) -> dict:
+        return {
+            stage: {
+                "concurrency": self.limits[stage].concurrency,
+                "queue_size": self.limits[stage].queue_size,
+                "deadline": self.limits[stage].deadline,
+                "rejected": self.rejected[stage],
+                **queue.stats(),
+            }
+            for stage, queue in self.queues.items()
+        }
+
+
+admission = AdmissionController({
+    "caption": StageLimit(Admission.caption_concurrency, Admission.caption_queue_size, Admission.caption_deadline),
+    "story": StageLimit(Admission.story_concurrency, Admission.story_queue_size, Admission.story_deadline),
+    "audio": StageLimit(Admission.audio_concurrency, Admission.audio_queue_size, Admission.audio_deadline),
+})
@@ -0,0 +1,146 @@
+"""
+背景任務佇列
+
+webhook 只負責驗證、更新狀態及回覆「收到」，耗時的模型推理（解讀圖片、生成故事、生成語音）
+放入佇列，由固定數量的 worker 執行並推送結果。各階段的佇列見 app/services/admission.py。
+"""
+import asyncio
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable, Optional
+
+from app.utils.logger import system_logger
+from app.utils.metrics import Histogram
+
+
+@dataclass
+class Job:
+    name: str
+    func: Callable[..., Awaitable[Any]]
+    args: tuple = ()
+    kwargs: dict = field(default_factory=dict)
+    enqueued_at: float = field(default_factory=time.monotonic)
+    # 超過此時間（time.monotonic()）仍未開始的任務不執行，改呼叫 on_expired
+    deadline: Optional[float] = None
+    on_expired: Optional[Callable[[], Awaitable[Any]]] = None
+
+
+class JobQueue:
+    """
+    asyncio worker pool
+
+    - submit()：放入佇列後立即返回，佇列已滿時拋出 asyncio.QueueFull
+    - enqueue()：放入已建立的 Job（可設定 deadline 及 on_expired）
+    - stats()：佇列長度、執行中數量、逾時數，以及各任務的等待時間、執行時間
+    """
+    def __init__(self, workers: int = 2, max_size: int = 0):
+        self.worker_count = workers
+        self.max_size = max_size
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.expired = 0
+        self.running = 0
+        self.wait_time = Histogram()
+        self.run_time = Histogram()
+        self.wait_time_by_job: dict[str, Histogram] = defaultdict(Histogram)
+        self.run_time_by_job: dict[str, Histogram] = defaultdict(Histogram)
+        self._queue: asyncio.Queue[Job] = None
+        self._workers: list[asyncio.Task] = []
+
+    @property
+    def depth(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def start(self):
+        if self._workers:
+            return
+        self.__ensure_queue()
+        self._workers = [
+            asyncio.create_task(self.__worker(i), name=f"job-worker-{i}")
+            for i in range(self.worker_count)
+        ]
+        system_logger.info(f"[JobQueue] started {self.worker_count} workers")
+
+    async def stop(self, timeout: float = 5):
+        """等待佇列中的任務完成（最多 timeout 秒），再停止 worker"""
+        if not self._workers:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            system_logger.warning(f"[JobQueue] stopped with {self.depth} pending jobs")
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def submit(self, name: str, func: Callable[..., Awaitable[Any]], *args, **kwargs) -> Job:
+        return self.enqueue(Job(name, func, args, kwargs))
+
+    def enqueue(self, job: Job) -> Job:
+        self.__ensure_queue().put_nowait(job)
+        self.submitted += 1
+        system_logger.info(f"[JobQueue] submit {job.name}, depth={self.depth}")
+        return job
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.worker_count,
+            "depth": self.depth,
+            "running": self.running,
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "failed": self.failed,
+            "expired": self.expired,
+            "wait_time": self.wait_time.snapshot(),
+            "run_time": self.run_time.snapshot(),
+            "jobs": {
+                name: {
+                    "wait_time": self.wait_time_by_job[name].snapshot(),
+                    "run_time": self.run_time_by_job[name].snapshot(),
+                }
+                for name in self.run_time_by_job
+            },
+        }
+
+    def __ensure_queue(self) -> asyncio.Queue:
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.max_size)
+        return self._queue
+
+    async def __worker(self, index: int):
+        while True:
+            job = await self._queue.get()
+            started_at = time.monotonic()
+            waited = started_at - job.enqueued_at
+            self.wait_time.observe(waited)
+            self.wait_time_by_job[job.name].observe(waited)
+            if job.deadline is not None and started_at > job.deadline:
+                await self.__expire(job, waited)
+                continue
+            self.running += 1
+            try:
+                await job.func(*job.args, **job.kwargs)
+                self.completed += 1
+            except Exception:
+                self.failed += 1
+                system_logger.exception(f"[JobQueue] worker-{index} job {job.name} failed")
+            finally:
+                elapsed = time.monotonic() - started_at
+                self.run_time.observe(elapsed)
+                self.run_time_by_job[job.name].observe(elapsed)
+                self.running -= 1
+                self._queue.task_done()
+
+    async def __expire(self, job: Job, waited: float):
+        self.expired += 1
+        system_logger.warning(f"[JobQueue] job {job.name} expired after waiting {waited:.1f}s")
+        try:
+            if job.on_expired is not None:
+                await job.on_expired()
+        except Exception:
+            system_logger.exception(f"[JobQueue] on_expired of {job.name} failed")
+        finally:
+            self._queue.task_done()
@@ -0,0 +1,152 @@
+"""
+webhook 事件去重
+
+LINE 在 webhook 逾時時會重送同一個事件（deliveryContext.isRedelivery 爲 true，webhookEventId 不變），
+同一張照片若被處理兩次，會重複跑 BLIP 及 LLM，並重複 update_state 弄亂狀態。
+在派送前以 webhookEventId 檢查：近 ttl 秒內見過的事件直接丟棄。
+
+事件在收到時即記錄（而不是處理完成後），重送通常發生在處理尚未結束時。
+event loop 上只查記憶體；SQLite 的寫入由背景任務分批在執行緒中進行，只有重送事件才會在執行緒中查詢 SQLite。
+"""
+import asyncio
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Optional
+
+from app.utils.logger import linebot_logger
+
+
+class SQLiteEventLog:
+    """
+    已收到的 webhookEventId，存在獨立的 SQLite 檔案，重啓後仍可去重
+
+    不與用戶狀態共用檔案：SQLite 的寫入鎖以檔案爲單位，批次寫入時狀態的寫入不必等待。
+
+    每 prune_every 次寫入刪除一次過期資料。
+    """
+    def __init__(self, db_path: str, prune_every: int = 1000):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.prune_every = prune_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS webhook_events ("
+            "event_id TEXT PRIMARY KEY, "
+            "seen_at REAL NOT NULL)"
+        )
+
+    def contains(self, event_id: str, since: float) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM webhook_events WHERE event_id = ? AND seen_at >= ?", (event_id, since)
+            ).fetchone()
+        return row is not None
+
+    def add_many(self, events: list[tuple[str, float]], expire_before: float):
+        """一次寫入多筆 (event_id, seen_at)，在同一個 transaction 中完成"""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO webhook_events (event_id, seen_at) VALUES (?, ?) "
+                    "ON CONFLICT(event_id) DO UPDATE SET seen_at = excluded.seen_at",
+                    events,
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            writes, self._writes = self._writes, self._writes + len(events)
+            if writes // self.prune_every != self._writes // self.prune_every:
+                self._conn.execute("DELETE FROM webhook_events WHERE seen_at < ?", (expire_before,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class EventDeduplicator:
+    """
+    近期收到的 webhookEventId
+
+    - is_duplicate(event)：見過的事件回傳 True，否則記錄並回傳 False
+    - 記憶體中依收到時間排序，超過 ttl 或 max_size 時從最舊的開始移除
+    - 有 persist 時，記憶體中找不到的重送事件（isRedelivery）再查 SQLite，涵蓋重啓前收到的事件
+    - 寫入 persist 的事件先放在 _pending，由背景任務分批寫入；flush() 等待尚未寫入的事件寫完
+    - 沒有 webhookEventId 的事件不去重
+    """
+    def __init__(self, ttl: float = 3600, max_size: int = 50000, persist: SQLiteEventLog = None):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.persist = persist
+        self.received = 0
+        self.redeliveries = 0
+        self.duplicates_dropped = 0
+        self._seen: OrderedDict[str, float] = OrderedDict()  # event_id -> 收到的時間（time.time()）
+        self._pending: list[tuple[str, float]] = []
+        self._writer: asyncio.Task = None
+
+    async def is_duplicate(self, event) -> bool:
+        event_id: Optional[str] = getattr(event, "webhook_event_id", None)
+        delivery_context = getattr(event, "delivery_context", None)
+        redelivery = bool(getattr(delivery_context, "is_redelivery", False))
+        self.received += 1
+        self.redeliveries += redelivery
+        if not event_id:
+            return False
+
+        now = time.time()
+        self.__expire(now)
+        duplicate = event_id in self._seen
+        if not duplicate:
+            # 查詢 SQLite 前先記錄，同時送達的同一事件不會都通過檢查
+            self._seen[event_id] = now
+            if redelivery and self.persist is not None:
+                duplicate = await asyncio.to_thread(self.persist.contains, event_id, now - self.ttl)
+
+        if duplicate:
+            self.duplicates_dropped += 1
+            linebot_logger.info(f"[EventDedup] drop duplicate event {event_id} (redelivery={redelivery})")
+            return True
+
+        if self.persist is not None:
+            self._pending.append((event_id, now))
+            if self._writer is None or self._writer.done():
+                self._writer = asyncio.create_task(self.__write(), name="event-dedup-writer")
+        return False
+
+    async def flush(self):
+        """等待尚未寫入 persist 的事件寫完，關閉時呼叫"""
+        while self._writer is not None and not self._writer.done():
+            await asyncio.shield(self._writer)
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received,
+            "redeliveries": self.redeliveries,
+            "duplicates_dropped": self.duplicates_dropped,
+            "tracked": len(self._seen),
+            "persistent": self.persist is not None,
+            "pending_writes": len(self._pending),
+        }
+
+    async def __write(self):
+        while self._pending:
+            batch, self._pending = self._pending, []
+            try:
+                await asyncio.to_thread(self.persist.add_many, batch, time.time() - self.ttl)
+            except Exception:
+                linebot_logger.exception(f"[EventDedup] failed to persist {len(batch)} events")
+
+    def __expire(self, now: float):
+        while self._seen:
+            event_id, seen_at = next(iter(self._seen.items()))
+            if seen_at >= now - self.ttl and len(self._seen) < self.max_size:
+                break
+            del self._seen[event_id]
@@ -1,4 +1,6 @@
 import json
+from enum import Enum
+from typing import Any, Awaitable, Callable, Optional
 
 # line tools
 from linebot.v3 import WebhookHandler
@@ -14,6 +16,8 @@ from linebot.v3.webhooks import (
 from app.config import LineBot
 import inspect
 from app.utils.logger import linebot_logger
+from app.services.linebot.user_dispatcher import UserEventDispatcher
+from app.services.linebot.event_dedup import EventDeduplicator, SQLiteEventLog
 from app.services.linebot.msg_services import (
     NonePeriod,
     PhotoCaptioningPeriod,
@@ -25,21 +29,35 @@ from app.services.linebot.msg_services import (
     AudioGeneratingPeriod,
     Action,
     Status,
+    TRANSITIONS,
     User,
 )
 
 class AsyncWebhookHandler(WebhookHandler):
     """Async Webhook Handler."""
 
+    def __init__(self, channel_secret, max_concurrency: int = 16, deduplicator: EventDeduplicator = None):
+        super().__init__(channel_secret)
+        self.dispatcher = UserEventDispatcher(max_concurrency)
+        self.deduplicator = deduplicator or EventDeduplicator()
+
     async def handle(self, body, signature):
         """Handle webhook asynchronously.
 
+        Events are queued per user: one user's events run in order without
+        overlapping, different users run concurrently. Returns once the
+        events are queued. Redelivered events already seen (same
+        webhookEventId) are dropped before dispatch.
+
         :param str body: Webhook request body (as text)
         :param str signature: X-Line-Signature value (as text)
         """
         payload = self.parser.parse(body, signature, as_payload=True)
 
         for event in payload.events:
+            if await self.deduplicator.is_duplicate(event):
+                continue
+
             func = None
             key = None
 
@@ -58,7 +76,16 @@ class AsyncWebhookHandler(WebhookHandler):
             if func is None:
                 linebot_logger.info('No handler for ' + key + ' and no default handler')
             else:
-                await self.__invoke_func(func, event, payload)
+                self.dispatcher.submit(self.__get_event_key(event), self.__invoke_func, func, event, payload)
+
+    @staticmethod
+    def __get_event_key(event) -> str:
+        """以用戶區分事件，沒有 user_id 時（群組等）改用來源 id"""
+        source = event.source
+        for attr in ("user_id", "group_id", "room_id"):
+            if key := getattr(source, attr, None):
+                return key
+        return "unknown"
 
     @classmethod
     async def __invoke_func(cls, func, event, payload):
@@ -80,170 +107,145 @@ class AsyncWebhookHandler(WebhookHandler):
         arg_spec = inspect.getfullargspec(func)
         return (arg_spec.varargs is not None, len(arg_spec.args))
 
-async_handler = AsyncWebhookHandler(LineBot.channel_secret)
+async_handler = AsyncWebhookHandler(
+    LineBot.channel_secret,
+    LineBot.EVENT_CONCURRENCY,
+    EventDeduplicator(
+        ttl=LineBot.EVENT_DEDUP_TTL,
+        max_size=LineBot.EVENT_DEDUP_SIZE,
+        persist=SQLiteEventLog(LineBot.EVENT_DEDUP_DB_PATH) if LineBot.EVENT_DEDUP_PERSIST else None,
+    ),
+)
 
-# 文字訊息
-@async_handler.add(event=MessageEvent, message=TextMessageContent)
-async def text_message_event(event):
-    # 准許的狀態：modifying
-    linebot_logger.info(f"[Text] {event}")
-    
-    user = User(event.source.user_id)
-    
+class EventKind(Enum):
+    TEXT = "text"
+    STICKER = "sticker"
+    IMAGE = "image"
+    POSTBACK = "postback"
+
+
+Handler = Callable[[Any, User, Optional[dict]], Awaitable[None]]
+
+
+def _period(period_cls, method: str, *args) -> Handler:
+    """建立該事件的 period（背景任務需要保留 event），呼叫 method(user, *args)"""
+    async def handler(event, user: User, postback: dict = None):
+        await getattr(period_cls(event), method)(user, *args)
+    handler.__qualname__ = f"{period_cls.__name__}.{method}"
+    return handler
+
+
+def _postback(period_cls, method: str) -> Handler:
+    """postback 的 type、message 作爲參數傳入：method(user, type, message)"""
+    async def handler(event, user: User, postback: dict = None):
+        await getattr(period_cls(event), method)(user, postback.get("type"), postback.get("message"))
+    handler.__qualname__ = f"{period_cls.__name__}.{method}"
+    return handler
+
+
+async def _ignore(event, user: User, postback: dict = None):
+    """該狀態下不回應"""
+
+
+# 文字及貼圖在各狀態的回應相同（貼圖亦以 "Text Message" 模板回應打斷）
+_MESSAGE_HANDLERS: dict[Status, Handler] = {
     # 用戶打斷，回應打斷訊息
-    if user.current_status == Status.NONE:
-        state_service = NonePeriod(event)
-        await state_service.handle_interrupt_message(user)
-    elif user.current_status == Status.PHOTO_CAPTIONING:
-        state_service = PhotoCaptioningPeriod(event)
-        await state_service.handle_interrupt_message(user, "Text Message")
-    elif user.current_status == Status.USER_ACTIONING:
-        state_service = UserActioningPeriod(event)
-        await state_service.resend_menu_select_message(user)
-    elif user.current_status == Status.STORY_GENERATING:
-        state_service = StoryGeneratingPeriod(event)
-        await state_service.handle_interrupt_message(user, "Text Message")
-    elif user.current_status == Status.STORY_PREVIEW:
-        state_service = StoryPreviewPeriod(event)
-        await state_service.resend_menu_select_message(user)
-    elif user.current_status == Status.AUDIO_GENERATING:
-        # 回應貼圖，儘快完成語音製作
-        action_service = AudioGeneratingPeriod(event)
-        await action_service.send_waiting_sticker(user)
-    
+    Status.NONE: _period(NonePeriod, "handle_interrupt_message"),
+    Status.PHOTO_CAPTIONING: _period(PhotoCaptioningPeriod, "handle_interrupt_message", "Text Message"),
+    Status.USER_ACTIONING: _period(UserActioningPeriod, "resend_menu_select_message"),
+    Status.STORY_GENERATING: _period(StoryGeneratingPeriod, "handle_interrupt_message", "Text Message"),
+    Status.STORY_PREVIEW: _period(StoryPreviewPeriod, "resend_menu_select_message"),
+    # 回應貼圖，儘快完成語音製作
+    Status.AUDIO_GENERATING: _period(AudioGeneratingPeriod, "send_waiting_sticker"),
     # 准許回應，須對内容處理
-    elif user.current_status == Status.CAPTION_MODIFYING:
-        action_service = CaptionModifyingPeriod(event)
-        await action_service.update_photo_caption_by_user(user)
-    elif user.current_status == Status.STORY_MODIFYING:
-        action_service = StoryModifyingPeriod(event)
-        await action_service.update_story_by_user(user)
-    elif user.current_status == Status.STORY_USER_PRODUCING:
-        action_service = StoryModifyingPeriod(event)
-        await action_service.append_story_by_user(user)
+    Status.CAPTION_MODIFYING: _period(CaptionModifyingPeriod, "update_photo_caption_by_user"),
+    Status.STORY_MODIFYING: _period(StoryModifyingPeriod, "update_story_by_user"),
+    Status.STORY_USER_PRODUCING: _period(StoryModifyingPeriod, "append_story_by_user"),
+}
+
+_IMAGE_HANDLERS: dict[Status, Handler] = {
+    # 模型推理圖片内容，推理完會推送結果和選單
+    Status.NONE: _period(PhotoCaptioningPeriod, "photo_captioning"),
+    Status.PHOTO_CAPTIONING: _period(PhotoCaptioningPeriod, "handle_interrupt_message", "Image Message"),
+    Status.USER_ACTIONING: _period(UserActioningPeriod, "resend_menu_select_message"),
+    Status.STORY_GENERATING: _period(StoryGeneratingPeriod, "handle_interrupt_message", "Image Message"),
+    Status.STORY_PREVIEW: _period(StoryPreviewPeriod, "resend_menu_select_message"),
+    # 生成音檔狀態為低調背景執行，用戶會以爲在 NONE 狀態，所以可以偷偷回應等我一下貼圖
+    Status.AUDIO_GENERATING: _period(AudioGeneratingPeriod, "send_waiting_sticker"),
+    Status.CAPTION_MODIFYING: _ignore,
+    Status.STORY_MODIFYING: _ignore,
+    Status.STORY_USER_PRODUCING: _ignore,
+}
+
+# 條件根據 quick reply 裏 data 的 action，其餘組合不回應
+_POSTBACK_HANDLERS: dict[tuple[Status, Action], Handler] = {
+    # 回傳story同時有附上功能選單(會判斷是否有延申功能)
+    (Status.USER_ACTIONING, Action.TYPE_COMFIRM): _postback(StoryGeneratingPeriod, "handle_generating_story"),
+    (Status.USER_ACTIONING, Action.MODIFY_REQUEST): _period(CaptionModifyingPeriod, "inform_modifying_start"),
+    (Status.USER_ACTIONING, Action.STORY_CLOSED): _period(AudioGeneratingPeriod, "generating_audio"),
+    # 延伸故事時 type、message 由 user cache 取得
+    (Status.STORY_PREVIEW, Action.STORY_EXTEND): _postback(StoryGeneratingPeriod, "handle_generating_story"),
+    (Status.STORY_PREVIEW, Action.MODIFY_REQUEST): _period(StoryModifyingPeriod, "inform_modifying_start"),
+    (Status.STORY_PREVIEW, Action.USER_PRODUCE_REQUEST): _period(StoryModifyingPeriod, "inform_produce_start"),
+    (Status.STORY_PREVIEW, Action.STORY_CLOSED): _period(AudioGeneratingPeriod, "generating_audio"),
+}
+
+# (狀態, 事件類型, 動作) -> handler，訊息事件的動作爲 None
+DISPATCH: dict[tuple[Status, EventKind, Optional[Action]], Handler] = {
+    **{(status, EventKind.TEXT, None): handler for status, handler in _MESSAGE_HANDLERS.items()},
+    **{(status, EventKind.STICKER, None): handler for status, handler in _MESSAGE_HANDLERS.items()},
+    **{(status, EventKind.IMAGE, None): handler for status, handler in _IMAGE_HANDLERS.items()},
+    **{(status, EventKind.POSTBACK, action): handler for (status, action), handler in _POSTBACK_HANDLERS.items()},
+}
+
+
+def validate_dispatch(dispatch: dict[tuple[Status, EventKind, Optional[Action]], Handler]):
+    """每個狀態都要處理文字、貼圖、圖片；postback 的動作必須是該狀態的合法轉換，否則拋出 ValueError"""
+    for kind in (EventKind.TEXT, EventKind.STICKER, EventKind.IMAGE):
+        if missing := [status.value for status in Status if (status, kind, None) not in dispatch]:
+            raise ValueError(f"no {kind.value} handler for states: {missing}")
+    for status, kind, action in dispatch:
+        if kind == EventKind.POSTBACK and (status, action) not in TRANSITIONS:
+            raise ValueError(f"postback {action} is not a valid transition from {status.value}")
+
+
+validate_dispatch(DISPATCH)
+
+
+def resolve(status: Status, kind: EventKind, action: Action = None) -> Optional[Handler]:
+    return DISPATCH.get((status, kind, action))
+
+
+async def dispatch(kind: EventKind, event, postback: dict = None):
+    """依用戶當前狀態查表呼叫 handler"""
+    user = await User.load(event.source.user_id)
+    action = Action(postback.get("action")) if postback is not None else None
+    linebot_logger.debug("[%s] %s", kind.value, postback if postback is not None else event)
+    linebot_logger.debug("[%s] user.__dict__=%s", kind.value, user.__dict__)
+
+    if (handler := resolve(user.current_status, kind, action)) is not None:
+        await handler(event, user, postback)
 
 
+# 文字訊息
+@async_handler.add(event=MessageEvent, message=TextMessageContent)
+async def text_message_event(event):
+    await dispatch(EventKind.TEXT, event)
+
 
 # 貼圖訊息
 @async_handler.add(event=MessageEvent, message=StickerMessageContent)
 async def sticker_msg_event(event):
-    user = User(event.source.user_id)
-    linebot_logger.info(f"[Sticker] {event}")
-    linebot_logger.info(f"[Sticker] {user.__dict__=}")
-
-    # 用戶傳貼圖打斷，回應打斷訊息
-    if user.current_status == Status.NONE:
-        state_service = NonePeriod(event)
-        await state_service.handle_interrupt_message(user)
-    elif user.current_status == Status.PHOTO_CAPTIONING:
-        state_service = PhotoCaptioningPeriod(event)
-        await state_service.handle_interrupt_message(user, "Text Message")
-    elif user.current_status == Status.USER_ACTIONING:
-        state_service = UserActioningPeriod(event)
-        await state_service.resend_menu_select_message(user)
-    elif user.current_status == Status.STORY_GENERATING:
-        state_service = StoryGeneratingPeriod(event)
-        await state_service.handle_interrupt_message(user, "Text Message")
-    elif user.current_status == Status.STORY_PREVIEW:
-        state_service = StoryPreviewPeriod(event)
-        await state_service.resend_menu_select_message(user)
-    elif user.current_status == Status.AUDIO_GENERATING:
-        action_service = AudioGeneratingPeriod(event)
-        await action_service.send_waiting_sticker(user)
-    elif user.current_status == Status.CAPTION_MODIFYING:
-        action_service = CaptionModifyingPeriod(event)
-        await action_service.update_photo_caption_by_user(user)
-
-    elif user.current_status == Status.STORY_MODIFYING:
-        action_service = StoryModifyingPeriod(event)
-        await action_service.update_story_by_user(user)
-    elif user.current_status == Status.STORY_USER_PRODUCING:
-        action_service = StoryModifyingPeriod(event)
-        await action_service.append_story_by_user(user)
+    await dispatch(EventKind.STICKER, event)
 
 
 # 照片訊息
 @async_handler.add(event=MessageEvent, message=ImageMessageContent)
-async def img_msg_event(event): 
-    # 准許的狀態：None
-    user = User(event.source.user_id)
-    linebot_logger.info(f"[Image] {event}")
-    linebot_logger.info(f"[Image] {user.__dict__=}")
-
-    if user.current_status == Status.NONE:
-        # 模型推理圖片内容，推理完會推送結果和選單
-        action_service = PhotoCaptioningPeriod(event)
-        await action_service.photo_captioning(user)
-        
-    elif user.current_status == Status.PHOTO_CAPTIONING:
-        action_service = PhotoCaptioningPeriod(event)
-        await action_service.handle_interrupt_message(user, "Image Message")
-    
-    elif user.current_status == Status.USER_ACTIONING:
-        action_service = UserActioningPeriod(event)
-        await action_service.resend_menu_select_message(user)
-
-    elif user.current_status == Status.STORY_GENERATING:
-        state_service = StoryGeneratingPeriod(event)
-        await state_service.handle_interrupt_message(event, "Image Message")
-    
-    elif user.current_status == Status.STORY_PREVIEW:
-        state_service = StoryPreviewPeriod(event)
-        await state_service.resend_menu_select_message(user)
-    
-    # 生成音檔狀態為低調背景執行，用戶會以爲在 NONE 狀態，所以可以偷偷回應等我一下貼圖 
-    elif user.current_status == Status.AUDIO_GENERATING:
-        action_service = AudioGeneratingPeriod(event)
-        await action_service.send_waiting_sticker(user)
-    
-    elif user.current_status in (Status.STORY_MODIFYING, Status.STORY_USER_PRODUCING, Status.CAPTION_MODIFYING):
-        pass
-
-
-    
+async def img_msg_event(event):
+    await dispatch(EventKind.IMAGE, event)
+
+
 # 回應訊息
 @async_handler.add(event=PostbackEvent)
 async def postback_event(event):
-
-    user = User(event.source.user_id)
-    data_dict = json.loads(event.postback.data)
-    action = Action(data_dict.get("action"))
-    type = data_dict.get("type")
-    message = data_dict.get("message")
-
-    linebot_logger.info(f"[Postback] {data_dict}")
-    linebot_logger.info(f"[Postback] {user.__dict__=}")
-
-    if user.current_status == Status.USER_ACTIONING:
-        # 條件根據 quick reply 裏 data 的 action
-        if action == Action.TYPE_COMFIRM:
-            state_service = StoryGeneratingPeriod(event)
-            await state_service.handle_generating_story(user, type, message) # 回傳story同時有附上功能選單(會判斷是否有延申功能)
-
-        elif action == Action.MODIFY_REQUEST:
-            action_service = CaptionModifyingPeriod(event)
-            await action_service.inform_modifying_start(user)
-
-        elif action == Action.STORY_CLOSED:
-            state_service = AudioGeneratingPeriod(event)
-            await state_service.generating_audio(user)
-            
-    elif user.current_status == Status.STORY_PREVIEW:
-        if action == Action.STORY_EXTEND:
-            action_service = StoryGeneratingPeriod(event)
-            await action_service.handle_generating_story(user, type)
-        
-        elif action == Action.MODIFY_REQUEST:
-            action_service = StoryModifyingPeriod(event)
-            await action_service.inform_modifying_start(user)
-        
-        elif action == Action.USER_PRODUCE_REQUEST:
-            action_service = StoryModifyingPeriod(event)
-            await action_service.inform_produce_start(user)
-        
-        elif action == Action.STORY_CLOSED:
-            action_service = AudioGeneratingPeriod(event)
-            await action_service.generating_audio(user)
-
-        
-    
\ No newline at end of file
+    await dispatch(EventKind.POSTBACK, event, json.loads(event.postback.data))
@@ -1,30 +1,31 @@
 import asyncio
 import json
 import random
+import time
+from contextlib import contextmanager
 from typing import TypedDict, Union
-from PIL import Image
 from enum import Enum
-from pathlib import Path
 
 # self package
 from app.utils.image_utils import ImageHelper
-from app.utils.utils import PathTool, JsonTool
+from app.utils.utils import PathTool
+from app.utils.template_registry import template_registry
 from app.utils.logger import linebot_logger
-from app.config import EnvConfig, LineBot
+from app.utils.metrics import Histogram
+from app.config import EnvConfig, ImageCaption, LineBot
+from app.services.linebot.profile_cache import ProfileCache
+from app.services.admission import admission
+from app.utils.state_store import async_state_store
 
 # model module
-from app.models.text_generation import mandrine_llm
-from app.models.text_to_speech import speech
-from app.models.image_to_text import image2text
-from app.models.translator import translator
+from app.models.singletons import image2text, mandrine_llm, speech, translator
+from app.models.caption_cache import caption_cache, dhash
 
 # line module
 from linebot.v3.messaging import (
     Configuration,
     AsyncApiClient,
-    ApiClient,
     AsyncMessagingApi,
-    MessagingApi,
     AsyncMessagingApiBlob,
     QuickReply,
     QuickReplyItem,
@@ -43,6 +44,12 @@ configuration = Configuration(access_token=LineBot.channel_access_token)
 async_api_client = AsyncApiClient(configuration)
 async_line_bot_api = AsyncMessagingApi(async_api_client)
 async_messaging_api = AsyncMessagingApiBlob(async_api_client)
+profile_cache = ProfileCache(
+    async_line_bot_api,
+    ttl=LineBot.PROFILE_CACHE_TTL,
+    negative_ttl=LineBot.PROFILE_CACHE_NEGATIVE_TTL,
+    max_size=LineBot.PROFILE_CACHE_SIZE,
+)
 
 class QuickReplyDict(TypedDict):
     label: str
@@ -66,7 +73,7 @@ def quick_reply(qr_list: list[QuickReplyDict]) -> QuickReply:
                         for qr_item in qr_list
                     ]
                 )
-    linebot_logger.info(f"[function] quick_reply: {template=}")
+    linebot_logger.debug("[function] quick_reply: template=%s", template)
     return template
 
 # 以 server 視角去判斷 action
@@ -92,9 +99,50 @@ class Status(Enum):
     STORY_USER_PRODUCING = "state_story_user_producing"
     AUDIO_GENERATING = "state_audio_generating" 
 
+
+# (當前狀態, 動作) -> 下一個狀態，不在表中的組合維持原狀態
+TRANSITIONS: dict[tuple[Status, Action], Status] = {
+    (Status.NONE, Action.PHOTO_RECEIVED): Status.PHOTO_CAPTIONING,           # 用戶觸發
+    (Status.PHOTO_CAPTIONING, Action.GENERATED): Status.USER_ACTIONING,      # 伺服器觸發
+    (Status.CAPTION_MODIFYING, Action.MODIFYED): Status.USER_ACTIONING,      # 用戶觸發
+    (Status.USER_ACTIONING, Action.TYPE_COMFIRM): Status.STORY_GENERATING,   # 用戶觸發
+    (Status.USER_ACTIONING, Action.MODIFY_REQUEST): Status.CAPTION_MODIFYING,
+    (Status.USER_ACTIONING, Action.STORY_CLOSED): Status.AUDIO_GENERATING,
+    (Status.STORY_GENERATING, Action.GENERATED): Status.STORY_PREVIEW,       # 伺服器觸發
+    (Status.STORY_PREVIEW, Action.STORY_EXTEND): Status.STORY_GENERATING,    # 用戶觸發
+    (Status.STORY_PREVIEW, Action.USER_PRODUCE_REQUEST): Status.STORY_USER_PRODUCING,
+    (Status.STORY_PREVIEW, Action.MODIFY_REQUEST): Status.STORY_MODIFYING,
+    (Status.STORY_PREVIEW, Action.STORY_CLOSED): Status.AUDIO_GENERATING,
+    (Status.STORY_MODIFYING, Action.MODIFYED): Status.STORY_PREVIEW,         # 用戶觸發
+    (Status.STORY_USER_PRODUCING, Action.USER_PRODUCED): Status.STORY_PREVIEW,
+    (Status.AUDIO_GENERATING, Action.GENERATED): Status.NONE,                # 伺服器觸發
+}
+
+
+def validate_transitions(transitions: dict[tuple[Status, Action], Status]):
+    """每個狀態都要能離開、都要能從 NONE 抵達，每個動作都要被用到，否則拋出 ValueError"""
+    sources = {status for status, _ in transitions}
+    if missing := set(Status) - sources:
+        raise ValueError(f"states without outgoing transitions: {sorted(s.value for s in missing)}")
+    if unused := set(Action) - {action for _, action in transitions}:
+        raise ValueError(f"actions never used in transitions: {sorted(a.value for a in unused)}")
+
+    reachable, frontier = {Status.NONE}, [Status.NONE]
+    while frontier:
+        current = frontier.pop()
+        for (status, _), target in transitions.items():
+            if status == current and target not in reachable:
+                reachable.add(target)
+                frontier.append(target)
+    if unreachable := set(Status) - reachable:
+        raise ValueError(f"states unreachable from NONE: {sorted(s.value for s in unreachable)}")
+
+
+validate_transitions(TRANSITIONS)
+
 class User:
     """
-    讀取 user 的 json 檔案，並記錄當前狀態。
+    從 state_store 讀取 user 的狀態，並記錄當前狀態。
     
     可對照 user_states_schema.json
     {
@@ -103,14 +151,19 @@ class User:
         "status": "state_none"
         ...
     }
+
+    須透過 `await User.load(id)` 建立，新用戶才會查詢 LINE 用戶名稱
+
+    同一事件內多次更新可用 `with user.batch():` 合併爲一次寫入
     """
-    def __init__(self, id: int):
+    def __init__(self, id: int, data_dict: dict = None):
         self.id = id
-        self.name = self.__get_user_name()
-        json_schema_path = Path.cwd() / "app" / "schemas" / "user_states_schema.json"
-        data_path = Path.cwd() / "app" / "data" / f"user_state_{id}.json"
-        self.user_file_tool = JsonTool(data_path, json_schema_path)
-        self.data_dict = self.__get_data_dict()
+        self.name: str = None
+        self.is_new: bool = data_dict is None
+        self._batch_depth: int = 0
+        self._dirty: bool = False
+        self.data_dict = data_dict if data_dict is not None else self.__new_data_dict()
+        self.name = self.data_dict.get("user_name")
         
         # 記錄該 user 對應的 server 狀態
         self.current_status: Status = self.__get_status(self.data_dict)
@@ -119,18 +172,35 @@ class User:
         self.story_list: list = self.data_dict.get("story_list", [])
         self.story_size: int = len(self.story_list) if self.story_list else 0
 
-    def __get_user_name(self):
-        with ApiClient(configuration) as api_client:
-            line_bot_api = MessagingApi(api_client)
-            name = line_bot_api.get_profile(self.id).display_name
-            return name
-
-    def __get_data_dict(self) -> dict:
+    @classmethod
+    async def load(cls, id: int) -> "User":
+        # SQLite 讀取在執行緒中進行，不阻塞 event loop
+        user = cls(id, await async_state_store.get(id))
+        if user.is_new:
+            # 只有第一次建立檔案時才查詢用戶名稱（非同步且有快取）
+            user.name = await profile_cache.get_display_name(id)
+            user.data_dict = user.__create_user_file()
+            user.is_new = False
+        return user
+
+    @contextmanager
+    def batch(self):
+        """區塊內的更新延後到離開時一次寫入"""
+        self._batch_depth += 1
         try:
-            data_dict = self.user_file_tool.read_file()
-        except FileNotFoundError:
-            data_dict = self.__create_user_file()
-        return data_dict
+            yield self
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0 and self._dirty:
+                self.__save()
+
+    def __save(self):
+        if self._batch_depth:
+            self._dirty = True
+            return
+        # 由背景任務在執行緒中寫入（含 schema 驗證），不阻塞 event loop
+        async_state_store.put(self.id, self.data_dict)
+        self._dirty = False
     
     def __get_status(self, data_dict: dict) -> Status:
         # status 驗證
@@ -159,10 +229,15 @@ class User:
     def update_photo_caption(self, image_caption: str):
         self.image_caption = image_caption
         self.data_dict["image_caption"] = image_caption
-        self.user_file_tool.write_file(self.data_dict)
+        self.__save()
     
     def clear_user_file(self):
-        self.__create_user_file()
+        self.data_dict = self.__create_user_file()
+        self.current_status = Status.NONE
+        self.image_caption = None
+        self.story_type = None
+        self.story_list = []
+        self.story_size = 0
 
     def update_state(self, action: Action):
         """
@@ -174,62 +249,32 @@ class User:
             new_state = self.__change_state(action)
             self.current_status = new_state
             self.data_dict["status"] = new_state.value
-            self.user_file_tool.write_file(self.data_dict)
+            self.__save()
             return True
         linebot_logger.warning(f"Invalid user data_dict: {self.data_dict}")
         return False
     
-    def __create_user_file(self):
-        data_dict = {"user_id": self.id, "user_name": self.name,"status": Status.NONE.value}
-        self.user_file_tool.write_file(data_dict)
+    def restore_state(self, status: Status):
+        """還原到指定狀態，不經過狀態轉換（任務被拒絕或排隊逾時、沒有執行時使用）"""
+        self.current_status = status
+        self.data_dict["status"] = status.value
+        self.__save()
+
+    def __new_data_dict(self) -> dict:
+        data_dict = {"user_id": self.id, "status": Status.NONE.value}
+        # 查詢失敗時不寫入名稱，避免違反 schema
+        if self.name is not None:
+            data_dict["user_name"] = self.name
         return data_dict
 
+    def __create_user_file(self):
+        self.data_dict = self.__new_data_dict()
+        self.__save()
+        return self.data_dict
+
     def __change_state(self, action: Action) -> Status:
-        if self.current_status == Status.NONE:
-            if action == Action.PHOTO_RECEIVED: # 用戶觸發
-                return Status.PHOTO_CAPTIONING
-        
-        if self.current_status == Status.PHOTO_CAPTIONING:
-            if action == Action.GENERATED: # 伺服器 觸發
-                return Status.USER_ACTIONING
-        
-        if self.current_status == Status.CAPTION_MODIFYING:
-            if action == Action.MODIFYED:    # 用戶觸發
-                return Status.USER_ACTIONING
-    
-        if self.current_status == Status.USER_ACTIONING:
-            if action == Action.TYPE_COMFIRM: # 用戶觸發
-                return Status.STORY_GENERATING
-            if action == Action.MODIFY_REQUEST: # 用戶觸發
-                return Status.CAPTION_MODIFYING
-            if action == Action.STORY_CLOSED: # 用戶觸發
-                return Status.AUDIO_GENERATING
-        
-        if self.current_status == Status.STORY_GENERATING:
-            if action == Action.GENERATED:
-                return Status.STORY_PREVIEW
-        
-        if self.current_status == Status.STORY_PREVIEW:
-            if action == Action.STORY_EXTEND: # 用戶觸發
-                return Status.STORY_GENERATING
-            if action == Action.USER_PRODUCE_REQUEST:
-                return Status.STORY_USER_PRODUCING
-            if action == Action.MODIFY_REQUEST: # 用戶觸發
-                return Status.STORY_MODIFYING
-            if action == Action.STORY_CLOSED: # 用戶觸發
-                return Status.AUDIO_GENERATING
-        
-        if self.current_status == Status.STORY_MODIFYING:
-            if action == Action.MODIFYED: # 用戶觸發
-                return Status.STORY_PREVIEW
-        
-        if self.current_status == Status.STORY_USER_PRODUCING:
-            if action == Action.USER_PRODUCED: # 用戶觸發
-                return Status.STORY_PREVIEW
-        
-        if self.current_status == Status.AUDIO_GENERATING:
-            if action == Action.GENERATED: # 伺服器觸發
-                return Status.NONE
+        if (new_state := TRANSITIONS.get((self.current_status, action))) is not None:
+            return new_state
         linebot_logger.warning(f"status:{action.value} is not a valid action.")
         return self.current_status
 
@@ -251,18 +296,16 @@ class TextMessageService:
     方法1：從 “狀態” “訊息類型” 模板中條一則回復
     """
     def __init__(self):
-        template_path = Path.cwd() / "app" / "data" / "reply_message.json"
-        schema_path = Path.cwd() / "app" / "schemas" / "reply_message_schema.json"
-        self.json_tool:JsonTool = JsonTool(template_path, schema_path)
         self.message_type_list = ["Text Message", "Image Message"]
-        self.data_template = self.json_tool.read_file()
+        # 模板已在啟動時載入並驗證，這裏只取得唯讀的快取
+        self.data_template = template_registry.get("reply_message")
 
     def get_message_by_random(self, message_type: str, state: str) -> str:
         if message_type not in self.message_type_list:
             raise f"{message_type} 不是規範訊息類型。"
         
         if (msg_type_dict:= self.data_template.get(message_type)) is None:
-            linebot_logger.warning(f"{self.template_path} 格式不符合預期，請確認。")
+            linebot_logger.warning(f"reply_message 模板格式不符合預期，請確認。")
             return None
         
         # 有 key 且 不爲空 list
@@ -271,24 +314,88 @@ class TextMessageService:
         
         return None
 
-class QuickReplyMenu:
-    def __init__(self):
-        json_schema_path = Path.cwd() / "app" / "schemas" / "quick_reply.json"
-        data_path = Path.cwd() / "app" / "data" / "quick_reply.json"
-        self.json_tool = JsonTool(data_path, json_schema_path)
-        self.template_dict: dict = self.__get_json_template()
-        linebot_logger.info(f"[class] QuickReplyMenu: {self.template_dict=}")
-    
-    def __get_json_template(self):
-        try:
-            return self.json_tool.read_file()
-        except FileNotFoundError as e:
-            raise e
+# reply_message.json 沒有 state_busy 模板時使用
+BUSY_MESSAGE = "現在使用的人有點多，請稍等一下再試一次🙏"
+
+
+def busy_message() -> str:
+    return TextMessageService().get_message_by_random("Text Message", "state_busy") or BUSY_MESSAGE
+
+
+async def reply_busy(reply_token: str):
+    """階段佇列已滿時的快速回應，用戶狀態不變，可直接重試"""
+    await async_line_bot_api.reply_message(
+        ReplyMessageRequest(
+            replyToken=reply_token,
+            messages=[TextMessage(text=busy_message())]
+        )
+    )
 
+
+async def push_busy(user: User, status: Status):
+    """任務排隊逾時沒有執行：還原狀態並推送忙碌訊息（reply token 可能已失效，改用 push）"""
+    user.restore_state(status)
+    await async_line_bot_api.push_message(
+        PushMessageRequest(
+            to=user.id,
+            messages=[TextMessage(text=busy_message())]
+        )
+    )
+
+
+def story_prompt(type: str) -> str:
+    """依照圖片描述創作故事的 system prompt，type 爲故事類型"""
+    return (
+        "你是一位專業的故事創作者，擅長將簡單的圖片描述轉化為生動的故事。你的目標是根據使用者提供的圖片描述內容和指定的故事類型，創作一個短篇故事。\n\n"
+        "以下是你的要求：\n"
+        "1. 充分理解圖片描述內容，讓故事與描述緊密相關。\n"
+        f"2. 根據故事類型\"{type}\" 來創作，確保故事風格符合該類型的特點。\n"
+        "3. 生成的故事應包含完整的開頭、發展、高潮和結局，字數控制在 100 至 200 字之間，緊湊而精彩。\n\n"
+        "請專注於創造力，並確保故事具有吸引力和清晰的結構。\n"
+        "故事包括以下結構：\n"
+        "1. 開始：簡短描述背景和主要角色。\n"
+        "2. 中間：設置角色面臨的挑戰或衝突，並描寫解決方案。\n"
+        "3. 結尾：故事需要有一個合理的結局（開放式結尾需緊扣主題）。\n"
+        "注意：\n"
+        "- 故事應避免重複段落。\n"
+        "- 每段情節應有邏輯銜接，避免跳躍式情節發展。\n"
+    )
+
+
+def story_continue_prompt(type: str) -> str:
+    """延續現有故事的 system prompt，type 爲故事類型"""
+    return (
+        "你是一位專業的故事創作者，擅長延續現有的故事劇情並創作出有趣的後續發展。你的目標是根據使用者提供的故事情節和指定的故事類型，接續創作一段新的故事內容。\n\n"
+        "以下是你的要求：\n"
+        "1. 仔細閱讀並理解現有的故事劇情，讓你的創作與之前的內容自然銜接。\n"
+        f"2. 根據故事類型-\"{type}\"，確保後續故事符合該類型的特點。\n"
+        "3. 創作的後續故事應包含合理的發展和清晰的邏輯，字數控制在 150 至 250 字之間。\n\n"
+        "請確保故事生動有趣，並為情節的發展增添吸引力。\n"
+        "故事包括以下結構：\n"
+        "1. 開始：簡短描述背景和主要角色。\n"
+        "2. 中間：設置角色面臨的挑戰或衝突，並描寫解決方案。\n"
+        "3. 結尾：故事需要有一個合理的結局（開放式結尾需緊扣主題）。\n"
+        "注意：\n"
+        "- 故事應避免重複段落。\n"
+        "- 每段情節應有邏輯銜接，避免跳躍式情節發展。\n"
+    )
+
+
+def story_types() -> list[str]:
+    """quick reply 選單中可選的故事類型"""
+    return [
+        item["data"]["type"]
+        for item in template_registry.get("quick_reply").get(Status.USER_ACTIONING.value, ())
+        if item["data"].get("action") == Action.TYPE_COMFIRM.value and item["data"].get("type")
+    ]
+
+
+class QuickReplyMenu:
     def get_template(self, state: Status) -> list:
-        linebot_logger.info(f"{state.value=}")
-        if template:= self.template_dict.get(state.value):
-            linebot_logger.info(f"{template=}")
+        """回傳可修改的模板副本，呼叫端可直接填入資料"""
+        linebot_logger.debug("state.value=%s", state.value)
+        if template:= template_registry.copy("quick_reply", state.value):
+            linebot_logger.debug("template=%s", template)
             return template
         return []
 
@@ -343,7 +450,7 @@ class NonePeriod(Period):
     """
     pass
     async def handle_interrupt_message(self, user: User):
-        linebot_logger.info(f"{self.event.message}=")
+        linebot_logger.debug("%s=", self.event.message)
         reply_service = TextMessageService()
         if not isinstance(self.event.message, ImageMessageContent):
             response = await async_line_bot_api.reply_message_with_http_info(
@@ -379,9 +486,18 @@ class PhotoCaptioningPeriod(Period):
         """
         類型：server類觸發，不會頻繁觸發
 
-        先回傳訊息“我在看看”，然後對圖片進行分析，最後再推送結果給用戶(已附上 qr menu)
+        先回傳訊息“我在看看”，再把圖片分析交給背景 worker，分析完推送結果給用戶(已附上 qr menu)
+        解讀圖片的佇列已滿時只回覆忙碌訊息，狀態不變
 
         """
+        # 耗時的模型推理放到背景執行，webhook 可立即回應
+        if not admission.submit(
+            "caption", "photo_captioning", self.__caption_photo, user,
+            on_expired=lambda: push_busy(user, Status.NONE),
+        ):
+            await reply_busy(self.event.reply_token)
+            return
+
         # 更新狀態至 Photo Captioning(會耗時，給一個狀態)
         user.update_state(Action.PHOTO_RECEIVED)
 
@@ -390,23 +506,33 @@ class PhotoCaptioningPeriod(Period):
                 replyToken=self.event.reply_token,
                 messages=[TextMessage(text="我來看看🧐")])
         )
-    
+
+    async def __caption_photo(self, user: User):
         # 獲取圖片的二進制内容
         message_content = await async_messaging_api.get_message_content(self.event.message.id, async_req=True).get()
 
-        # 對二進制内容進行下載圖片
-        self.image_path = PathTool.join_path("app/downloads", f"image{user.id}.jpg")
-        await asyncio.to_thread(ImageHelper.download_binary_stream, message_content, self.image_path)
+        # 有設定時才保存原圖
+        if ImageCaption.save_uploads:
+            self.image_path = PathTool.join_path("app/downloads", f"image{user.id}.jpg")
+            await asyncio.to_thread(ImageHelper.download_binary_stream, message_content, self.image_path)
+
+        # 直接由記憶體解碼，JPEG 以縮小比例解碼到接近模型輸入的大小
+        image_file = await asyncio.to_thread(ImageHelper.decode, message_content, ImageCaption.decode_size)
+
+        # 重傳或重新壓縮過的同一張照片，直接使用快取的描述
+        image_hash = await asyncio.to_thread(dhash, image_file)
+        cached = caption_cache.get(image_hash)
+        if cached is not None:
+            cn_caption = cached.cn_caption
+        else:
+            # [呼叫模型] 進行分析，獲取圖片描述
+            eng_caption = await asyncio.to_thread(image2text.img_to_text, image_file)
+
+            # [呼叫模型] 翻譯成中文
+            cn_caption =  await asyncio.to_thread(translator.translate_to_zh, eng_caption)
+            caption_cache.put(image_hash, eng_caption, cn_caption)
 
-        # 讀取圖片
-        image_file = Image.open(self.image_path)
-        
-        # [呼叫模型] 進行分析，獲取圖片描述
-        eng_caption = await asyncio.to_thread(image2text.img_to_text, image_file)
 
-        # [呼叫模型] 翻譯成中文
-        cn_caption =  await asyncio.to_thread(translator.translate_to_zh, eng_caption)
-        
         # 推送caption給使用戶
         quick_reply_menu = UserActioningPeriod.creat_quick_reply_menu(user, cn_caption)
         response = await async_line_bot_api.push_message(
@@ -418,8 +544,9 @@ class PhotoCaptioningPeriod(Period):
                 )]
             )
         )
-        user.update_photo_caption(cn_caption)
-        user.update_state(Action.GENERATED)
+        with user.batch():
+            user.update_photo_caption(cn_caption)
+            user.update_state(Action.GENERATED)
 
         linebot_logger.info(f"[class] PhotoCaptioningPeriod: {cn_caption=}")
         return cn_caption
@@ -467,7 +594,7 @@ class UserActioningPeriod:
         menu = QuickReplyMenu()
         quick_reply_template = menu.get_template(Status.USER_ACTIONING)
         
-        linebot_logger.info(f"{quick_reply_template=}")
+        linebot_logger.debug("quick_reply_template=%s", quick_reply_template)
         
         # 若不提供 description 則使用 user 裏 caching 的内容
         if image_description is None:
@@ -477,7 +604,7 @@ class UserActioningPeriod:
         for item in quick_reply_template:
             item["data"]["message"] = image_description
         
-        linebot_logger.info(f"[class] UserActioningPeriod: {quick_reply_template}")
+        linebot_logger.debug("[class] UserActioningPeriod: %s", quick_reply_template)
         return quick_reply(quick_reply_template)
 
     
@@ -499,21 +626,23 @@ class CaptionModifyingPeriod:
         if user.current_status == Status.CAPTION_MODIFYING:
             user_produced_caption = self.event.message.text
             
-            # 更新至 user cache
-            user.update_photo_caption(user_produced_caption)
-            
-            quick_reply_menu = UserActioningPeriod.creat_quick_reply_menu(user, user_produced_caption)
-            response = await async_line_bot_api.reply_message(
-                ReplyMessageRequest(
-                    reply_token=self.event.reply_token,
-                    messages=[
-                        TextMessage(text="已幫你修改為："),
-                        TextMessage(text=user.image_caption,
-                                    quick_reply=quick_reply_menu)
-                    ]
+            # 描述及狀態在同一次寫入
+            with user.batch():
+                # 更新至 user cache
+                user.update_photo_caption(user_produced_caption)
+                
+                quick_reply_menu = UserActioningPeriod.creat_quick_reply_menu(user, user_produced_caption)
+                response = await async_line_bot_api.reply_message(
+                    ReplyMessageRequest(
+                        reply_token=self.event.reply_token,
+                        messages=[
+                            TextMessage(text="已幫你修改為："),
+                            TextMessage(text=user.image_caption,
+                                        quick_reply=quick_reply_menu)
+                        ]
+                    )
                 )
-            )
-            user.update_state(Action.MODIFYED)
+                user.update_state(Action.MODIFYED)
 
 
 class StoryGeneratingPeriod(Period):
@@ -535,6 +664,7 @@ class StoryGeneratingPeriod(Period):
         """
         * UserActiongPeriod必須附帶type，需記錄
         """
+        previous_status = user.current_status
         # 若爲 User Actioning，必須有type
         if user.current_status == Status.USER_ACTIONING:
             # 確保參數去傳遞
@@ -556,6 +686,15 @@ class StoryGeneratingPeriod(Period):
         else:
             raise f"{user.current_status} is not allow to generating story."
 
+        # AI創作故事，預計30秒，放到背景執行；佇列已滿時還原狀態並回覆忙碌訊息
+        if not admission.submit(
+            "story", "story_generating", self.__push_story, user, type, msg, msg_for_qr,
+            on_expired=lambda: push_busy(user, previous_status),
+        ):
+            user.restore_state(previous_status)
+            await reply_busy(self.event.reply_token)
+            return
+
         # 發送已收到訊息
         await async_line_bot_api.reply_message(
             ReplyMessageRequest(
@@ -564,8 +703,9 @@ class StoryGeneratingPeriod(Period):
             )
         )
 
-        # AI創作故事，預計30秒,staging 至 user
-        story = await self.__generating_story(type, msg)
+    async def __push_story(self, user: User, type: str, msg: Union[str, list], msg_for_qr: str = None):
+        # staging 至 user
+        story = await self.__generating_story(type, msg, user.id)
         user.append_story_list(story)
 
         # 建立功能選單
@@ -585,75 +725,26 @@ class StoryGeneratingPeriod(Period):
         user.update_state(Action.GENERATED)
 
 
-    async def __generating_story(self, type: str, data: Union[str, list] = None):
+    async def __generating_story(self, type: str, data: Union[str, list] = None, user_id: str = None):
         """
         Args:
-            user (User): 此 event 用戶
             type (str): 故事延展類型
-            msg (str): 故事生成依照的參考内容
+            data (str | list): 故事生成依照的參考内容，str 爲圖片描述，list 爲已生成的故事
+            user_id (str): 延伸故事時，以此保存該用戶的對話 session
         """
-        system_prompt_1 = [
-            {
-                'role': 'system', 
-                'content': (
-                    "你是一位專業的故事創作者，擅長將簡單的圖片描述轉化為生動的故事。你的目標是根據使用者提供的圖片描述內容和指定的故事類型，創作一個短篇故事。\n\n"
-                    "以下是你的要求：\n"
-                    "1. 充分理解圖片描述內容，讓故事與描述緊密相關。\n"
-                    f"2. 根據故事類型\"{type}\" 來創作，確保故事風格符合該類型的特點。\n"
-                    "3. 生成的故事應包含完整的開頭、發展、高潮和結局，字數控制在 100 至 200 字之間，緊湊而精彩。\n\n"
-                    "請專注於創造力，並確保故事具有吸引力和清晰的結構。\n"
-                    "故事包括以下結構：\n"
-                    "1. 開始：簡短描述背景和主要角色。\n"
-                    "2. 中間：設置角色面臨的挑戰或衝突，並描寫解決方案。\n"
-                    "3. 結尾：故事需要有一個合理的結局（開放式結尾需緊扣主題）。\n"
-                    "注意：\n"
-                    "- 故事應避免重複段落。\n"
-                    "- 每段情節應有邏輯銜接，避免跳躍式情節發展。\n"
-                )
-            }
-        ]
-
-        system_prompt_2 = [
-            {
-                'role': 'system', 
-                'content': (
-                    "你是一位專業的故事創作者，擅長延續現有的故事劇情並創作出有趣的後續發展。你的目標是根據使用者提供的故事情節和指定的故事類型，接續創作一段新的故事內容。\n\n"
-                    "以下是你的要求：\n"
-                    "1. 仔細閱讀並理解現有的故事劇情，讓你的創作與之前的內容自然銜接。\n"
-                    f"2. 根據故事類型-\"{type}\"，確保後續故事符合該類型的特點。\n"
-                    "3. 創作的後續故事應包含合理的發展和清晰的邏輯，字數控制在 150 至 250 字之間。\n\n"
-                    "請確保故事生動有趣，並為情節的發展增添吸引力。\n"
-                    "故事包括以下結構：\n"
-                    "1. 開始：簡短描述背景和主要角色。\n"
-                    "2. 中間：設置角色面臨的挑戰或衝突，並描寫解決方案。\n"
-                    "3. 結尾：故事需要有一個合理的結局（開放式結尾需緊扣主題）。\n"
-                    "注意：\n"
-                    "- 故事應避免重複段落。\n"
-                    "- 每段情節應有邏輯銜接，避免跳躍式情節發展。\n"
-                )
-            }
-        ]
-
         word_num = 500
         # 圖片描述
         if isinstance(data, str):
-            user_input = data
-            chat_history = system_prompt_1
-        # 故事劇情
+            # 達到 100 字後遇到句尾即停止
+            stream = mandrine_llm.stream_text(data, [{"role": "system", "content": story_prompt(type)}], word_num, length=(100, 250))
+        # 故事劇情：每段故事是一輪對話，只需 prefill 新增的段落
         else:
-            user_input = ""
-            chat_history = system_prompt_2
-            for story in data:
-                user_input += f"{story}\n"
-                word_num += 120
-
-        story = await asyncio.to_thread(
-            mandrine_llm.generate_text, 
-            user_input, 
-            chat_history, 
-            word_num
-            )
-        return story
+            stream = mandrine_llm.stream_story(user_id, story_continue_prompt(type), data, word_num, length=(150, 300))
+
+        story = ""
+        async for text in stream:
+            story += text
+        return story.strip()
     
 
 class StoryPreviewPeriod:
@@ -681,7 +772,7 @@ class StoryPreviewPeriod:
         menu = QuickReplyMenu()
         quick_reply_template = menu.get_template(Status.STORY_PREVIEW)
         
-        linebot_logger.info(f"{quick_reply_template=}")
+        linebot_logger.debug("quick_reply_template=%s", quick_reply_template)
         
         if user.story_size >= LineBot.MAX_STORY_SIZE:
             # TODO 需優化為對 extend 來刪
@@ -764,6 +855,10 @@ class AudioGeneratingPeriod:
     前一個狀態：故事預覽（Story Preview）->完成故事、使用者決策（User Actioning）->結束
 
     """
+    # 從開始合成到推送第一段音檔的時間，以及全部推送完成的時間
+    time_to_first_audio = Histogram()
+    total_audio_time = Histogram()
+
     def __init__(self, event):
         self.event = event
 
@@ -780,11 +875,30 @@ class AudioGeneratingPeriod:
             )
         )
     async def generating_audio(self, user: User):
+        previous_status = user.current_status
         user.update_state(Action.STORY_CLOSED)
-        # 故事音檔
-        if user.story_size:
-            for story in user.story_list:
-                audio_name, duration = await asyncio.to_thread(speech.generate_speech, story, user.id)
+        # 語音合成放到背景執行；佇列已滿時還原狀態並回覆忙碌訊息
+        if not admission.submit(
+            "audio", "audio_generating", self.__push_audio, user,
+            on_expired=lambda: push_busy(user, previous_status),
+        ):
+            user.restore_state(previous_status)
+            await reply_busy(self.event.reply_token)
+
+    async def __push_audio(self, user: User):
+        # 故事音檔，沒有故事時使用圖片描述音檔
+        texts = list(user.story_list) if user.story_size else [user.image_caption]
+
+        start_time = time.perf_counter()
+        first_audio_time = None
+        next_audio = asyncio.create_task(asyncio.to_thread(speech.generate_speech, texts[0], user.id))
+        try:
+            for index in range(len(texts)):
+                audio_name, duration = await next_audio
+                # 推送這一段的同時，開始合成下一段
+                if index + 1 < len(texts):
+                    next_audio = asyncio.create_task(asyncio.to_thread(speech.generate_speech, texts[index + 1], user.id))
+
                 response = await async_line_bot_api.push_message(
                     PushMessageRequest(
                         to=user.id,
@@ -794,18 +908,22 @@ class AudioGeneratingPeriod:
                         )]
                     )
                 )
-        else:
-            # 圖片描述音檔
-            audio_name, duration = await asyncio.to_thread(speech.generate_speech, user.image_caption, user.id)
-            response = await async_line_bot_api.push_message(
-                        PushMessageRequest(
-                            to=user.id,
-                            messages=[AudioMessage(
-                                originalContentUrl=f"{EnvConfig.ngrok_url}/line/static/audio/{audio_name}",
-                                duration=duration
-                            )]
-                        )
-                    )
-        user.update_state(Action.GENERATED)
-        user.clear_user_file()
+                if first_audio_time is None:
+                    first_audio_time = time.perf_counter() - start_time
+        finally:
+            next_audio.cancel()
+
+        total_time = time.perf_counter() - start_time
+        self.time_to_first_audio.observe(first_audio_time)
+        self.total_audio_time.observe(total_time)
+        linebot_logger.info(
+            f"[class] AudioGeneratingPeriod: {len(texts)} segments, "
+            f"time_to_first_audio={first_audio_time:.2f}s, total={total_time:.2f}s"
+        )
+        with user.batch():
+            user.update_state(Action.GENERATED)
+            user.clear_user_file()
+        # 故事已結束，釋放延伸故事的 KV（只有圖片描述時模型可能尚未建構）
+        # remote 模式下是一次 IPC 往返，放在執行緒中避免阻塞 event loop
+        await asyncio.to_thread(mandrine_llm.call_if_loaded, "end_session", user.id)
         
\ No newline at end of file
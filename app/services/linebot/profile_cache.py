@@ -0,0 +1,82 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from linebot.v3.messaging import AsyncMessagingApi
+
+from app.utils.logger import linebot_logger
+
+
+class ProfileCache:
+    """
+    LINE 用戶名稱的非同步快取
+
+    - 使用 AsyncMessagingApi 查詢，不會阻塞 event loop
+    - 查詢成功快取 ttl 秒，查詢失敗快取 None（negative_ttl 秒），避免重複打 API
+    - 超過 max_size 時淘汰最久未使用的用戶
+    - 同一用戶同時查詢只會發出一次請求
+    """
+    def __init__(self, api: AsyncMessagingApi, ttl: float = 3600, negative_ttl: float = 60, max_size: int = 10000):
+        self.api = api
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.failures = 0
+        self._entries: OrderedDict[str, tuple[float, Optional[str]]] = OrderedDict()  # user_id -> (過期時間, 名稱)
+        self._pending: dict[str, asyncio.Future] = {}
+
+    async def get_display_name(self, user_id: str) -> Optional[str]:
+        """取得用戶名稱，查詢失敗回傳 None"""
+        if (entry := self._entries.get(user_id)) is not None:
+            expires_at, name = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return name
+            del self._entries[user_id]
+
+        # 已有相同用戶的查詢在進行中，等待其結果
+        if (pending := self._pending.get(user_id)) is not None:
+            self.hits += 1
+            return await asyncio.shield(pending)
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending[user_id] = future
+        try:
+            name = await self.__fetch(user_id)
+            future.set_result(name)
+            return name
+        finally:
+            if not future.done():
+                future.cancel()
+            del self._pending[user_id]
+
+    def invalidate(self, user_id: str):
+        self._entries.pop(user_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "failures": self.failures,
+        }
+
+    async def __fetch(self, user_id: str) -> Optional[str]:
+        try:
+            profile = await self.api.get_profile(user_id)
+            name, ttl = profile.display_name, self.ttl
+        except Exception as e:
+            linebot_logger.warning(f"[ProfileCache] get_profile failed for {user_id}: {e}")
+            self.failures += 1
+            name, ttl = None, self.negative_ttl
+
+        self._entries[user_id] = (time.monotonic() + ttl, name)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return name
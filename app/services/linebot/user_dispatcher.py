@@ -0,0 +1,65 @@
+import asyncio
+from collections import deque
+from typing import Any, Awaitable, Callable
+
+from app.utils.logger import linebot_logger
+
+
+class UserEventDispatcher:
+    """
+    依 user_id 分組派送事件
+
+    - 同一用戶的事件依到達順序執行，不會重疊（避免同時改寫同一份狀態）
+    - 不同用戶的事件並行執行，最多 max_concurrency 個同時進行
+    - 用戶的佇列清空後，其 worker 會自動結束
+    """
+    def __init__(self, max_concurrency: int = 16):
+        self.max_concurrency = max_concurrency
+        self.dispatched = 0
+        self.failed = 0
+        self._queues: dict[str, deque] = {}
+        self._workers: dict[str, asyncio.Task] = {}
+        self._semaphore: asyncio.Semaphore = None
+
+    def submit(self, key: str, func: Callable[..., Awaitable[Any]], *args):
+        """放入該用戶的佇列後立即返回"""
+        self._queues.setdefault(key, deque()).append((func, args))
+        if key not in self._workers:
+            self._workers[key] = asyncio.create_task(self.__run_user(key), name=f"user-events-{key}")
+
+    def queue_lengths(self) -> dict[str, int]:
+        """各用戶尚未執行的事件數（不含正在執行的事件）"""
+        return {key: len(queue) for key, queue in self._queues.items() if queue}
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "active_users": len(self._workers),
+            "dispatched": self.dispatched,
+            "failed": self.failed,
+            "queue_lengths": self.queue_lengths(),
+        }
+
+    async def drain(self, timeout: float = 5):
+        """等待所有已收到的事件處理完畢"""
+        if self._workers:
+            await asyncio.wait(list(self._workers.values()), timeout=timeout)
+
+    async def __run_user(self, key: str):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        queue = self._queues[key]
+        try:
+            while queue:
+                func, args = queue.popleft()
+                async with self._semaphore:
+                    try:
+                        await func(*args)
+                        self.dispatched += 1
+                    except Exception:
+                        self.failed += 1
+                        linebot_logger.exception(f"[UserEventDispatcher] event of {key} failed")
+        finally:
+            del self._workers[key]
+            if not queue:
+                del self._queues[key]
@@ -0,0 +1,114 @@
+"""
+啟動預熱
+
+部署後第一位用戶不應替模型下載、載入、tokenizer 初始化及第一次推理的 kernel 編譯買單。
+lifespan 啟動後在背景依序執行各階段：載入模型並以極小的輸入試跑一次，記錄每個階段的耗時。
+全部階段結束前 /readyz 回傳 503，load balancer 不會把流量導入。
+"""
+import asyncio
+import time
+from typing import Callable
+
+from app.config import Warmup
+from app.utils.logger import system_logger
+
+
+def _warm_caption():
+    from PIL import Image
+    from app.models.singletons import image2text
+    image2text.img_to_text(Image.new("RGB", (64, 64)), max_new_tokens=5)
+
+
+def _warm_translate():
+    from app.models.singletons import translator
+    translator.translate_batch(["A warm up sentence."])
+
+
+def _warm_generate():
+    from app.config import TextGeneration
+    from app.models.singletons import mandrine_llm
+    from app.services.linebot.msg_services import story_prompt, story_types
+    # 以實際的故事 system prompt 試跑，同時爲各故事類型建立前綴 KV cache（不超過 PREFIX_CACHE_SIZE 個）
+    types = story_types()[:TextGeneration.prefix_cache_size]
+    if not types:
+        # 沒有可快取的故事類型時只載入模型並試跑一次
+        mandrine_llm.generate_text("你好", generate_text_len=8)
+    for type in types:
+        system_prompt = [{"role": "system", "content": story_prompt(type)}]
+        mandrine_llm.generate_text("一隻貓坐在窗邊。", system_prompt, generate_text_len=8)
+
+
+def _warm_tts():
+    from app.models.singletons import speech
+    # 只合成不寫檔，避免寫入語音快取
+    speech.synthesize("你好。")
+
+
+STAGES: dict[str, Callable[[], None]] = {
+    "caption": _warm_caption,
+    "translate": _warm_translate,
+    "generate": _warm_generate,
+    "tts": _warm_tts,
+}
+
+
+class WarmupRunner:
+    """
+    依序執行預熱階段
+
+    - start()：在背景執行，不阻塞 lifespan；推理放在執行緒中，避免阻塞 event loop
+    - ready：所有階段結束（成功或失敗）後爲 True；失敗的階段之後仍會在第一次使用時載入
+    - stats()：各階段狀態（pending / running / done / failed）及耗時
+    """
+    def __init__(self, stages: list[str]):
+        unknown = [stage for stage in stages if stage not in STAGES]
+        if unknown:
+            system_logger.warning(f"[Warmup] unknown stages ignored: {unknown}")
+        self.stages = [stage for stage in stages if stage in STAGES]
+        self.status: dict[str, dict] = {stage: {"state": "pending"} for stage in self.stages}
+        self.started_at: float = None
+        self.finished_at: float = None
+        self._task: asyncio.Task = None
+
+    @property
+    def ready(self) -> bool:
+        return self.finished_at is not None
+
+    async def start(self):
+        if self._task is None:
+            self.started_at = time.monotonic()
+            self._task = asyncio.create_task(self.__run(), name="warmup")
+
+    async def stop(self):
+        # 執行緒中的推理無法中斷，只取消尚未開始的階段
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def stats(self) -> dict:
+        end = self.finished_at or time.monotonic()
+        return {
+            "ready": self.ready,
+            "elapsed_seconds": round(end - self.started_at, 2) if self.started_at is not None else None,
+            "stages": self.status,
+        }
+
+    async def __run(self):
+        for stage in self.stages:
+            self.status[stage] = {"state": "running"}
+            start = time.perf_counter()
+            try:
+                await asyncio.to_thread(STAGES[stage])
+                state = "done"
+            except Exception:
+                state = "failed"
+                system_logger.exception(f"[Warmup] stage {stage} failed")
+            seconds = round(time.perf_counter() - start, 2)
+            self.status[stage] = {"state": state, "seconds": seconds}
+            system_logger.info(f"[Warmup] {stage} {state} in {seconds:.2f}s")
+        self.finished_at = time.monotonic()
+        system_logger.info(f"[Warmup] finished in {self.finished_at - self.started_at:.2f}s, ready for traffic")
+
+
+warmup = WarmupRunner(Warmup.stages)
@@ -1,4 +1,5 @@
-import aiofiles
+import io
+from PIL import Image
 
 class ImageHelper:
     @staticmethod
@@ -13,3 +14,18 @@ class ImageHelper:
             print(f"File successfully download to {save_path}")
         except Exception as e:
             print(f"Failed to download the file: {e}")
+
+    @staticmethod
+    def decode(data: bytes, target_size: int = None) -> Image.Image:
+        """
+        Decodes image bytes in memory and returns an RGB image.
+
+        For JPEG, draft mode lets libjpeg decode at 1/2, 1/4 or 1/8 scale, so the
+        shorter side stays at least target_size while most of the full-resolution
+        decode work and memory are skipped.
+        """
+        image = Image.open(io.BytesIO(data))
+        if target_size and image.format == "JPEG":
+            image.draft("RGB", (target_size, target_size))
+        image = image.convert("RGB")
+        return image
@@ -1,52 +1,167 @@
+import atexit
+import json
 import logging
-from logging.handlers import RotatingFileHandler
 import os
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
-def setup_logger(name, log_file, level=logging.INFO):
+# 日誌模式：queue 由背景執行緒寫檔，sync 直接在呼叫端寫檔
+LOG_MODE = os.getenv("LOG_MODE", "queue")
+# 日誌格式：text 或 json
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+
+# logging.LogRecord 本身的屬性，其餘的屬性視爲 extra 欄位
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JsonFormatter(logging.Formatter):
+    """每筆日誌輸出爲一行 json，logger.info(..., extra={...}) 的欄位也會一併輸出"""
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": self.formatTime(record),
+            "logger": record.name,
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS:
+                data[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc_info"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    依呼叫位置（檔案+行數）限制 INFO 以下日誌的頻率
+
+    每個呼叫位置每秒最多 rate 筆（可累積至 burst 筆），超出的日誌會被丟棄，
+    下一筆通過的日誌會附上被丟棄的筆數。WARNING 以上不受限制。
+    """
+    def __init__(self, rate: float, burst: int = None):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst or max(1, int(rate))
+        self._buckets: dict[tuple, list] = {}  # key -> [tokens, last_time, suppressed]
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.setdefault(key, [self.burst, now, 0])
+            bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[2] += 1
+                return False
+            bucket[0] -= 1
+            suppressed, bucket[2] = bucket[2], 0
+
+        if suppressed:
+            record.msg = f"{record.msg} (suppressed {suppressed} similar messages)"
+        return True
+
+
+class _LoggerRouter(logging.Handler):
+    """QueueListener 只有一組 handler，依 logger 名稱轉交給各自的 handler"""
+    def __init__(self):
+        super().__init__()
+        self.routes: dict[str, list[logging.Handler]] = {}
+
+    def emit(self, record: logging.LogRecord):
+        for handler in self.routes.get(record.name, ()):
+            if record.levelno >= handler.level:
+                handler.handle(record)
+
+
+_log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_router = _LoggerRouter()
+_listener = QueueListener(_log_queue, _router)
+_listener.start()
+atexit.register(_listener.stop)
+
+
+def setup_logger(name, log_file, level=logging.INFO, mode=None, fmt=None, rate_limit=None, console=True):
+    """
+    Args:
+        mode (str): "queue" 或 "sync"，預設讀取 LOG_MODE
+        fmt (str): "text" 或 "json"，預設讀取 LOG_FORMAT
+        rate_limit (float): 每個呼叫位置每秒最多幾筆 INFO 日誌，預設讀取 LOG_RATE_LIMIT_<NAME> 或 LOG_RATE_LIMIT，0 爲不限制
+        console (bool): 是否同時輸出到控制台
+    """
+    mode = mode or LOG_MODE
+    fmt = fmt or LOG_FORMAT
+    if rate_limit is None:
+        rate_limit = float(os.getenv(f"LOG_RATE_LIMIT_{name.upper()}", os.getenv("LOG_RATE_LIMIT", 0)))
+
+    if fmt == "json":
+        formatter = JsonFormatter()
+    else:
+        formatter = logging.Formatter(
+            '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+        )
 
-    formatter = logging.Formatter(
-        '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-    )
-    
     # 確保日誌目錄存在
     os.makedirs(os.path.dirname(log_file), exist_ok=True)
-    
+
     # 如果 logger 已经存在，清理它的 handlers
     logger = logging.getLogger(name)
     if logger.hasHandlers():
         logger.handlers.clear()
-    
+    logger.filters.clear()
+
     # 可迴轉的文件日誌處理器
     file_handler = RotatingFileHandler(
-        log_file, 
+        log_file,
         maxBytes=10*1024*1024,  # 10MB
         backupCount=5,
         encoding='utf-8'  # 設置為 UTF-8 編碼
     )
     file_handler.setFormatter(formatter)
 
+    handlers = [file_handler]
+
     # 控制台處理器
-    console_handler = logging.StreamHandler()
-    console_handler.setFormatter(formatter)
+    if console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(formatter)
+        handlers.append(console_handler)
 
     logger = logging.getLogger(name)
     logger.setLevel(level)
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
+    if rate_limit:
+        logger.addFilter(RateLimitFilter(rate_limit))
+
+    if mode == "queue":
+        # 呼叫端只把 record 放入佇列，格式化及寫檔由背景執行緒處理
+        _router.routes[name] = handlers
+        logger.addHandler(QueueHandler(_log_queue))
+    else:
+        _router.routes.pop(name, None)
+        for handler in handlers:
+            logger.addHandler(handler)
 
     return logger
 
 
 # 創建不同模組的日誌
 system_logger = setup_logger(
-    'system', 
+    'system',
     'logs/system.log'
 )
 linebot_logger = setup_logger(
-    'line', 
+    'line',
     'logs/linebot.log'
 )
 model_logger = setup_logger(
-    'model_logger', 
+    'model_logger',
     'logs/model.log'
-)
\ No newline at end of file
+)
@@ -0,0 +1,59 @@
+import threading
+from bisect import bisect_left
+from collections import deque
+from itertools import accumulate
+from typing import Iterable
+
+# 預設 bucket（秒），涵蓋 webhook 回應到模型推理的時間範圍
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class Histogram:
+    """
+    固定 bucket 的直方圖
+
+    另外保留最近 window 筆樣本，用來計算百分位數。可在多執行緒下使用。
+    """
+    def __init__(self, buckets: Iterable[float] = DEFAULT_BUCKETS, window: int = 1024):
+        self.buckets = tuple(sorted(buckets))
+        self.bucket_counts = [0] * (len(self.buckets) + 1)  # 最後一格爲 +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self._recent = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, value: float):
+        with self._lock:
+            self.bucket_counts[bisect_left(self.buckets, value)] += 1
+            self.count += 1
+            self.sum += value
+            self.max = max(self.max, value)
+            self._recent.append(value)
+
+    def percentile(self, q: float) -> float:
+        """q 介於 0 至 100，以最近的樣本計算"""
+        with self._lock:
+            samples = sorted(self._recent)
+        if not samples:
+            return 0.0
+        index = min(len(samples) - 1, max(0, round(q / 100 * (len(samples) - 1))))
+        return samples[index]
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            count, total, maximum = self.count, self.sum, self.max
+            bucket_counts = list(self.bucket_counts)
+        return {
+            "count": count,
+            "avg": round(total / count, 4) if count else 0.0,
+            "max": round(maximum, 4),
+            "p50": round(self.percentile(50), 4),
+            "p90": round(self.percentile(90), 4),
+            "p99": round(self.percentile(99), 4),
+            # 與 Prometheus 相同爲累計數：le_{bound} 是 ≤ bound 的樣本數，le_inf 等於 count
+            "buckets": dict(zip(
+                [f"le_{bound}" for bound in self.buckets] + ["le_inf"],
+                accumulate(bucket_counts),
+            )),
+        }
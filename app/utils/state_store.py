@@ -0,0 +1,278 @@
+"""
+用戶狀態儲存
+
+取代每個用戶一個 json 檔案（app/data/user_state_{id}.json）的做法，讀寫都是單筆資料列的操作。
+
+- MemoryStateStore：存在記憶體，重啓即消失，適合測試
+- SQLiteStateStore：WAL 模式的 SQLite，user_id 爲主鍵
+- AsyncStateStore：event loop 上使用的 facade，SQLite 讀寫及 schema 驗證都在執行緒中進行
+
+Usage（匯入既有的 json 檔案）:
+- Run from the root directory.
+- `python -m app.utils.state_store --data-dir app/data --db app/data/user_states.db`
+"""
+import argparse
+import asyncio
+import copy
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Callable, Iterable, Optional
+
+from app.config import UserState
+from app.utils.logger import linebot_logger
+from app.utils.template_registry import template_registry
+from app.utils.utils import JsonTool
+
+
+class StateStore(ABC):
+    """
+    用戶狀態儲存介面
+
+    validator: 寫入前驗證資料的函式，驗證失敗須拋出例外
+    """
+    def __init__(self, validator: Callable[[dict], None] = None):
+        self.validator = validator
+
+    @abstractmethod
+    def get(self, user_id: str) -> Optional[dict]:
+        """取得用戶狀態，不存在時回傳 None"""
+
+    @abstractmethod
+    def put(self, user_id: str, data: dict):
+        """寫入（覆蓋）用戶狀態"""
+
+    @abstractmethod
+    def put_many(self, items: Iterable[tuple[str, dict]]):
+        """在同一個 transaction 內寫入多筆用戶狀態"""
+
+    @abstractmethod
+    def delete(self, user_id: str):
+        """刪除用戶狀態"""
+
+    def close(self):
+        pass
+
+    def _validate(self, data: dict):
+        if self.validator is not None:
+            self.validator(data)
+
+
+class MemoryStateStore(StateStore):
+    def __init__(self, validator: Callable[[dict], None] = None):
+        super().__init__(validator)
+        self._states: dict[str, dict] = {}
+        self._lock = threading.Lock()
+
+    def get(self, user_id: str) -> Optional[dict]:
+        with self._lock:
+            data = self._states.get(user_id)
+        return copy.deepcopy(data) if data is not None else None
+
+    def put(self, user_id: str, data: dict):
+        self._validate(data)
+        with self._lock:
+            self._states[user_id] = copy.deepcopy(data)
+
+    def put_many(self, items: Iterable[tuple[str, dict]]):
+        items = [(user_id, copy.deepcopy(data)) for user_id, data in items]
+        for _, data in items:
+            self._validate(data)
+        with self._lock:
+            self._states.update(items)
+
+    def delete(self, user_id: str):
+        with self._lock:
+            self._states.pop(user_id, None)
+
+
+class SQLiteStateStore(StateStore):
+    """
+    WAL 模式的 SQLite
+
+    單一連線搭配 lock，event loop 及背景 worker 皆可使用；每次 put 爲一次 upsert。
+    """
+    def __init__(self, db_path: str, validator: Callable[[dict], None] = None):
+        super().__init__(validator)
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS user_states ("
+            "user_id TEXT PRIMARY KEY, "
+            "data TEXT NOT NULL, "
+            "updated_at REAL NOT NULL)"
+        )
+
+    def get(self, user_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data FROM user_states WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def put(self, user_id: str, data: dict):
+        self.put_many([(user_id, data)])
+
+    def put_many(self, items: Iterable[tuple[str, dict]]):
+        rows = []
+        for user_id, data in items:
+            self._validate(data)
+            rows.append((user_id, json.dumps(data, ensure_ascii=False), time.time()))
+
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO user_states (user_id, data, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(user_id) DO UPDATE SET data = excluded.data, updated_at = excluded.updated_at",
+                    rows,
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def delete(self, user_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM user_states WHERE user_id = ?", (user_id,))
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class AsyncStateStore:
+    """
+    event loop 使用的 facade
+
+    - get()：在執行緒中讀取；尚未寫入的狀態直接從記憶體回傳，讀得到自己剛寫入的狀態
+    - put()：立即返回，由背景任務合併後以 put_many 在執行緒中寫入；同一用戶只寫最後一次的狀態
+    - flush()：等待尚未寫入的狀態寫完，關閉時呼叫
+    不在 event loop 中呼叫 put() 時（例如 migrate 腳本）直接同步寫入。
+    """
+    def __init__(self, store: StateStore):
+        self.store = store
+        self.writes = 0
+        self.failed = 0
+        self._pending: dict[str, dict] = {}
+        self._writing: dict[str, dict] = {}
+        self._writer: asyncio.Task = None
+
+    async def get(self, user_id: str) -> Optional[dict]:
+        data = self._pending.get(user_id) or self._writing.get(user_id)
+        if data is not None:
+            return copy.deepcopy(data)
+        return await asyncio.to_thread(self.store.get, user_id)
+
+    def put(self, user_id: str, data: dict):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self.store.put(user_id, data)
+            return
+        self._pending[user_id] = copy.deepcopy(data)
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self.__write(), name="state-store-writer")
+
+    async def flush(self):
+        while self._writer is not None and not self._writer.done():
+            await asyncio.shield(self._writer)
+
+    def stats(self) -> dict:
+        return {"pending": len(self._pending) + len(self._writing), "writes": self.writes, "failed": self.failed}
+
+    async def __write(self):
+        while self._pending:
+            self._writing, self._pending = self._pending, {}
+            items = list(self._writing.items())
+            try:
+                failed = await asyncio.to_thread(self.__put_many, items)
+            finally:
+                self._writing = {}
+            self.writes += len(items) - failed
+            self.failed += failed
+
+    def __put_many(self, items: list[tuple[str, dict]]) -> int:
+        """整批寫入；有資料驗證失敗時改爲逐筆寫入，只略過失敗的用戶。回傳失敗筆數"""
+        try:
+            self.store.put_many(items)
+            return 0
+        except Exception:
+            failed = 0
+            for user_id, data in items:
+                try:
+                    self.store.put(user_id, data)
+                except Exception:
+                    failed += 1
+                    linebot_logger.exception(f"[AsyncStateStore] failed to write state of {user_id}")
+            return failed
+
+
+def load_user_state_validator() -> Callable[[dict], None]:
+    """編譯 user_states_schema.json，回傳驗證函式"""
+    schema_path = Path.cwd() / "app" / "schemas" / "user_states_schema.json"
+    return template_registry.get_validator(schema_path).validate
+
+
+def create_state_store(backend: str, db_path: str) -> StateStore:
+    validator = load_user_state_validator()
+    if backend == "memory":
+        return MemoryStateStore(validator)
+    if backend == "sqlite":
+        return SQLiteStateStore(db_path, validator)
+    raise ValueError(f"Unknown state store backend: {backend}")
+
+
+def migrate_json_files(data_dir: Path, store: StateStore, remove: bool = False) -> int:
+    """
+    將 user_state_{id}.json 匯入 store，所有資料在同一個 transaction 寫入
+
+    Returns:
+        匯入的用戶數
+    """
+    json_schema_path = Path.cwd() / "app" / "schemas" / "user_states_schema.json"
+    items = []
+    migrated_paths = []
+    for path in sorted(Path(data_dir).glob("user_state_*.json")):
+        try:
+            data = JsonTool(path, json_schema_path).read_file()
+        except Exception as e:
+            linebot_logger.warning(f"[migrate] skip {path}: {e}")
+            continue
+        user_id = data.get("user_id") or path.stem.removeprefix("user_state_")
+        items.append((user_id, data))
+        migrated_paths.append(path)
+
+    store.put_many(items)
+    if remove:
+        for path in migrated_paths:
+            path.unlink()
+    return len(items)
+
+
+state_store = create_state_store(UserState.backend, UserState.db_path)
+async_state_store = AsyncStateStore(state_store)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import user_state_*.json files into the SQLite state store.")
+    parser.add_argument("--data-dir", default="app/data", help="json 檔案所在目錄")
+    parser.add_argument("--db", default=UserState.db_path, help="SQLite 檔案路徑")
+    parser.add_argument("--remove", action="store_true", help="匯入後刪除 json 檔案")
+    args = parser.parse_args()
+
+    store = SQLiteStateStore(args.db, load_user_state_validator())
+    count = migrate_json_files(Path(args.data_dir), store, remove=args.remove)
+    store.close()
+    print(f"Imported {count} user states into {args.db}")
+
+
+if __name__ == "__main__":
+    main()
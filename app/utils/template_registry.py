@@ -0,0 +1,139 @@
+"""
+json 模板及 schema 快取
+
+回應訊息模板（reply_message.json）、quick reply 模板（quick_reply.json）只在啟動時讀取並驗證一次，
+之後依檔案 mtime 判斷是否需要重新載入；schema 編譯後的 validator 也會被快取。
+"""
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Union
+
+import jsonschema
+
+from app.utils.logger import linebot_logger
+
+
+def freeze(data: Any) -> Any:
+    """dict 轉爲唯讀的 MappingProxyType，list 轉爲 tuple"""
+    if isinstance(data, dict):
+        return MappingProxyType({key: freeze(value) for key, value in data.items()})
+    if isinstance(data, (list, tuple)):
+        return tuple(freeze(item) for item in data)
+    return data
+
+
+def thaw(data: Any) -> Any:
+    """freeze 的反向操作，回傳可修改的副本"""
+    if isinstance(data, MappingProxyType):
+        return {key: thaw(value) for key, value in data.items()}
+    if isinstance(data, tuple):
+        return [thaw(item) for item in data]
+    return data
+
+
+@dataclass
+class _Template:
+    data_path: Path
+    schema_path: Path
+    data: Any = None
+    mtime_ns: int = None
+    checked_at: float = 0.0
+
+
+class TemplateRegistry:
+    """
+    - register()：登記模板並立即載入、驗證
+    - get()：回傳唯讀的模板，檔案有變動時自動重新載入
+    - copy()：回傳可修改的副本，適合需要填入資料的模板（例如 quick reply）
+    - get_validator()：取得已編譯的 schema validator
+
+    check_interval: 兩次檢查 mtime 之間最少間隔的秒數
+    """
+    def __init__(self, check_interval: float = 1.0):
+        self.check_interval = check_interval
+        self._templates: dict[str, _Template] = {}
+        self._validators: dict[Path, tuple[int, Any]] = {}  # schema_path -> (mtime_ns, validator)
+        self._lock = threading.RLock()
+
+    def register(self, name: str, data_path: Union[str, Path], schema_path: Union[str, Path]):
+        with self._lock:
+            self._templates[name] = _Template(Path(data_path), Path(schema_path))
+        try:
+            self.get(name)
+        except FileNotFoundError:
+            # 部署時才會放入模板，等第一次使用再載入
+            linebot_logger.warning(f"[TemplateRegistry] {data_path} not found, will retry on first use.")
+
+    def get(self, name: str) -> Any:
+        with self._lock:
+            template = self._templates[name]
+            now = time.monotonic()
+            if template.data is None or now - template.checked_at >= self.check_interval:
+                template.checked_at = now
+                try:
+                    mtime_ns = os.stat(template.data_path).st_mtime_ns
+                except FileNotFoundError:
+                    if template.data is None:
+                        raise
+                    return template.data
+                if mtime_ns != template.mtime_ns:
+                    self.__load(name, template, mtime_ns)
+            return template.data
+
+    def copy(self, name: str, key: str = None) -> Any:
+        data = self.get(name)
+        if key is not None:
+            data = data.get(key)
+        return thaw(data)
+
+    def get_validator(self, schema_path: Union[str, Path]):
+        """讀取並編譯 schema，schema 檔案有變動才重新編譯"""
+        schema_path = Path(schema_path)
+        with self._lock:
+            mtime_ns = os.stat(schema_path).st_mtime_ns
+            cached = self._validators.get(schema_path)
+            if cached is not None and cached[0] == mtime_ns:
+                return cached[1]
+
+            with open(schema_path, "r", encoding="utf-8") as f:
+                schema = json.load(f)
+            validator_cls = jsonschema.validators.validator_for(schema)
+            validator_cls.check_schema(schema)
+            validator = validator_cls(schema)
+            self._validators[schema_path] = (mtime_ns, validator)
+            return validator
+
+    def __load(self, name: str, template: _Template, mtime_ns: int):
+        try:
+            with open(template.data_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self.get_validator(template.schema_path).validate(data)
+        except (json.JSONDecodeError, jsonschema.exceptions.ValidationError) as e:
+            if template.data is None:
+                raise
+            # 重新載入失敗時沿用舊的模板
+            linebot_logger.error(f"[TemplateRegistry] reload {name} failed, keep previous version: {e}")
+            template.mtime_ns = mtime_ns
+            return
+
+        template.data = freeze(data)
+        template.mtime_ns = mtime_ns
+        linebot_logger.info(f"[TemplateRegistry] loaded {name} from {template.data_path}")
+
+
+template_registry = TemplateRegistry()
+template_registry.register(
+    "reply_message",
+    Path.cwd() / "app" / "data" / "reply_message.json",
+    Path.cwd() / "app" / "schemas" / "reply_message_schema.json",
+)
+template_registry.register(
+    "quick_reply",
+    Path.cwd() / "app" / "data" / "quick_reply.json",
+    Path.cwd() / "app" / "schemas" / "quick_reply.json",
+)
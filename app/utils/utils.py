@@ -3,6 +3,7 @@ import jsonschema
 from pathlib import Path
 from typing import Union
 from app.utils.logger import linebot_logger
+from app.utils.template_registry import template_registry
 
 class PathTool:
     @staticmethod
@@ -56,13 +57,12 @@ class JsonTool:
             raise f"JSON schema validation error: {e.message}"
     
     def __validate_json(self, data: dict):
-        # 加载 JSON schema 文件
+        # 使用快取的 validator，schema 只在變動時重新編譯
         try:
-            with open(self.schema_path, 'r', encoding='utf-8') as schema_file:
-                schema = json.load(schema_file)
+            validator = template_registry.get_validator(self.schema_path)
 
             # 使用 jsonschema 验证数据
-            jsonschema.validate(instance=data, schema=schema)
+            validator.validate(data)
 
         except json.JSONDecodeError:
             linebot_logger.error("Schema file is not valid JSON.")
@@ -0,0 +1,151 @@
+"""
+量測事件派送的純查表開銷：if/elif 階梯（舊版寫法）與 DISPATCH / TRANSITIONS 查表的比較。
+
+產生 --events 個隨機事件（狀態、事件類型、postback 動作），只選出 handler 並計算下一個狀態，
+不呼叫 handler、不讀寫用戶狀態。舊版寫法在此重現其判斷順序，回傳相同的 handler。
+
+Usage:
+- Run from the root directory.
+- `python -m benchmarks.event_dispatch --events 100000`
+"""
+
+import argparse
+import random
+import time
+
+from app.services.linebot.event_services import DISPATCH, EventKind, resolve
+from app.services.linebot.msg_services import TRANSITIONS, Action, Status
+
+
+def ladder_message(status: Status, kind: EventKind):
+    """舊版 text/sticker/image handler 的 if/elif 階梯"""
+    if status == Status.NONE:
+        return DISPATCH[(Status.NONE, kind, None)]
+    elif status == Status.PHOTO_CAPTIONING:
+        return DISPATCH[(Status.PHOTO_CAPTIONING, kind, None)]
+    elif status == Status.USER_ACTIONING:
+        return DISPATCH[(Status.USER_ACTIONING, kind, None)]
+    elif status == Status.STORY_GENERATING:
+        return DISPATCH[(Status.STORY_GENERATING, kind, None)]
+    elif status == Status.STORY_PREVIEW:
+        return DISPATCH[(Status.STORY_PREVIEW, kind, None)]
+    elif status == Status.AUDIO_GENERATING:
+        return DISPATCH[(Status.AUDIO_GENERATING, kind, None)]
+    elif status == Status.CAPTION_MODIFYING:
+        return DISPATCH[(Status.CAPTION_MODIFYING, kind, None)]
+    elif status == Status.STORY_MODIFYING:
+        return DISPATCH[(Status.STORY_MODIFYING, kind, None)]
+    elif status == Status.STORY_USER_PRODUCING:
+        return DISPATCH[(Status.STORY_USER_PRODUCING, kind, None)]
+
+
+def ladder_postback(status: Status, action: Action):
+    if status == Status.USER_ACTIONING:
+        if action == Action.TYPE_COMFIRM:
+            return DISPATCH[(status, EventKind.POSTBACK, action)]
+        elif action == Action.MODIFY_REQUEST:
+            return DISPATCH[(status, EventKind.POSTBACK, action)]
+        elif action == Action.STORY_CLOSED:
+            return DISPATCH[(status, EventKind.POSTBACK, action)]
+    elif status == Status.STORY_PREVIEW:
+        if action == Action.STORY_EXTEND:
+            return DISPATCH[(status, EventKind.POSTBACK, action)]
+        elif action == Action.MODIFY_REQUEST:
+            return DISPATCH[(status, EventKind.POSTBACK, action)]
+        elif action == Action.USER_PRODUCE_REQUEST:
+            return DISPATCH[(status, EventKind.POSTBACK, action)]
+        elif action == Action.STORY_CLOSED:
+            return DISPATCH[(status, EventKind.POSTBACK, action)]
+    return None
+
+
+def ladder_transition(status: Status, action: Action) -> Status:
+    """舊版 User.__change_state"""
+    if status == Status.NONE:
+        if action == Action.PHOTO_RECEIVED:
+            return Status.PHOTO_CAPTIONING
+    if status == Status.PHOTO_CAPTIONING:
+        if action == Action.GENERATED:
+            return Status.USER_ACTIONING
+    if status == Status.CAPTION_MODIFYING:
+        if action == Action.MODIFYED:
+            return Status.USER_ACTIONING
+    if status == Status.USER_ACTIONING:
+        if action == Action.TYPE_COMFIRM:
+            return Status.STORY_GENERATING
+        if action == Action.MODIFY_REQUEST:
+            return Status.CAPTION_MODIFYING
+        if action == Action.STORY_CLOSED:
+            return Status.AUDIO_GENERATING
+    if status == Status.STORY_GENERATING:
+        if action == Action.GENERATED:
+            return Status.STORY_PREVIEW
+    if status == Status.STORY_PREVIEW:
+        if action == Action.STORY_EXTEND:
+            return Status.STORY_GENERATING
+        if action == Action.USER_PRODUCE_REQUEST:
+            return Status.STORY_USER_PRODUCING
+        if action == Action.MODIFY_REQUEST:
+            return Status.STORY_MODIFYING
+        if action == Action.STORY_CLOSED:
+            return Status.AUDIO_GENERATING
+    if status == Status.STORY_MODIFYING:
+        if action == Action.MODIFYED:
+            return Status.STORY_PREVIEW
+    if status == Status.STORY_USER_PRODUCING:
+        if action == Action.USER_PRODUCED:
+            return Status.STORY_PREVIEW
+    if status == Status.AUDIO_GENERATING:
+        if action == Action.GENERATED:
+            return Status.NONE
+    return status
+
+
+def ladder(status: Status, kind: EventKind, action: Action):
+    if kind == EventKind.POSTBACK:
+        return ladder_postback(status, action), ladder_transition(status, action)
+    return ladder_message(status, kind), status
+
+
+def table(status: Status, kind: EventKind, action: Action):
+    if kind == EventKind.POSTBACK:
+        return resolve(status, kind, action), TRANSITIONS.get((status, action), status)
+    return resolve(status, kind), status
+
+
+def make_events(count: int, seed: int) -> list[tuple[Status, EventKind, Action]]:
+    rng = random.Random(seed)
+    statuses, kinds, actions = list(Status), list(EventKind), list(Action)
+    return [
+        (rng.choice(statuses), kind, rng.choice(actions) if kind == EventKind.POSTBACK else None)
+        for kind in (rng.choice(kinds) for _ in range(count))
+    ]
+
+
+def measure(route, events, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for status, kind, action in events:
+            route(status, kind, action)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark state/event dispatch overhead.")
+    parser.add_argument("--events", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    events = make_events(args.events, seed=0)
+    assert all(ladder(*event) == table(*event) for event in events), "table disagrees with if/elif ladder"
+
+    baseline = measure(ladder, events, args.repeat)
+    lookup = measure(table, events, args.repeat)
+    print(f"if/elif ladder: {baseline * 1000:7.1f} ms ({baseline / args.events * 1e9:6.0f} ns/event)")
+    print(f"table lookup:   {lookup * 1000:7.1f} ms ({lookup / args.events * 1e9:6.0f} ns/event, {baseline / lookup:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
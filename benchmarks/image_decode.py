@@ -0,0 +1,97 @@
+"""
+比較舊的圖片讀取流程與記憶體內縮小解碼的耗時及峰值記憶體（RSS）。
+
+- disk：把下載的位元組寫入 app/downloads 後再 Image.open，並完整解碼（模型前處理時才會縮放）
+- draft：ImageHelper.decode 直接由記憶體解碼，JPEG 以 draft mode 縮小比例解碼
+
+以 --width x --height（預設 4000x3000，約 1200 萬像素）的合成 JPEG 量測。
+每種方式在獨立的子行程中執行，峰值 RSS 才不會互相影響。
+
+Usage:
+- Run from the root directory.
+- `python -m benchmarks.image_decode --runs 10`
+"""
+
+import argparse
+import io
+import multiprocessing
+import resource
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from PIL import Image, ImageDraw, ImageFilter
+
+from app.utils.image_utils import ImageHelper
+
+
+def make_photo(width: int, height: int) -> bytes:
+    """有漸層、雜訊及幾何形狀的合成照片，壓縮率接近手機照片"""
+    image = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    noise = Image.effect_noise((width, height), 40).convert("RGB")
+    image = Image.blend(image, noise, 0.3)
+    draw = ImageDraw.Draw(image)
+    for i in range(40):
+        x, y = (i * 97) % width, (i * 61) % height
+        draw.ellipse((x, y, x + width // 8, y + height // 8), fill=((i * 50) % 256, (i * 80) % 256, (i * 110) % 256))
+    image = image.filter(ImageFilter.GaussianBlur(1))
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+
+def peak_rss_mb() -> float:
+    # Linux 的 ru_maxrss 單位爲 KB，macOS 爲 bytes
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024**2 if sys.platform == "darwin" else rss / 1024
+
+
+def run(mode: str, data: bytes, runs: int, target_size: int) -> dict:
+    baseline = peak_rss_mb()
+    times = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = str(Path(tmp_dir) / "image.jpg")
+        for _ in range(runs):
+            start = time.perf_counter()
+            if mode == "disk":
+                # 與 ImageHelper.download_binary_stream 相同，省略其 print
+                with open(path, "wb") as f:
+                    f.write(data)
+                image = Image.open(path).convert("RGB")
+            else:
+                image = ImageHelper.decode(data, target_size)
+            times.append(time.perf_counter() - start)
+            size = image.size
+            del image
+    return {
+        "median_ms": statistics.median(times) * 1000,
+        "peak_rss_delta_mb": peak_rss_mb() - baseline,
+        "size": size,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark image decode time and peak RSS.")
+    parser.add_argument("--width", type=int, default=4000)
+    parser.add_argument("--height", type=int, default=3000)
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--target-size", type=int, default=384, help="draft mode 短邊至少保留的像素")
+    args = parser.parse_args()
+
+    data = make_photo(args.width, args.height)
+    print(f"input: {args.width}x{args.height} JPEG, {len(data) / 1024**2:.1f} MB")
+
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(1, maxtasksperchild=1) as pool:
+        for mode in ("disk", "draft"):
+            result = pool.apply(run, (mode, data, args.runs, args.target_size))
+            print(
+                f"{mode:>5}: median {result['median_ms']:.1f} ms, "
+                f"peak RSS +{result['peak_rss_delta_mb']:.1f} MB, decoded size {result['size']}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+量測推理滿載時 webhook 處理的 p99 延遲：推理在 web 行程內（local）與獨立推理行程（remote）的比較。
+
+以純 Python 迴圈模擬持有 GIL 的推理（--infer-ms 毫秒一次），--concurrency 個任務不斷送出推理請求；
+同時每 --interval 毫秒處理一次模擬的 webhook（驗證簽章、解析 JSON），記錄從排定時間到處理完成的延遲。
+- local：推理以 asyncio.to_thread 在同一行程執行，與 event loop 爭奪 GIL
+- remote：推理交給 InferenceServer 子行程，web 端只在執行緒中等待 IPC 回應
+
+Usage:
+- Run from the root directory.
+- `python -m benchmarks.inference_isolation --seconds 10 --concurrency 4 --infer-ms 200`
+"""
+
+import argparse
+import asyncio
+import base64
+import hashlib
+import hmac
+import json
+import multiprocessing
+import os
+import secrets
+import tempfile
+import time
+
+from app.models.inference_server import InferenceClient, InferenceServer
+from app.utils.metrics import Histogram
+
+SECRET = b"channel-secret"
+BODY = json.dumps({
+    "destination": "U" + "0" * 32,
+    "events": [{"type": "message", "message": {"type": "text", "text": "說一個故事" * 20}}] * 4,
+}).encode()
+
+
+class BusyModel:
+    """持有 GIL 的假模型"""
+    def is_loaded(self) -> bool:
+        return True
+
+    def run(self, ms: float) -> int:
+        deadline = time.perf_counter() + ms / 1000
+        count = 0
+        while time.perf_counter() < deadline:
+            count += sum(i * i for i in range(200))
+        return count
+
+
+def serve(address: str, authkey: bytes):
+    InferenceServer(address, authkey, {"busy": BusyModel()}).serve_forever()
+
+
+def handle_webhook(signature: str):
+    digest = hmac.new(SECRET, BODY, hashlib.sha256).digest()
+    if not hmac.compare_digest(base64.b64encode(digest).decode(), signature):
+        raise ValueError("invalid signature")
+    return json.loads(BODY)
+
+
+async def measure(model, args) -> tuple[Histogram, int]:
+    signature = base64.b64encode(hmac.new(SECRET, BODY, hashlib.sha256).digest()).decode()
+    latency = Histogram(window=1_000_000)
+    stop = time.perf_counter() + args.seconds
+    inferences = 0
+
+    async def saturate():
+        nonlocal inferences
+        while time.perf_counter() < stop:
+            await asyncio.to_thread(model.run, args.infer_ms)
+            inferences += 1
+
+    workers = [asyncio.create_task(saturate()) for _ in range(args.concurrency)]
+    scheduled = time.perf_counter()
+    while scheduled < stop:
+        scheduled += args.interval / 1000
+        await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+        handle_webhook(signature)
+        await asyncio.sleep(0)
+        latency.observe(time.perf_counter() - scheduled)
+    await asyncio.gather(*workers)
+    return latency, inferences
+
+
+def report(mode: str, latency: Histogram, inferences: int, seconds: float):
+    print(
+        f"{mode:>6}: webhook p50 {latency.percentile(50) * 1000:7.2f} ms, "
+        f"p99 {latency.percentile(99) * 1000:7.2f} ms, max {latency.max * 1000:7.2f} ms "
+        f"({latency.count} webhooks, {inferences / seconds:.1f} inferences/s)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare webhook latency with in-process vs. out-of-process inference.")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--concurrency", type=int, default=4, help="同時送出的推理請求數")
+    parser.add_argument("--infer-ms", type=float, default=200, help="每次推理持有 GIL 的毫秒數")
+    parser.add_argument("--interval", type=float, default=5, help="webhook 間隔毫秒數")
+    args = parser.parse_args()
+
+    report("local", *asyncio.run(measure(BusyModel(), args)), args.seconds)
+
+    address = os.path.join(tempfile.mkdtemp(), "inference.sock")
+    authkey = secrets.token_bytes(32)
+    server = multiprocessing.Process(target=serve, args=(address, authkey), daemon=True)
+    server.start()
+    client = InferenceClient(address, authkey, pool_size=args.concurrency)
+    for _ in range(50):
+        try:
+            client.call("busy", "is_loaded")
+            break
+        except OSError:
+            time.sleep(0.1)
+    try:
+        report("remote", *asyncio.run(measure(client.model("busy"), args)), args.seconds)
+    finally:
+        client.close()
+        server.terminate()
+        server.join()
+        if os.path.exists(address):
+            os.unlink(address)
+        os.rmdir(os.path.dirname(address))
+
+
+if __name__ == "__main__":
+    main()
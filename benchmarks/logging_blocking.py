@@ -0,0 +1,94 @@
+"""
+比較同步寫檔與 QueueHandler 模式下，記錄日誌時 event loop 被阻塞的時間。
+
+在 event loop 中連續記錄 --records 筆大型事件內容（模擬舊版把整個 event、user.__dict__ 寫進 INFO 日誌），
+同時用一個每毫秒喚醒的 task 量測 loop 延遲。
+
+Usage:
+- Run from the root directory.
+- `python -m benchmarks.logging_blocking --records 5000`
+"""
+
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+from pathlib import Path
+
+from app.utils.logger import setup_logger, _listener
+
+
+def fake_event(i: int) -> dict:
+    return {
+        "type": "message",
+        "webhook_event_id": f"01HXYZ{i:020d}",
+        "source": {"type": "user", "user_id": f"U{i:032x}"},
+        "message": {"type": "text", "id": str(i), "text": "我想聽一個關於小狗的故事" * 20},
+        "story_list": ["很久很久以前，" * 40] * 3,
+    }
+
+
+async def measure(logger, records: int) -> dict:
+    lags = []
+    stop = asyncio.Event()
+
+    async def ticker():
+        # 每毫秒喚醒一次，記錄實際延遲
+        while not stop.is_set():
+            expected = time.perf_counter() + 0.001
+            await asyncio.sleep(0.001)
+            lags.append(max(0.0, time.perf_counter() - expected))
+
+    ticker_task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.01)
+
+    call_times = []
+    for i in range(records):
+        start = time.perf_counter()
+        logger.info(f"[Text] {fake_event(i)}")
+        call_times.append(time.perf_counter() - start)
+        if i % 50 == 0:
+            await asyncio.sleep(0)
+
+    stop.set()
+    await ticker_task
+    call_times.sort()
+    return {
+        "blocked_total_ms": sum(call_times) * 1000,
+        "call_p50_us": statistics.median(call_times) * 1e6,
+        "call_p99_us": call_times[int(len(call_times) * 0.99) - 1] * 1e6,
+        "max_loop_lag_ms": max(lags, default=0) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark event-loop blocking caused by logging.")
+    parser.add_argument("--records", type=int, default=5000, help="記錄筆數")
+    parser.add_argument("--fmt", default="text", choices=["text", "json"])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for mode in ("sync", "queue"):
+            logger = setup_logger(
+                f"bench_{mode}",
+                str(Path(tmp_dir) / f"{mode}.log"),
+                mode=mode,
+                fmt=args.fmt,
+                rate_limit=0,
+                console=False,
+            )
+            result = asyncio.run(measure(logger, args.records))
+            if mode == "queue":
+                # 等待背景執行緒寫完，避免暫存目錄被提前刪除
+                _listener.stop()
+                _listener.start()
+            print(
+                f"{mode:>5}: blocked {result['blocked_total_ms']:.1f} ms total, "
+                f"call p50 {result['call_p50_us']:.1f} us, p99 {result['call_p99_us']:.1f} us, "
+                f"max loop lag {result['max_loop_lag_ms']:.2f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
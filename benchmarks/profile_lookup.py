@@ -0,0 +1,92 @@
+"""
+比較同步 get_profile 與 ProfileCache 在 event loop 中的處理時間。
+
+啟動一個本地的假 LINE API（每次查詢延遲 --latency 秒），模擬 --events 個同時到達的事件，
+分別以舊的同步 MessagingApi 及新的 ProfileCache（AsyncMessagingApi）查詢用戶名稱。
+
+Usage:
+- Run from the root directory.
+- `python -m benchmarks.profile_lookup --events 200 --users 20 --latency 0.05`
+"""
+
+import argparse
+import asyncio
+import random
+import threading
+import time
+
+from aiohttp import web
+from linebot.v3.messaging import (
+    ApiClient,
+    AsyncApiClient,
+    AsyncMessagingApi,
+    Configuration,
+    MessagingApi,
+)
+
+from app.services.linebot.profile_cache import ProfileCache
+
+
+def start_fake_line_api(port: int, latency: float) -> threading.Thread:
+    async def get_profile(request: web.Request):
+        await asyncio.sleep(latency)
+        user_id = request.match_info["user_id"]
+        return web.json_response({"userId": user_id, "displayName": f"user-{user_id}"})
+
+    def serve():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        app = web.Application()
+        app.router.add_get("/v2/bot/profile/{user_id}", get_profile)
+        runner = web.AppRunner(app)
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", port).start())
+        loop.run_forever()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    time.sleep(0.5)
+    return thread
+
+
+async def bench_sync(configuration: Configuration, user_ids: list[str]) -> float:
+    async def handle_event(user_id: str):
+        # 舊做法：每個事件都在 event loop 裏同步查詢
+        with ApiClient(configuration) as api_client:
+            MessagingApi(api_client).get_profile(user_id)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(handle_event(user_id) for user_id in user_ids))
+    return time.perf_counter() - start
+
+
+async def bench_cache(configuration: Configuration, user_ids: list[str]) -> tuple[float, dict]:
+    async with AsyncApiClient(configuration) as api_client:
+        cache = ProfileCache(AsyncMessagingApi(api_client))
+        start = time.perf_counter()
+        await asyncio.gather(*(cache.get_display_name(user_id) for user_id in user_ids))
+        return time.perf_counter() - start, cache.stats()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark LINE profile lookups.")
+    parser.add_argument("--events", type=int, default=200, help="同時到達的事件數")
+    parser.add_argument("--users", type=int, default=20, help="不同用戶數")
+    parser.add_argument("--latency", type=float, default=0.05, help="假 API 每次查詢延遲（秒）")
+    parser.add_argument("--port", type=int, default=18080)
+    args = parser.parse_args()
+
+    start_fake_line_api(args.port, args.latency)
+    configuration = Configuration(host=f"http://127.0.0.1:{args.port}", access_token="fake-token")
+    user_ids = [f"U{random.randrange(args.users):04d}" for _ in range(args.events)]
+
+    sync_seconds = asyncio.run(bench_sync(configuration, user_ids))
+    cache_seconds, stats = asyncio.run(bench_cache(configuration, user_ids))
+
+    print(f"events={args.events} users={args.users} latency={args.latency}s")
+    print(f"sync MessagingApi : {sync_seconds:.3f}s ({args.events / sync_seconds:.1f} events/s)")
+    print(f"ProfileCache      : {cache_seconds:.3f}s ({args.events / cache_seconds:.1f} events/s) {stats}")
+
+
+if __name__ == "__main__":
+    main()
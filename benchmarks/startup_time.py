@@ -0,0 +1,78 @@
+"""
+量測 import app.main 的啟動時間，整理 `python -X importtime` 的結果。
+
+在子行程中以 -X importtime 匯入 --module，列出：
+- 總耗時（wall time）及 importtime 統計的累計時間
+- 累計耗時最久的頂層套件、自身耗時最久的模組
+- torch、transformers 等重型套件是否在啟動時就被匯入（模型應延遲到第一次使用才匯入）
+
+Usage:
+- Run from the root directory.
+- `python -m benchmarks.startup_time --top 15`
+- `python -m benchmarks.startup_time --module app.services.linebot.msg_services`
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+HEAVY_PACKAGES = ("torch", "transformers", "diffusers", "accelerate", "bitsandbytes", "MeloTTS", "melo", "nltk", "librosa")
+
+_LINE = re.compile(r"^import time:\s+(?P<self>\d+)\s+\|\s+(?P<cumulative>\d+)\s+\|\s(?P<indent>\s*)(?P<name>\S+)$")
+
+
+def import_times(module: str) -> tuple[float, list[tuple[str, int, int, int]]]:
+    """回傳 (wall 秒數, [(模組, 自身 us, 累計 us, 巢狀深度)])"""
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env=env,
+    )
+    wall = time.perf_counter() - start
+    if result.returncode != 0:
+        tail = "\n".join(result.stderr.splitlines()[-10:])
+        raise SystemExit(f"import {module} failed:\n{tail}")
+
+    records = []
+    for line in result.stderr.splitlines():
+        if match := _LINE.match(line):
+            depth = len(match["indent"]) // 2
+            records.append((match["name"], int(match["self"]), int(match["cumulative"]), depth))
+    return wall, records
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarise `python -X importtime` for the app entry point.")
+    parser.add_argument("--module", default="app.main")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    wall, records = import_times(args.module)
+    # 頂層（深度 0）的累計時間加總即爲整體 import 時間
+    total_us = sum(cumulative for _, _, cumulative, depth in records if depth == 0)
+    print(f"import {args.module}: wall {wall:.2f}s, importtime {total_us / 1e6:.2f}s, {len(records)} modules")
+
+    by_package: dict[str, int] = defaultdict(int)
+    for name, self_us, _, _ in records:
+        by_package[name.split(".")[0]] += self_us
+    print(f"\ntop {args.top} packages by self time:")
+    for package, self_us in sorted(by_package.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {self_us / 1000:9.1f} ms  {package}")
+
+    print(f"\ntop {args.top} modules by cumulative time:")
+    for name, _, cumulative, depth in sorted(records, key=lambda record: -record[2])[:args.top]:
+        print(f"  {cumulative / 1000:9.1f} ms  {'  ' * depth}{name}")
+
+    imported = sorted({name.split(".")[0] for name, *_ in records} & set(HEAVY_PACKAGES))
+    print(f"\nheavy packages imported at startup: {', '.join(imported) if imported else 'none'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+比較逐句翻譯與批次翻譯（padding 後一次 generate）在 CPU 上的吞吐量。
+
+以數種 BLIP 常見的描述句型組合出 --captions 筆不重複的英文句子，關閉 LRU 快取後分別量測：
+- single：每句呼叫一次 translate_to_zh
+- batch：translate_batch，每 --batch-size 句一次 generate
+最後再以含重複句子的輸入量測快取命中後的效果。
+
+Usage:
+- Run from the root directory.
+- `python -m benchmarks.translation_throughput --captions 64 --batch-size 16`
+"""
+
+import argparse
+import random
+import time
+
+import torch
+
+from app.models.translator import Translator
+
+SUBJECTS = ["a dog", "a cat", "a little girl", "a man", "two children", "a bird", "a woman", "a teddy bear"]
+ACTIONS = ["sitting on", "lying on", "standing next to", "playing with", "looking at", "running across"]
+OBJECTS = ["a couch", "the grass", "a wooden table", "a red ball", "the beach", "a snowy street", "a bed"]
+
+
+def make_captions(count: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    captions = set()
+    while len(captions) < count:
+        captions.add(f"{rng.choice(SUBJECTS)} {rng.choice(ACTIONS)} {rng.choice(OBJECTS)}")
+    return sorted(captions)
+
+
+def timed(func, *args) -> float:
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark single vs batched caption translation on CPU.")
+    parser.add_argument("--captions", type=int, default=64, help="不重複的句子數")
+    parser.add_argument("--batch-size", type=int, default=16, help="每次 generate 的句數")
+    parser.add_argument("--threads", type=int, default=0, help="torch 執行緒數，0 爲預設")
+    args = parser.parse_args()
+
+    if args.threads:
+        torch.set_num_threads(args.threads)
+
+    captions = make_captions(args.captions)
+    translator = Translator(device="cpu", memo_size=0, batch_size=args.batch_size)
+    # 預先載入模型並暖機，不計入時間
+    translator.translate_batch(captions[:2])
+
+    single = timed(lambda: [translator.translate_to_zh(caption) for caption in captions])
+    batch = timed(translator.translate_batch, captions)
+    print(f"single: {single:.2f}s, {len(captions) / single:.1f} captions/s")
+    print(f" batch: {batch:.2f}s, {len(captions) / batch:.1f} captions/s (batch_size={args.batch_size}, {single / batch:.1f}x)")
+
+    # 重複的句子由 LRU 快取回傳
+    cached = Translator(device="cpu", memo_size=1024, batch_size=args.batch_size)
+    repeated = captions * 4
+    random.Random(1).shuffle(repeated)
+    cold = timed(cached.translate_batch, repeated)
+    warm = timed(cached.translate_batch, repeated)
+    stats = cached.stats()
+    print(
+        f"  memo: {len(repeated)} captions cold {cold:.2f}s, warm {warm * 1000:.1f}ms, "
+        f"hits {stats['memo_hits']}, misses {stats['memo_misses']}"
+    )
+
+
+if __name__ == "__main__":
+    main()
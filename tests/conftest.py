@@ -0,0 +1,15 @@
+"""
+測試共用設定
+
+app.config 在 import 時讀取環境變數（PORT 沒有預設值），須在 import app 之前設定。
+模型相關的測試以 pytest.importorskip 在缺少 torch / transformers 時略過。
+"""
+import os
+
+os.environ.setdefault("PORT", "8000")
+os.environ.setdefault("INFERENCE_MODE", "local")
+os.environ.setdefault("LINE_CHANNEL_SECRET", "test-channel-secret")
+os.environ.setdefault("LINE_CHANNEL_ACCESS_TOKEN", "test-access-token")
+# 測試不寫入 app/data 下的 SQLite，需要時各自在 tmp_path 建立
+os.environ.setdefault("STATE_STORE", "memory")
+os.environ.setdefault("EVENT_DEDUP_PERSIST", "false")
@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("dotenv")
+
+from app.services.admission import AdmissionController, StageLimit  # noqa: E402
+
+
+def test_rejects_when_stage_queue_is_full():
+    async def run():
+        admission = AdmissionController({"story": StageLimit(concurrency=1, queue_size=1, deadline=0)})
+        gate = asyncio.Event()
+
+        async def job():
+            await gate.wait()
+
+        accepted = [admission.submit("story", "job", job) for _ in range(3)]
+        await admission.start()
+        await asyncio.sleep(0.01)
+        # 第一個任務已在執行，佇列又空出一格
+        accepted.append(admission.submit("story", "job", job))
+        gate.set()
+        await admission.stop()
+        return accepted, admission.stats()["story"]
+
+    accepted, stats = asyncio.run(run())
+    assert accepted == [True, False, False, True]
+    assert stats["rejected"] == 2
+    assert stats["completed"] == 2
+
+
+def test_expired_jobs_call_on_expired():
+    async def run():
+        admission = AdmissionController({"audio": StageLimit(concurrency=1, queue_size=4, deadline=0.01)})
+        calls = []
+
+        async def job():
+            calls.append("run")
+
+        async def expired():
+            calls.append("busy")
+
+        admission.submit("audio", "job", job, on_expired=expired)
+        await asyncio.sleep(0.05)
+        await admission.start()
+        await admission.stop()
+        return calls, admission.stats()["audio"]["expired"]
+
+    assert asyncio.run(run()) == (["busy"], 1)
@@ -0,0 +1,61 @@
+import asyncio
+from types import SimpleNamespace
+
+from app.services.linebot.event_dedup import EventDeduplicator, SQLiteEventLog
+
+
+def event(event_id: str = None, redelivery: bool = False):
+    return SimpleNamespace(webhook_event_id=event_id, delivery_context=SimpleNamespace(is_redelivery=redelivery))
+
+
+def check(deduplicator: EventDeduplicator, *events) -> list[bool]:
+    async def run():
+        results = [await deduplicator.is_duplicate(e) for e in events]
+        await deduplicator.flush()
+        return results
+    return asyncio.run(run())
+
+
+def test_drops_repeated_event_ids():
+    deduplicator = EventDeduplicator()
+    assert check(deduplicator, event("a"), event("b"), event("a", redelivery=True), event("b")) == [False, False, True, True]
+    assert deduplicator.stats()["duplicates_dropped"] == 2
+    assert deduplicator.stats()["redeliveries"] == 1
+
+
+def test_events_without_id_are_never_dropped():
+    deduplicator = EventDeduplicator()
+    assert check(deduplicator, event(), event()) == [False, False]
+
+
+def test_forgets_oldest_beyond_max_size():
+    deduplicator = EventDeduplicator(max_size=2)
+    assert check(deduplicator, event("a"), event("b"), event("c"), event("a")) == [False, False, False, False]
+    assert deduplicator.stats()["tracked"] == 2
+
+
+def test_concurrent_copies_pass_once(tmp_path):
+    deduplicator = EventDeduplicator(persist=SQLiteEventLog(str(tmp_path / "events.db")))
+
+    async def run():
+        results = await asyncio.gather(*(deduplicator.is_duplicate(event("a", redelivery=True)) for _ in range(3)))
+        await deduplicator.flush()
+        return sorted(results)
+    assert asyncio.run(run()) == [False, True, True]
+
+
+def test_persisted_events_survive_restart(tmp_path):
+    db_path = str(tmp_path / "events.db")
+    check(EventDeduplicator(persist=SQLiteEventLog(db_path)), event("a"), event("b"))
+
+    restarted = EventDeduplicator(persist=SQLiteEventLog(db_path))
+    # 只有重送事件才查 SQLite
+    assert check(restarted, event("a", redelivery=True), event("b"), event("c", redelivery=True)) == [True, False, False]
+
+
+def test_prunes_expired_rows(tmp_path):
+    log = SQLiteEventLog(str(tmp_path / "events.db"), prune_every=2)
+    log.add_many([("old", 1.0)], expire_before=0)
+    log.add_many([("new", 100.0)], expire_before=50)
+    assert not log.contains("old", since=0)
+    assert log.contains("new", since=0)
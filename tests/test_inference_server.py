@@ -0,0 +1,123 @@
+import asyncio
+import secrets
+import threading
+import time
+from multiprocessing.connection import AuthenticationError
+
+import pytest
+
+pytest.importorskip("dotenv")
+
+from app.models.inference_server import (  # noqa: E402
+    InferenceClient,
+    InferenceServer,
+    SharedBuffer,
+    _pack,
+    _unpack,
+    check_authkey,
+    parse_address,
+)
+from app.models.singletons import LazyModel  # noqa: E402
+
+
+class EchoModel:
+    def __init__(self):
+        self.ended = []
+
+    def echo(self, *args, **kwargs):
+        return args, kwargs
+
+    def fail(self):
+        raise KeyError("missing")
+
+    def end_session(self, key: str):
+        self.ended.append(key)
+        return True
+
+    async def stream_words(self, text: str):
+        for word in text.split():
+            yield word
+
+
+def test_parse_address():
+    assert parse_address("127.0.0.1:6100") == ("127.0.0.1", 6100)
+    assert parse_address("app/data/inference.sock") == "app/data/inference.sock"
+
+
+@pytest.mark.parametrize("authkey", [b"", None, b"storylens"])
+def test_rejects_missing_or_short_authkey(authkey):
+    with pytest.raises(ValueError):
+        check_authkey(authkey)
+    with pytest.raises(ValueError):
+        InferenceClient("unused.sock", authkey)
+
+
+def test_large_buffers_go_through_shared_memory():
+    payload = {"audio": secrets.token_bytes(256 * 1024), "text": "短句", "items": [b"small"]}
+    packed = _pack(payload)
+    assert isinstance(packed["audio"], SharedBuffer)
+    assert packed["items"] == [b"small"]
+    assert _unpack(packed) == payload
+
+
+@pytest.fixture(scope="module")
+def remote(tmp_path_factory):
+    address = str(tmp_path_factory.mktemp("ipc") / "inference.sock")
+    authkey = secrets.token_bytes(32)
+    lazy = LazyModel("lazy", f"{__name__}:EchoModel")
+    model = EchoModel()
+    server = InferenceServer(address, authkey, {"echo": model, "lazy": lazy})
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = InferenceClient(address, authkey)
+    for _ in range(50):
+        try:
+            client.call("server", "stats")
+            break
+        except OSError:
+            time.sleep(0.05)
+    yield client, model, lazy
+    client.close()
+
+
+def test_call_round_trip(remote):
+    client, _, _ = remote
+    assert client.model("echo").echo(1, "二", key=b"x") == ((1, "二"), {"key": b"x"})
+
+
+def test_remote_exception_is_reraised(remote):
+    client, _, _ = remote
+    with pytest.raises(KeyError):
+        client.model("echo").fail()
+
+
+def test_private_attributes_are_rejected(remote):
+    client, _, _ = remote
+    with pytest.raises(AttributeError):
+        client.call("echo", "__class__")
+    with pytest.raises(AttributeError):
+        client.call("server", "serve_forever")
+
+
+def test_stream(remote):
+    client, _, _ = remote
+
+    async def collect():
+        return [word async for word in client.model("echo").stream_words("從前 有 一隻 貓")]
+    assert asyncio.run(collect()) == ["從前", "有", "一隻", "貓"]
+    # 串流結束後連線可繼續使用
+    assert client.model("echo").echo() == ((), {})
+
+
+def test_call_if_loaded_does_not_construct(remote):
+    client, _, lazy = remote
+    assert client.model("lazy").call_if_loaded("end_session", "u1") is None
+    assert not lazy.is_loaded()
+    lazy.instance()
+    assert client.model("lazy").call_if_loaded("end_session", "u1") is True
+    assert lazy.ended == ["u1"]
+
+
+def test_wrong_authkey_is_rejected(remote):
+    client, _, _ = remote
+    with pytest.raises(AuthenticationError):
+        InferenceClient(client.address, secrets.token_bytes(32)).call("server", "stats")
@@ -0,0 +1,83 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services.job_queue import Job, JobQueue
+
+
+def test_runs_jobs_with_worker_limit():
+    async def run():
+        queue = JobQueue(workers=2)
+        await queue.start()
+        running, peak, done = 0, 0, []
+
+        async def job(index: int):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.01)
+            running -= 1
+            done.append(index)
+
+        for index in range(6):
+            queue.submit("job", job, index)
+        await queue.stop()
+        return peak, sorted(done), queue.stats()
+
+    peak, done, stats = asyncio.run(run())
+    assert peak == 2
+    assert done == list(range(6))
+    assert stats["completed"] == 6
+
+
+def test_rejects_when_full():
+    async def run():
+        queue = JobQueue(workers=1, max_size=1)
+
+        async def job():
+            pass
+
+        queue.submit("job", job)
+        with pytest.raises(asyncio.QueueFull):
+            queue.submit("job", job)
+    asyncio.run(run())
+
+
+def test_failed_job_does_not_stop_worker():
+    async def run():
+        queue = JobQueue(workers=1)
+        await queue.start()
+
+        async def fail():
+            raise RuntimeError("boom")
+
+        async def ok():
+            pass
+
+        queue.submit("fail", fail)
+        queue.submit("ok", ok)
+        await queue.stop()
+        return queue.stats()
+
+    stats = asyncio.run(run())
+    assert (stats["failed"], stats["completed"]) == (1, 1)
+
+
+def test_expired_job_calls_on_expired_instead():
+    async def run():
+        queue = JobQueue(workers=1)
+        calls = []
+
+        async def job():
+            calls.append("run")
+
+        async def expired():
+            calls.append("expired")
+
+        queue.enqueue(Job("late", job, deadline=time.monotonic() - 1, on_expired=expired))
+        await queue.start()
+        await queue.stop()
+        return calls, queue.stats()["expired"]
+
+    assert asyncio.run(run()) == (["expired"], 1)
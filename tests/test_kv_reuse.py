@@ -0,0 +1,175 @@
+"""
+KV 重用的正確性：前綴快取、session 裁切（crop）及 continuous batching 的 left padding 合併，
+greedy 生成的 token 都須與直接呼叫 model.generate 完全相同。
+
+以隨機初始化的小型 LlamaForCausalLM 在 CPU 上執行。
+"""
+import threading
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+pytest.importorskip("accelerate")
+
+from app.models.chat_session import ChatSessionCache  # noqa: E402
+from app.models.prefix_cache import PrefixKVCache, kv_bytes  # noqa: E402
+from app.models.text_generation import ContinuousBatchScheduler, GenerationRequest, SamplingParams  # noqa: E402
+
+VOCAB_SIZE = 97
+NEW_TOKENS = 10
+
+
+@pytest.fixture(scope="module")
+def model():
+    torch.manual_seed(0)
+    config = transformers.LlamaConfig(
+        vocab_size=VOCAB_SIZE,
+        hidden_size=64,
+        intermediate_size=128,
+        num_hidden_layers=2,
+        num_attention_heads=4,
+        num_key_value_heads=2,
+        max_position_embeddings=256,
+        bos_token_id=None,
+        eos_token_id=None,
+        pad_token_id=None,
+    )
+    return transformers.LlamaForCausalLM(config).eval()
+
+
+@pytest.fixture
+def scheduler():
+    return ContinuousBatchScheduler(max_batch_size=4, timeout=60)
+
+
+def prompt(length: int, seed: int) -> list[int]:
+    generator = torch.Generator().manual_seed(seed)
+    return torch.randint(3, VOCAB_SIZE, (length,), generator=generator).tolist()
+
+
+def greedy(max_new_tokens: int = NEW_TOKENS) -> SamplingParams:
+    return SamplingParams(max_new_tokens=max_new_tokens, do_sample=False, eos_token_id=None)
+
+
+def reference(model, input_ids: list[int], max_new_tokens: int = NEW_TOKENS) -> list[int]:
+    ids = torch.tensor([input_ids])
+    with torch.no_grad():
+        output = model.generate(
+            input_ids=ids,
+            attention_mask=torch.ones_like(ids),
+            max_new_tokens=max_new_tokens,
+            do_sample=False,
+            pad_token_id=0,
+        )
+    return output[0, len(input_ids):].tolist()
+
+
+def test_scheduler_matches_generate(model, scheduler):
+    input_ids = prompt(20, seed=1)
+    assert scheduler.generate(model, input_ids, greedy()) == reference(model, input_ids)
+
+
+def test_prefix_cache_matches_generate(model, scheduler):
+    cache = PrefixKVCache(max_entries=2, min_prefix_tokens=4)
+    system = prompt(16, seed=2)
+    for seed in (3, 4):
+        input_ids = system + prompt(6, seed=seed)
+        past, reused = cache.prepare(model, input_ids, len(system))
+        assert reused == len(system)
+        assert scheduler.generate(model, input_ids, greedy(), past, reused) == reference(model, input_ids)
+    # 第二次命中快取；取出的是副本，生成追加的 KV 不會改變快取中的前綴
+    assert cache.stats()["hits"] == 1
+    assert cache.get(model, tuple(system)).get_seq_length() == len(system)
+
+
+def test_prefix_cache_evicts_by_bytes(model):
+    one_entry = kv_bytes(PrefixKVCache(min_prefix_tokens=4).get(model, tuple(prompt(16, seed=5))))
+    cache = PrefixKVCache(max_entries=8, max_bytes=one_entry * 2, min_prefix_tokens=4)
+    for seed in range(5, 9):
+        cache.get(model, tuple(prompt(16, seed=seed)))
+    assert cache.stats()["entries"] == 2
+    assert cache.evictions == 2
+    assert cache.bytes_used <= cache.max_bytes
+
+
+def run_session(model, scheduler, sessions: ChatSessionCache, key: str, input_ids: list[int]) -> tuple[list[int], int]:
+    past, reused = sessions.prepare(model, key, input_ids)
+    generated = scheduler.generate(
+        model, input_ids, greedy(), past, reused,
+        on_finish=lambda token_ids, kv: sessions.save(key, token_ids, kv),
+    )
+    return generated, reused
+
+
+def test_chat_session_reuse_matches_generate(model, scheduler):
+    sessions = ChatSessionCache(PrefixKVCache(max_entries=0), max_bytes=64 * 1024 ** 2)
+    first = prompt(18, seed=10)
+    generated, reused = run_session(model, scheduler, sessions, "user", first)
+    assert reused == 0
+    assert generated == reference(model, first)
+
+    # 延伸：上一次的 prompt + 生成結果 + 新指示，只需 prefill 新增的部分
+    extended = first + generated + prompt(5, seed=11)
+    generated, reused = run_session(model, scheduler, sessions, "user", extended)
+    assert reused == len(first) + NEW_TOKENS - 1
+    assert generated == reference(model, extended)
+
+    # 修改過故事：共同前綴變短，KV 裁切後仍須正確
+    modified = extended[:12] + [extended[12] % (VOCAB_SIZE - 3) + 3] + prompt(8, seed=12)
+    generated, reused = run_session(model, scheduler, sessions, "user", modified)
+    assert reused == 12
+    assert generated == reference(model, modified)
+    assert sessions.stats()["hits"] == 2
+
+
+def test_chat_session_evicts_by_bytes(model, scheduler):
+    sessions = ChatSessionCache(PrefixKVCache(max_entries=0), max_bytes=64 * 1024 ** 2)
+    run_session(model, scheduler, sessions, "a", prompt(20, seed=13))
+    one_session = sessions.bytes_used
+    sessions.max_bytes = one_session * 2
+    run_session(model, scheduler, sessions, "b", prompt(20, seed=14))
+    run_session(model, scheduler, sessions, "c", prompt(20, seed=15))
+    assert sessions.stats()["sessions"] == 2
+    assert sessions.evictions == 1
+    assert sessions.bytes_used <= sessions.max_bytes
+
+
+def hold_until(gate: threading.Event):
+    """第一個 token 時停住排程執行緒，讓另一個請求在下一個 token 邊界加入批次"""
+    def stop(generated: list[int]) -> bool:
+        gate.wait(10)
+        return False
+    return stop
+
+
+@pytest.mark.parametrize("lengths", [(24, 9), (9, 24)], ids=["shorter-joins", "longer-joins"])
+def test_batched_requests_match_generate(model, scheduler, lengths):
+    first_ids, second_ids = prompt(lengths[0], seed=20), prompt(lengths[1], seed=21)
+    gate = threading.Event()
+    first = GenerationRequest(model, first_ids, greedy(), stop=hold_until(gate))
+    second = GenerationRequest(model, second_ids, greedy())
+    scheduler.submit(first)
+    scheduler.submit(second)
+    gate.set()
+
+    assert first.future.result(timeout=60) == reference(model, first_ids)
+    assert second.future.result(timeout=60) == reference(model, second_ids)
+    # 兩個序列在同一批 decode，step 數少於逐一生成
+    assert scheduler.steps < 2 * (NEW_TOKENS - 1)
+
+
+def test_batch_failure_keeps_scheduler_alive(model, scheduler):
+    def explode(generated: list[int]) -> bool:
+        # 第一個 token 在 prefill 產生，第二個才在 decode step 中
+        if len(generated) >= 2:
+            raise RuntimeError("boom")
+        return False
+
+    failing = GenerationRequest(model, prompt(10, seed=30), greedy(), stop=explode)
+    with pytest.raises(RuntimeError):
+        scheduler.submit(failing).result(timeout=60)
+
+    input_ids = prompt(10, seed=31)
+    assert scheduler.generate(model, input_ids, greedy()) == reference(model, input_ids)
+    assert scheduler.stats()["failed"] == 1
@@ -0,0 +1,26 @@
+from app.utils.metrics import Histogram
+
+
+def test_buckets_are_cumulative():
+    histogram = Histogram(buckets=(0.1, 1, 10))
+    for value in (0.05, 0.1, 0.5, 2, 20, 30):
+        histogram.observe(value)
+    snapshot = histogram.snapshot()
+    assert snapshot["buckets"] == {"le_0.1": 2, "le_1": 3, "le_10": 4, "le_inf": 6}
+    assert snapshot["count"] == 6
+    assert snapshot["max"] == 30
+
+
+def test_percentiles_use_recent_window():
+    histogram = Histogram(window=3)
+    for value in (100, 1, 2, 3):
+        histogram.observe(value)
+    assert histogram.percentile(0) == 1
+    assert histogram.percentile(100) == 3
+    assert histogram.max == 100
+
+
+def test_empty_snapshot():
+    snapshot = Histogram(buckets=(1,)).snapshot()
+    assert snapshot["avg"] == 0.0
+    assert snapshot["buckets"] == {"le_1": 0, "le_inf": 0}
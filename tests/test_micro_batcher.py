@@ -0,0 +1,40 @@
+import threading
+
+import pytest
+
+from app.models.micro_batcher import MicroBatcher
+
+
+def test_batches_concurrent_requests_and_routes_results():
+    batches = []
+
+    def process(items: list) -> list:
+        batches.append(list(items))
+        return [item * 10 for item in items]
+
+    batcher = MicroBatcher("test", process, max_batch_size=4, max_wait=0.2)
+    futures = [batcher.submit(index) for index in range(6)]
+    assert [future.result(timeout=5) for future in futures] == [index * 10 for index in range(6)]
+    assert [len(batch) for batch in batches] == [4, 2]
+
+
+def test_batch_error_reaches_every_caller():
+    gate = threading.Event()
+
+    def process(items: list) -> list:
+        gate.wait(5)
+        raise ValueError("bad batch")
+
+    batcher = MicroBatcher("test", process, max_batch_size=2, max_wait=0.2)
+    futures = [batcher.submit(index) for index in range(2)]
+    gate.set()
+    for future in futures:
+        with pytest.raises(ValueError):
+            future.result(timeout=5)
+    assert batcher.stats()["failed"] == 1
+
+
+def test_wrong_result_count_is_an_error():
+    batcher = MicroBatcher("test", lambda items: [], max_batch_size=1)
+    with pytest.raises(RuntimeError):
+        batcher.submit(1).result(timeout=5)
@@ -0,0 +1,31 @@
+import pytest
+
+pytest.importorskip("dotenv")
+pytest.importorskip("linebot")
+
+from app.services.linebot.event_services import DISPATCH, EventKind, resolve, validate_dispatch  # noqa: E402
+from app.services.linebot.msg_services import TRANSITIONS, Action, Status, validate_transitions  # noqa: E402
+
+
+def test_tables_are_valid():
+    validate_transitions(TRANSITIONS)
+    validate_dispatch(DISPATCH)
+
+
+def test_transition_without_exit_is_rejected():
+    transitions = {key: target for key, target in TRANSITIONS.items() if key[0] != Status.STORY_MODIFYING}
+    with pytest.raises(ValueError):
+        validate_transitions(transitions)
+
+
+def test_postback_must_be_a_valid_transition():
+    dispatch = dict(DISPATCH)
+    dispatch[(Status.NONE, EventKind.POSTBACK, Action.STORY_CLOSED)] = resolve(Status.NONE, EventKind.TEXT)
+    with pytest.raises(ValueError):
+        validate_dispatch(dispatch)
+
+
+def test_every_state_handles_messages():
+    for status in Status:
+        for kind in (EventKind.TEXT, EventKind.STICKER, EventKind.IMAGE):
+            assert resolve(status, kind) is not None
@@ -0,0 +1,82 @@
+import asyncio
+
+import pytest
+
+pytest.importorskip("dotenv")
+pytest.importorskip("jsonschema")
+
+from app.utils.state_store import AsyncStateStore, MemoryStateStore, SQLiteStateStore  # noqa: E402
+
+
+def reject_missing_status(data: dict):
+    if "current_status" not in data:
+        raise ValueError("current_status is required")
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "memory":
+        yield MemoryStateStore(reject_missing_status)
+    else:
+        store = SQLiteStateStore(str(tmp_path / "states.db"), reject_missing_status)
+        yield store
+        store.close()
+
+
+def test_put_get_delete(store):
+    assert store.get("a") is None
+    store.put("a", {"current_status": "none", "story_list": ["從前"]})
+    store.put("a", {"current_status": "story_preview", "story_list": ["從前", "後來"]})
+    assert store.get("a") == {"current_status": "story_preview", "story_list": ["從前", "後來"]}
+    store.delete("a")
+    assert store.get("a") is None
+
+
+def test_returned_state_is_a_copy(store):
+    store.put("a", {"current_status": "none", "story_list": []})
+    store.get("a")["story_list"].append("x")
+    assert store.get("a")["story_list"] == []
+
+
+def test_invalid_batch_writes_nothing(store):
+    with pytest.raises(ValueError):
+        store.put_many([("a", {"current_status": "none"}), ("b", {})])
+    assert store.get("a") is None
+
+
+def test_sqlite_state_survives_reopen(tmp_path):
+    path = str(tmp_path / "states.db")
+    SQLiteStateStore(path).put("a", {"current_status": "none"})
+    assert SQLiteStateStore(path).get("a") == {"current_status": "none"}
+
+
+def test_async_facade_reads_own_writes_and_coalesces(tmp_path):
+    store = SQLiteStateStore(str(tmp_path / "states.db"), reject_missing_status)
+    facade = AsyncStateStore(store)
+
+    async def run():
+        facade.put("a", {"current_status": "none"})
+        facade.put("a", {"current_status": "photo_captioning"})
+        # 尚未寫入 SQLite 也讀得到最新狀態
+        assert await facade.get("a") == {"current_status": "photo_captioning"}
+        await facade.flush()
+        assert await facade.get("a") == {"current_status": "photo_captioning"}
+
+    asyncio.run(run())
+    assert store.get("a") == {"current_status": "photo_captioning"}
+    assert facade.stats() == {"pending": 0, "writes": 1, "failed": 0}
+
+
+def test_async_facade_skips_only_invalid_states(tmp_path):
+    store = SQLiteStateStore(str(tmp_path / "states.db"), reject_missing_status)
+    facade = AsyncStateStore(store)
+
+    async def run():
+        facade.put("a", {"current_status": "none"})
+        facade.put("b", {})
+        await facade.flush()
+
+    asyncio.run(run())
+    assert store.get("a") == {"current_status": "none"}
+    assert store.get("b") is None
+    assert facade.stats()["failed"] == 1
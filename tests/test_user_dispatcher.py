@@ -0,0 +1,52 @@
+import asyncio
+
+from app.services.linebot.user_dispatcher import UserEventDispatcher
+
+
+def test_same_user_in_order_different_users_concurrent():
+    async def run():
+        dispatcher = UserEventDispatcher(max_concurrency=4)
+        log, active = [], set()
+        overlapped = False
+
+        async def handle(user: str, index: int):
+            nonlocal overlapped
+            if user in active:
+                overlapped = True
+            active.add(user)
+            log.append((user, index, "start"))
+            await asyncio.sleep(0.01)
+            active.discard(user)
+
+        for index in range(3):
+            for user in ("a", "b"):
+                dispatcher.submit(user, handle, user, index)
+        await dispatcher.drain()
+        return log, overlapped
+
+    log, overlapped = asyncio.run(run())
+    assert not overlapped
+    assert [index for user, index, _ in log if user == "a"] == [0, 1, 2]
+    # 不同用戶並行：b 的第一個事件不必等 a 全部完成
+    assert log.index(("b", 0, "start")) < log.index(("a", 1, "start"))
+
+
+def test_failure_does_not_block_later_events():
+    async def run():
+        dispatcher = UserEventDispatcher()
+        done = []
+
+        async def fail():
+            raise RuntimeError("boom")
+
+        async def ok():
+            done.append(True)
+
+        dispatcher.submit("a", fail)
+        dispatcher.submit("a", ok)
+        await dispatcher.drain()
+        return done, dispatcher.stats()
+
+    done, stats = asyncio.run(run())
+    assert done == [True]
+    assert (stats["failed"], stats["dispatched"], stats["active_users"]) == (1, 1, 0)